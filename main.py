@@ -5,6 +5,7 @@ import glob
 import json
 from pathlib import Path
 
+from modules.batch import group_identical_inputs, iter_batch_results
 from modules.processor import NonStandardAminoAcidProcessor
 from modules.run_antechamber import run_antechamber_for_all
 
@@ -50,11 +51,52 @@ def build_arg_parser() -> argparse.ArgumentParser:
     parser.add_argument("--sidechain", "-sc", choices=["gaff", "gaff2"], default="gaff2")
     parser.add_argument("--charge", "-c", choices=["gas", "bcc", "resp"], default="bcc")
     parser.add_argument("--gmx", "-gmx", action="store_true", help="Generate GROMACS files.")
+    parser.add_argument(
+        "--capping-engine",
+        choices=["pymol", "geometric"],
+        default=None,
+        help="ACE/NME capping backend (default: $NSAA_CAPPING_ENGINE or pymol).",
+    )
+    parser.add_argument(
+        "--pdb-converter",
+        choices=["native", "pymol"],
+        default=None,
+        help="PDB to MOL2 conversion backend (default: $NSAA_PDB_CONVERTER or native).",
+    )
 
     parser.add_argument("--map", default=None, help="Residue mapping JSON file.")
     parser.add_argument("--default-net-charge", type=int, default=0, help="Fallback net charge.")
     parser.add_argument("--net-charge", "-nc", type=int, default=None, help="Override net charge.")
     parser.add_argument("--out", "-o", default=".", help="Output directory.")
+    parser.add_argument(
+        "--cache-dir",
+        default=None,
+        help="Persistent charged-residue cache directory (default: $NSAA_CHARGE_CACHE_DIR, disabled if unset).",
+    )
+    parser.add_argument(
+        "--cache-max-mb",
+        type=int,
+        default=None,
+        help="Size cap of the charged-residue cache in MB (default: $NSAA_CHARGE_CACHE_MAX_MB or 2048).",
+    )
+    parser.add_argument(
+        "--template-dir",
+        default=None,
+        help="Library of finished residues reused under atom renaming (default: $NSAA_TEMPLATE_DIR, disabled if unset).",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=1,
+        help="Number of residues processed in parallel in batch mode.",
+    )
+    parser.add_argument(
+        "--param-jobs",
+        type=int,
+        default=None,
+        help="Parallel AMBER parameter jobs in batch mode (default: same as --jobs).",
+    )
 
     return parser
 
@@ -89,16 +131,33 @@ def main() -> None:
     out_base.mkdir(parents=True, exist_ok=True)
 
     charged_files: list[str] = []
+    pipelined = False
+
+    param_kwargs = {
+        "backbone": args.backbone,
+        "sidechain": args.sidechain,
+        "charge": args.charge,
+        "generate_gmx": args.gmx,
+        "template_dir": args.template_dir,
+    }
+
+    processor_kwargs = {
+        "charge_model": args.charge,
+        "residue_map": residue_map,
+        "default_net_charge": args.default_net_charge,
+        "net_charge_override": args.net_charge,
+        "output_base": str(out_base),
+        "charge_cache_dir": args.cache_dir,
+        "charge_cache_max_mb": args.cache_max_mb,
+        "capping_engine": args.capping_engine,
+        "pdb_converter": args.pdb_converter,
+        "template_dir": args.template_dir,
+        "backbone": args.backbone,
+        "sidechain": args.sidechain,
+    }
 
     def build_processor(path: str) -> NonStandardAminoAcidProcessor:
-        return NonStandardAminoAcidProcessor(
-            input_file=path,
-            charge_model=args.charge,
-            residue_map=residue_map,
-            default_net_charge=args.default_net_charge,
-            net_charge_override=args.net_charge,
-            output_base=str(out_base),
-        )
+        return NonStandardAminoAcidProcessor(input_file=path, **processor_kwargs)
 
     def process_one(path: str) -> None:
         proc = build_processor(path)
@@ -130,17 +189,57 @@ def main() -> None:
         total = len(batch_items)
         print(f"\nBatch mode: {total} residues detected\n")
 
+        groups = group_identical_inputs(batch_items)
+        representatives = [g[0] for g in groups]
+        duplicates = {g[0]: g[1:] for g in groups}
+        if len(representatives) < total:
+            print(f"{len(representatives)} unique residues after deduplication\n")
+
         failures = []
 
-        for fp in batch_items:
-            print(f"\n--- Processing {fp} ---")
-            try:
-                process_one(fp)
-            except Exception as e:
-                print(f"[FAILED] {fp}")
-                print(e)
-                failures.append(fp)
-                continue
+        def report_duplicates(rep: str, failed: bool) -> None:
+            for dup in duplicates[rep]:
+                print(f"\n--- Processing {dup} ---")
+                print(f"[DEDUP] identical to {rep}; reusing its result")
+                if failed:
+                    print(f"[FAILED] {dup}")
+                    failures.append(dup)
+
+        param_jobs = args.param_jobs if args.param_jobs is not None else args.jobs
+
+        if args.jobs > 1 or param_jobs > 1:
+            pipelined = True
+            print(f"Running with {args.jobs} charge jobs and {param_jobs} parameter jobs\n")
+            for res in iter_batch_results(
+                representatives,
+                processor_kwargs,
+                jobs=args.jobs,
+                param_kwargs=param_kwargs,
+                param_jobs=param_jobs,
+            ):
+                print(f"\n--- Processing {res.path} ---")
+                print(res.output, end="")
+                if res.error is not None:
+                    print(f"[FAILED] {res.path}")
+                    print(res.error)
+                    failures.append(res.path)
+                    report_duplicates(res.path, failed=True)
+                    continue
+                print(res.param_output, end="")
+                charged_files.extend(res.charged)
+                report_duplicates(res.path, failed=False)
+        else:
+            for fp in representatives:
+                print(f"\n--- Processing {fp} ---")
+                try:
+                    process_one(fp)
+                except Exception as e:
+                    print(f"[FAILED] {fp}")
+                    print(e)
+                    failures.append(fp)
+                    report_duplicates(fp, failed=True)
+                    continue
+                report_duplicates(fp, failed=False)
 
         print("\nBatch processing finished")
 
@@ -149,14 +248,11 @@ def main() -> None:
             for f in failures:
                 print(" -", f)
 
+    if pipelined and charged_files:
+        return
+
     if charged_files:
-        run_antechamber_for_all(
-            charged_files,
-            backbone=args.backbone,
-            sidechain=args.sidechain,
-            charge=args.charge,
-            generate_gmx=args.gmx,
-        )
+        run_antechamber_for_all(charged_files, **param_kwargs)
     else:
         print("No charged .mol2 files were generated. Skipping parameter generation.")
 
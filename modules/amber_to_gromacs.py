@@ -1,60 +1,9 @@
 # modules/amber_to_gromacs.py
 from __future__ import annotations
 
-import os
 from pathlib import Path
-from typing import List, Dict, Tuple
 
-
-def _parse_mol2_atoms_coords(mol2_file: str) -> List[Dict]:
-    atoms: List[Dict] = []
-    in_atoms = False
-    with open(mol2_file, "r", encoding="utf-8", errors="replace") as f:
-        for line in f:
-            s = line.strip()
-            if s.startswith("@<TRIPOS>ATOM"):
-                in_atoms = True
-                continue
-            if s.startswith("@<TRIPOS>") and in_atoms:
-                break
-            if not in_atoms or not s:
-                continue
-
-            parts = line.split()
-            # id name x y z type subst_id subst_name charge
-            if len(parts) < 9:
-                continue
-            atom_id = int(parts[0])
-            name = parts[1]
-            x, y, z = float(parts[2]), float(parts[3]), float(parts[4])
-            atype = parts[5]
-            charge = float(parts[8])
-            atoms.append({"id": atom_id, "name": name, "type": atype, "x": x, "y": y, "z": z, "charge": charge})
-    if not atoms:
-        raise ValueError("No atoms parsed from MOL2 (missing @<TRIPOS>ATOM?)")
-    return atoms
-
-
-def _parse_mol2_bonds(mol2_file: str) -> List[Tuple[int, int]]:
-    bonds: List[Tuple[int, int]] = []
-    in_bonds = False
-    with open(mol2_file, "r", encoding="utf-8", errors="replace") as f:
-        for line in f:
-            s = line.strip()
-            if s.startswith("@<TRIPOS>BOND"):
-                in_bonds = True
-                continue
-            if s.startswith("@<TRIPOS>") and in_bonds:
-                break
-            if not in_bonds or not s:
-                continue
-            parts = line.split()
-            if len(parts) < 4:
-                continue
-            a1 = int(parts[1])
-            a2 = int(parts[2])
-            bonds.append((a1, a2))
-    return bonds
+from .mol2 import require_atoms
 
 
 def convert_to_gromacs_best_effort(mol2_file: str, output_dir: str, residue_name: str) -> None:
@@ -71,35 +20,28 @@ def convert_to_gromacs_best_effort(mol2_file: str, output_dir: str, residue_name
     out = Path(output_dir)
     out.mkdir(parents=True, exist_ok=True)
 
-    atoms = _parse_mol2_atoms_coords(mol2_file)
-    bonds = _parse_mol2_bonds(mol2_file)
+    mol = require_atoms(mol2_file)
+    atoms = list(mol.atoms)
+    bonds = list(zip(mol.bond_a1.tolist(), mol.bond_a2.tolist()))
 
     gro_path = out / f"{residue_name}.gro"
     itp_path = out / f"{residue_name}.itp"
 
     # MOL2 coords are in Angstrom; GROMACS uses nm
-    coords_nm = [(a["x"] / 10.0, a["y"] / 10.0, a["z"] / 10.0) for a in atoms]
-    xs, ys, zs = zip(*coords_nm)
+    coords_nm = mol.xyz / 10.0
     padding = 1.2  # nm
 
-    min_x, max_x = min(xs), max(xs)
-    min_y, max_y = min(ys), max(ys)
-    min_z, max_z = min(zs), max(zs)
-
-    box_x = (max_x - min_x) + 2 * padding
-    box_y = (max_y - min_y) + 2 * padding
-    box_z = (max_z - min_z) + 2 * padding
-
-    shift_x = -min_x + padding
-    shift_y = -min_y + padding
-    shift_z = -min_z + padding
+    lo = coords_nm.min(axis=0)
+    hi = coords_nm.max(axis=0)
+    box_x, box_y, box_z = (hi - lo + 2 * padding).tolist()
+    shift_x, shift_y, shift_z = (-lo + padding).tolist()
 
     # Write .gro
     with gro_path.open("w", encoding="utf-8") as gro:
         gro.write(f"{residue_name}\n")
         gro.write(f"{len(atoms):5d}\n")
-        for i, (a, (x, y, z)) in enumerate(zip(atoms, coords_nm), start=1):
-            atom_name = a["name"][:5]
+        for i, (a, (x, y, z)) in enumerate(zip(atoms, coords_nm.tolist()), start=1):
+            atom_name = a.name[:5]
             gro.write(
                 f"{1:5d}{residue_name:<5}{atom_name:>5}{i:5d}"
                 f"{x + shift_x:8.3f}{y + shift_y:8.3f}{z + shift_z:8.3f}\n"
@@ -117,7 +59,7 @@ def convert_to_gromacs_best_effort(mol2_file: str, output_dir: str, residue_name
         itp.write("[ atoms ]\n")
         for i, a in enumerate(atoms, start=1):
             itp.write(
-                f"{i:<5} {a['type']:<8} 1 {residue_name:<6} {a['name']:<6} {i:<5} {a['charge']:10.6f} 0.0000\n"
+                f"{i:<5} {a.atom_type:<8} 1 {residue_name:<6} {a.name:<6} {i:<5} {a.charge:10.6f} 0.0000\n"
             )
 
         itp.write("\n[ bonds ]\n")
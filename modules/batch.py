@@ -0,0 +1,262 @@
+from __future__ import annotations
+
+import contextlib
+import io
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Iterator, Optional
+
+from modules.processor import NonStandardAminoAcidProcessor, read_split_meta, residue_name_from_file
+from modules.result_cache import stable_digest
+from modules.run_antechamber import run_antechamber_for_all
+from modules.utils import mol2_residue_digest
+
+
+@dataclass
+class BatchItemResult:
+    path: str
+    charged: list[str] = field(default_factory=list)
+    output: str = ""
+    error: str | None = None
+    param_output: str = ""
+
+
+def _dedup_key(path: str) -> Optional[str]:
+    p = Path(path)
+    if p.suffix.lower() != ".mol2" or not p.is_file():
+        return None
+
+    try:
+        digest = mol2_residue_digest(str(p), include_coordinates=False)
+    except Exception:
+        # Let the real run report the parse error for this entry.
+        return None
+
+    split_meta = read_split_meta(p.resolve())
+    return stable_digest(
+        {
+            "resname": residue_name_from_file(str(p)),
+            "residue": digest,
+            "head_name": split_meta.get("head_name"),
+            "tail_name": split_meta.get("tail_name"),
+            "topology": split_meta.get("topology"),
+            # Net charge and caps follow the peptide context the residue was cut from.
+            "full_context_net_charge": split_meta.get("full_context_net_charge"),
+            "pre_head_type": split_meta.get("pre_head_type"),
+            "post_tail_type": split_meta.get("post_tail_type"),
+        }
+    )
+
+
+def group_identical_inputs(paths: list[str]) -> list[list[str]]:
+    """
+    Group batch entries that describe the same residue: same resname, atoms,
+    atom types and bonds, and the same peptide context from the split metadata
+    (head/tail, net charge, neighbouring atom types), independent of file
+    name and atom order.
+
+    Groups keep the order of first appearance and the first member of each group
+    is its representative. Non-MOL2 or unreadable inputs are never grouped.
+    """
+    groups: dict[object, list[str]] = {}
+    for idx, path in enumerate(paths):
+        key = _dedup_key(path)
+        groups.setdefault(key if key is not None else ("unique", idx), []).append(path)
+    return list(groups.values())
+
+
+def _output_name(path: str) -> str:
+    """Residue name an entry writes under (``output_base/<name>/``)."""
+    try:
+        return residue_name_from_file(path)
+    except OSError:
+        # Unreadable: the run reports it, and it writes nothing shared.
+        return f"\0{path}"
+
+
+def _process_batch_item(path: str, processor_kwargs: dict) -> BatchItemResult:
+    """
+    Worker entry point: process one residue and capture everything it prints,
+    so the parent can replay the output in input order.
+    """
+    result = BatchItemResult(path=path)
+    buf = io.StringIO()
+
+    with contextlib.redirect_stdout(buf):
+        try:
+            proc = NonStandardAminoAcidProcessor(input_file=path, **processor_kwargs)
+            result.charged = list(proc.process_single_residue())
+        except Exception as e:
+            result.error = str(e)
+
+    result.output = buf.getvalue()
+    return result
+
+
+def _parametrize_batch_item(charged: list[str], param_kwargs: dict) -> str:
+    """Worker entry point for the AC/prepgen/parmchk2/tleap stage of one residue."""
+    buf = io.StringIO()
+
+    with contextlib.redirect_stdout(buf):
+        try:
+            run_antechamber_for_all(charged, **param_kwargs)
+        except Exception as e:
+            print(f"[FAILED] parameter generation: {e}")
+
+    return buf.getvalue()
+
+
+class _PoolLane:
+    """
+    One stage of the batch on its own process pool. At most ``jobs`` items
+    are submitted at a time, so every submitted item is running.
+
+    A crashed worker breaks the whole pool and fails everything in it. The
+    lane then starts a new pool and reruns the items that were in flight one
+    at a time, alone in the pool, so that only an item that crashes by
+    itself is blamed.
+    """
+
+    def __init__(self, fn: Callable[..., Any], jobs: int):
+        self.fn = fn
+        self.jobs = max(1, int(jobs))
+        self.pool = ProcessPoolExecutor(max_workers=self.jobs)
+        self.queue: deque[tuple[int, tuple]] = deque()
+        self.suspects: deque[tuple[int, tuple]] = deque()
+        # future -> (item index, args, pool it went to, submitted alone)
+        self.running: dict[Future, tuple[int, tuple, ProcessPoolExecutor, bool]] = {}
+
+    def add(self, idx: int, *args: Any) -> None:
+        self.queue.append((idx, args))
+
+    def _submit(self, idx: int, args: tuple, alone: bool) -> bool:
+        try:
+            fut = self.pool.submit(self.fn, *args)
+        except BrokenProcessPool:
+            # The crash surfaces on the futures in flight, which restart the pool.
+            return False
+        self.running[fut] = (idx, args, self.pool, alone)
+        return True
+
+    def fill(self) -> None:
+        while True:
+            if self.suspects:
+                # A suspect runs alone, so that a crash can only be its own.
+                if not self.running and self._submit(*self.suspects[0], alone=True):
+                    self.suspects.popleft()
+                return
+            if not self.queue or len(self.running) >= self.jobs:
+                return
+            if not self._submit(*self.queue[0], alone=False):
+                return
+            self.queue.popleft()
+
+    def _restart(self, broken: ProcessPoolExecutor) -> None:
+        if broken is self.pool:
+            broken.shutdown(wait=True, cancel_futures=True)
+            self.pool = ProcessPoolExecutor(max_workers=self.jobs)
+
+    def finish(self, fut: Future) -> Optional[tuple[int, Any, Optional[BaseException]]]:
+        """
+        (item index, result, error) of a finished future, or None when the
+        item was caught in a pool crash and has been queued for a rerun.
+        """
+        idx, args, pool, alone = self.running.pop(fut)
+        try:
+            return idx, fut.result(), None
+        except BrokenProcessPool as e:
+            self._restart(pool)
+            if alone:
+                return idx, None, e
+            self.suspects.append((idx, args))
+            return None
+        except Exception as e:
+            return idx, None, e
+
+    def shutdown(self) -> None:
+        self.pool.shutdown(wait=True, cancel_futures=True)
+
+
+def iter_batch_results(
+    paths: list[str],
+    processor_kwargs: dict,
+    *,
+    jobs: int,
+    param_kwargs: dict | None = None,
+    param_jobs: int | None = None,
+) -> Iterator[BatchItemResult]:
+    """
+    Run process_single_residue for every path on a process pool.
+
+    When ``param_kwargs`` is given, each residue is handed to a second pool for
+    parameter generation as soon as its charged MOL2 exists, so the AMBER tool
+    stage overlaps with charge jobs that are still running.
+
+    Entries with the same residue name write to the same output directory, so
+    they run one after another (both stages), in input order, never side by side.
+
+    Results are yielded in the order of ``paths`` regardless of completion order.
+    A failure (including a crashed worker) is reported on that item only; the
+    items that shared the pool with a crashed worker are rerun.
+    """
+    results = [BatchItemResult(path=p) for p in paths]
+    done = [False] * len(paths)
+    next_to_yield = 0
+
+    names = [_output_name(p) for p in paths]
+    held: dict[str, deque[int]] = {}
+    for idx, name in enumerate(names):
+        held.setdefault(name, deque()).append(idx)
+
+    charge = _PoolLane(_process_batch_item, jobs)
+    param = _PoolLane(_parametrize_batch_item, param_jobs or jobs) if param_kwargs is not None else None
+    lanes = [lane for lane in (charge, param) if lane is not None]
+
+    try:
+        for queue in held.values():
+            idx = queue.popleft()
+            charge.add(idx, paths[idx], processor_kwargs)
+
+        while not all(done):
+            for lane in lanes:
+                lane.fill()
+            futures = {fut: lane for lane in lanes for fut in lane.running}
+            finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+
+            for fut in finished:
+                lane = futures[fut]
+                outcome = lane.finish(fut)
+                if outcome is None:
+                    continue
+                idx, value, error = outcome
+
+                if lane is charge:
+                    if error is not None:
+                        results[idx].error = f"worker crashed: {error}"
+                    else:
+                        results[idx] = value
+
+                    res = results[idx]
+                    if param is not None and res.error is None and res.charged:
+                        param.add(idx, res.charged, param_kwargs)
+                        continue
+                else:
+                    if error is not None:
+                        results[idx].param_output = f"[FAILED] parameter worker crashed: {error}\n"
+                    else:
+                        results[idx].param_output = value
+
+                done[idx] = True
+                if held[names[idx]]:
+                    nxt = held[names[idx]].popleft()
+                    charge.add(nxt, paths[nxt], processor_kwargs)
+
+            while next_to_yield < len(paths) and done[next_to_yield]:
+                yield results[next_to_yield]
+                next_to_yield += 1
+    finally:
+        for lane in lanes:
+            lane.shutdown()
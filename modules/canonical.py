@@ -0,0 +1,291 @@
+from __future__ import annotations
+
+import hashlib
+import re
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .mol2 import AtomView, BondView, Mol2Source, as_molecule
+from .utils import _ELEMENT_BY_ATYPE_PREFIX
+
+
+# Bump when the certificate layout changes; stored hashes are then stale.
+_HASH_VERSION = 2
+
+# Search-tree leaves explored before falling back to the refined colouring alone.
+_MAX_LEAVES = 4096
+
+# Writers disagree on amide bonds; treat them as the single bonds they are.
+_BOND_ALIASES = {"am": "1"}
+
+
+def _bond_label(bond_type: object) -> str:
+    label = str(bond_type or "").strip().lower()
+    return _BOND_ALIASES.get(label, label or "1")
+
+
+def _element(atom: AtomView) -> str:
+    # Sybyl types carry the element before the dot ("N.am", "C.ar") or are the
+    # bare symbol ("Cl", "H"); utils._guess_element reads "N.am" as sodium and
+    # "C.ar" as calcium, which would tie the hash to the input's typing. Other
+    # types (GAFF "ca", "na", ...) say nothing reliable, so go by the name.
+    atom_type = str(atom.atom_type or "").strip()
+    head = atom_type.split(".", 1)[0]
+    if head and ("." in atom_type or head in _ELEMENT_BY_ATYPE_PREFIX.values()):
+        return head.upper()
+    name = re.sub(r"[^A-Za-z]", "", str(atom.name or "")).upper()
+    if name[:2] in ("CL", "BR"):
+        return name[:2]
+    return name[:1] or "C"
+
+
+# =========================
+# HEAVY-ATOM GRAPH
+# =========================
+class _HeavyGraph:
+    """
+    Residue graph with terminal hydrogens folded into their heavy atom as a
+    hydrogen count, so that interchangeable hydrogens do not multiply the
+    canonical-labelling search. Vertices keep the MOL2 atom they came from.
+    """
+
+    __slots__ = ("atoms", "labels", "adj", "hydrogens")
+
+    def __init__(self, atoms: Sequence[AtomView], bonds: Iterable[BondView], *, bond_orders: bool = True):
+        row_of = {a.atom_id: i for i, a in enumerate(atoms)}
+        elements = [_element(a) for a in atoms]
+
+        edges: Dict[Tuple[int, int], str] = {}
+        for b in bonds:
+            i, j = row_of.get(b.a1), row_of.get(b.a2)
+            if i is None or j is None or i == j:
+                continue
+            edges[(min(i, j), max(i, j))] = _bond_label(b.bond_type) if bond_orders else "1"
+
+        degree = [0] * len(atoms)
+        for i, j in edges:
+            degree[i] += 1
+            degree[j] += 1
+
+        # Only a hydrogen hanging off a single heavy atom is folded away.
+        folded = [False] * len(atoms)
+        h_rows: List[List[int]] = [[] for _ in atoms]
+        for (i, j), label in edges.items():
+            for h, heavy in ((i, j), (j, i)):
+                if elements[h] == "H" and degree[h] == 1 and elements[heavy] != "H" and label == "1":
+                    folded[h] = True
+                    h_rows[heavy].append(h)
+
+        keep = [i for i in range(len(atoms)) if not folded[i]]
+        vertex_of = {i: v for v, i in enumerate(keep)}
+
+        self.atoms = [atoms[i] for i in keep]
+        self.labels = [(elements[i], len(h_rows[i])) for i in keep]
+        self.hydrogens = [[atoms[h] for h in h_rows[i]] for i in keep]
+        self.adj: List[List[Tuple[int, str]]] = [[] for _ in keep]
+        for (i, j), label in edges.items():
+            if i in vertex_of and j in vertex_of:
+                self.adj[vertex_of[i]].append((vertex_of[j], label))
+                self.adj[vertex_of[j]].append((vertex_of[i], label))
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def initial_colors(self) -> List[int]:
+        keys = [(label, len(nbrs)) for label, nbrs in zip(self.labels, self.adj)]
+        rank = {k: c for c, k in enumerate(sorted(set(keys)))}
+        return [rank[k] for k in keys]
+
+    def refine(self, colors: List[int]) -> List[int]:
+        """
+        Colour refinement to a stable partition. Colours are renumbered by
+        sorted signature, so the result depends only on the graph and the
+        input colouring, never on vertex order.
+        """
+        n_classes = len(set(colors))
+        while True:
+            sigs = [
+                (colors[v], tuple(sorted((label, colors[u]) for u, label in self.adj[v])))
+                for v in range(len(colors))
+            ]
+            rank = {s: c for c, s in enumerate(sorted(set(sigs)))}
+            refined = [rank[s] for s in sigs]
+            if len(rank) == n_classes:
+                return refined
+            colors, n_classes = refined, len(rank)
+
+    def certificate(self, colors: List[int]) -> tuple:
+        # Discrete colouring: the colour of a vertex is its canonical position.
+        order = sorted(range(len(colors)), key=colors.__getitem__)
+        edges = sorted(
+            (min(colors[v], colors[u]), max(colors[v], colors[u]), label)
+            for v in range(len(colors))
+            for u, label in self.adj[v]
+            if v < u
+        )
+        return (tuple(self.labels[v] for v in order), tuple(edges))
+
+
+# =========================
+# CANONICAL LABELLING
+# =========================
+def _target_cell(colors: List[int]) -> Optional[List[int]]:
+    cells: Dict[int, List[int]] = {}
+    for v, c in enumerate(colors):
+        cells.setdefault(c, []).append(v)
+    ties = [(len(members), c) for c, members in cells.items() if len(members) > 1]
+    return cells[min(ties)[1]] if ties else None
+
+
+def _canonical_leaves(graph: _HeavyGraph, stable: List[int]) -> Tuple[Optional[tuple], List[List[int]]]:
+    """
+    Individualisation-refinement search. Returns the smallest certificate and
+    every discrete colouring that produces it, or (None, []) when the search
+    exceeds ``_MAX_LEAVES``.
+    """
+    best: Optional[tuple] = None
+    best_leaves: List[List[int]] = []
+    leaves = 0
+    stack = [stable]
+    while stack:
+        colors = stack.pop()
+        cell = _target_cell(colors)
+        if cell is None:
+            leaves += 1
+            if leaves > _MAX_LEAVES:
+                return None, []
+            cert = graph.certificate(colors)
+            if best is None or cert < best:
+                best, best_leaves = cert, [colors]
+            elif cert == best:
+                best_leaves.append(colors)
+            continue
+
+        for v in cell:
+            # v takes a colour just below the rest of its cell.
+            split = [2 * c for c in colors]
+            split[v] -= 1
+            stack.append(graph.refine(split))
+    return best, best_leaves
+
+
+def _chirality(graph: _HeavyGraph, stable: List[int], colors: List[int]) -> tuple:
+    """
+    Signed-volume parity of every tetrahedral centre whose substituents are
+    distinguishable, listed by canonical position. Substituents are ordered
+    by canonical position, so the parity is independent of atom order.
+    """
+    out = []
+    for v, atom in enumerate(graph.atoms):
+        nbrs = graph.adj[v]
+        h_count = graph.labels[v][1]
+        if h_count > 1 or len(nbrs) + h_count != 4:
+            continue
+        if len({stable[u] for u, _ in nbrs}) != len(nbrs):
+            continue
+
+        ranked = sorted((u for u, _ in nbrs), key=colors.__getitem__)[:3]
+        centre = np.array([atom.x, atom.y, atom.z])
+        vecs = np.array([[graph.atoms[u].x, graph.atoms[u].y, graph.atoms[u].z] for u in ranked]) - centre
+        volume = float(np.linalg.det(vecs))
+        sign = 0 if abs(volume) < 1e-6 else (1 if volume > 0 else -1)
+        out.append((colors[v], sign))
+    return tuple(sorted(out))
+
+
+def _digest(*parts: object) -> str:
+    blob = repr((_HASH_VERSION,) + parts)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+@dataclass(frozen=True)
+class CanonicalForm:
+    """
+    Graph hash, stereo graph hash and canonical atom order of one residue.
+
+    ``atom_order`` lists MOL2 atom ids so that equal forms give an atom
+    mapping by position: heavy atoms in canonical order, each followed by its
+    hydrogens. It is None for graphs too symmetric for the search, whose
+    hashes then come from the refined colouring alone.
+    """
+
+    graph_hash: str
+    stereo_hash: str
+    atom_order: Optional[Tuple[int, ...]]
+
+
+def canonical_form(atoms: Sequence[AtomView], bonds: Iterable[BondView]) -> CanonicalForm:
+    """
+    The graph hash depends only on elements, hydrogen counts and bond orders:
+    atom names, atom order, atom types and coordinates do not enter it. The
+    stereo hash additionally carries the handedness of tetrahedral centres,
+    read from the coordinates.
+    """
+    graph = _HeavyGraph(list(atoms), bonds)
+    stable = graph.refine(graph.initial_colors())
+    best, leaves = _canonical_leaves(graph, stable)
+
+    if best is None:
+        # Highly symmetric graph: the stable colouring is still an invariant,
+        # only weaker than a canonical form.
+        sig = tuple(sorted(zip(stable, graph.labels)))
+        edges = tuple(sorted((min(stable[v], stable[u]), max(stable[v], stable[u]), label)
+                             for v in range(len(graph)) for u, label in graph.adj[v] if v < u))
+        constitution = ("refined", sig, edges)
+        return CanonicalForm(_digest(constitution), _digest(constitution, ()), None)
+
+    constitution = ("canonical",) + best
+    chirality = [_chirality(graph, stable, colors) for colors in leaves]
+    stereo = min(chirality)
+    colors = leaves[chirality.index(stereo)]
+
+    order: List[int] = []
+    for v in sorted(range(len(graph)), key=colors.__getitem__):
+        order.append(graph.atoms[v].atom_id)
+        # Hydrogens on one atom are interchangeable; any order is an isomorphism.
+        order.extend(h.atom_id for h in sorted(graph.hydrogens[v], key=lambda h: (h.name, h.atom_id)))
+    return CanonicalForm(_digest(constitution), _digest(constitution, stereo), tuple(order))
+
+
+def canonical_hashes(atoms: Sequence[AtomView], bonds: Iterable[BondView]) -> Tuple[str, str]:
+    """(graph hash, stereo graph hash) of one residue; see ``canonical_form``."""
+    form = canonical_form(atoms, bonds)
+    return form.graph_hash, form.stereo_hash
+
+
+def symmetry_classes(atoms: Sequence[AtomView], bonds: Iterable[BondView]) -> List[int]:
+    """
+    Topological symmetry class per atom (in ``atoms`` order), from the refined
+    colouring of the graph without bond orders, so that resonance partners
+    such as carboxylate oxygens fall in one class. Hydrogens share a class
+    when their heavy atoms do.
+    """
+    atoms = list(atoms)
+    graph = _HeavyGraph(atoms, bonds, bond_orders=False)
+    stable = graph.refine(graph.initial_colors())
+
+    key_of: Dict[int, tuple] = {}
+    for v, atom in enumerate(graph.atoms):
+        key_of[atom.atom_id] = ("heavy", stable[v])
+        for h in graph.hydrogens[v]:
+            key_of[h.atom_id] = ("hydrogen", stable[v])
+    keys = [key_of[a.atom_id] for a in atoms]
+    rank = {k: c for c, k in enumerate(sorted(set(keys)))}
+    return [rank[k] for k in keys]
+
+
+def canonical_graph_hash(atoms: Sequence[AtomView], bonds: Iterable[BondView], *, stereo: bool = False) -> str:
+    graph_hash, stereo_hash = canonical_hashes(atoms, bonds)
+    return stereo_hash if stereo else graph_hash
+
+
+def mol2_canonical_form(mol2: Mol2Source) -> CanonicalForm:
+    mol = as_molecule(mol2)
+    return canonical_form(list(mol.atoms), mol.bonds)
+
+
+def mol2_graph_hashes(mol2: Mol2Source) -> Tuple[str, str]:
+    form = mol2_canonical_form(mol2)
+    return form.graph_hash, form.stereo_hash
@@ -57,21 +57,11 @@ def _normalize_name_arg(value: str | None) -> str | None:
     return s
 
 
-def main() -> int:
-    if pymol is None:
-        print("ERROR: PyMOL is not available in this Python environment. Install/enable PyMOL to use capping.")
-        return 2
-
-    pymol.finish_launching(["pymol", "-cq"])
-
-    if len(sys.argv) < 2:
-        print("Usage: python capping.py <residue_folder> [head_name|NONE] [tail_name|NONE]")
-        return 1
-
-    residue_folder = Path(sys.argv[1]).resolve()
-    head_name = _normalize_name_arg(sys.argv[2] if len(sys.argv) >= 3 else "N")
-    tail_name = _normalize_name_arg(sys.argv[3] if len(sys.argv) >= 4 else "C")
-
+def cap_residue(residue_folder: Path, head_name: str | None, tail_name: str | None) -> int:
+    """
+    Cap residue.mol2 in ``residue_folder`` with ACE/NME and write residue_capped.mol2
+    plus residue_capping_meta.json. PyMOL must already be launched.
+    """
     input_file = residue_folder / "residue.mol2"
     output_file = residue_folder / "residue_capped.mol2"
     meta_file = residue_folder / "residue_capping_meta.json"
@@ -129,5 +119,23 @@ def main() -> int:
     return 3
 
 
+def main() -> int:
+    if pymol is None:
+        print("ERROR: PyMOL is not available in this Python environment. Install/enable PyMOL to use capping.")
+        return 2
+
+    pymol.finish_launching(["pymol", "-cq"])
+
+    if len(sys.argv) < 2:
+        print("Usage: python capping.py <residue_folder> [head_name|NONE] [tail_name|NONE]")
+        return 1
+
+    residue_folder = Path(sys.argv[1]).resolve()
+    head_name = _normalize_name_arg(sys.argv[2] if len(sys.argv) >= 3 else "N")
+    tail_name = _normalize_name_arg(sys.argv[3] if len(sys.argv) >= 4 else "C")
+
+    return cap_residue(residue_folder, head_name, tail_name)
+
+
 if __name__ == "__main__":
     raise SystemExit(main())
\ No newline at end of file
@@ -0,0 +1,192 @@
+from __future__ import annotations
+
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from modules.graph import CSRGraph
+from modules.mol2 import Mol2Molecule, Mol2Source, require_atoms
+from modules.utils import _guess_element
+
+
+# Closest allowed non-bonded contacts (A) for atoms more than three bonds apart.
+_MIN_HEAVY_CONTACT = 2.2
+_MIN_H_CONTACT = 1.6
+
+# Conformers closer than this heavy-atom RMSD (A) to a kept one are dropped.
+_MIN_RMSD = 0.5
+
+_TORSION_STEPS = np.radians([60.0, 180.0, 300.0])
+
+
+# =========================
+# GEOMETRY
+# =========================
+def _rotate(xyz: np.ndarray, axis_from: np.ndarray, axis_to: np.ndarray, angle: float) -> np.ndarray:
+    """Rotate points by ``angle`` about the axis through two points (Rodrigues)."""
+    k = axis_to - axis_from
+    k = k / np.linalg.norm(k)
+    p = xyz - axis_from
+    cos, sin = np.cos(angle), np.sin(angle)
+    return axis_from + p * cos + np.cross(k, p) * sin + np.outer(p @ k, k) * (1.0 - cos)
+
+
+def _rmsd(a: np.ndarray, b: np.ndarray) -> float:
+    """RMSD after optimal superposition (Kabsch)."""
+    a = a - a.mean(axis=0)
+    b = b - b.mean(axis=0)
+    u, s, vt = np.linalg.svd(a.T @ b)
+    d = np.sign(np.linalg.det(u @ vt))
+    s[-1] *= d
+    msd = (np.sum(a * a) + np.sum(b * b) - 2.0 * s.sum()) / len(a)
+    return float(np.sqrt(max(msd, 0.0)))
+
+
+def _is_distinct(xyz: np.ndarray, kept: List[np.ndarray], heavy: np.ndarray) -> bool:
+    return all(_rmsd(xyz[heavy], other[heavy]) >= _MIN_RMSD for other in kept)
+
+
+# =========================
+# TORSION DRIVING
+# =========================
+class _TorsionDriver:
+    """
+    Rotatable single bonds of one molecule, with the atoms each rotation
+    moves and the atom pairs that must not clash.
+    """
+
+    def __init__(self, mol: Mol2Molecule):
+        n = len(mol.atom_id)
+        self.heavy = np.array(
+            [_guess_element(a.name, a.atom_type).upper() != "H" for a in mol.atoms], dtype=bool
+        )
+        graph = CSRGraph.from_edges(mol.atom_id, mol.bond_a1, mol.bond_a2)
+        row_of = {label: i for i, label in enumerate(mol.atom_id.tolist())}
+
+        # Far pairs: more than three bonds apart (or disconnected).
+        near = np.zeros((n, n), dtype=bool)
+        for i, label in enumerate(mol.atom_id.tolist()):
+            near[i, [row_of[x] for x in graph.k_hop(label, 3)]] = True
+        self.far = ~near
+        self.min_contact = np.where(
+            self.heavy[:, None] & self.heavy[None, :], _MIN_HEAVY_CONTACT, _MIN_H_CONTACT
+        )
+
+        self.torsions: List[Tuple[int, int, np.ndarray]] = []
+        for a1, a2, btype in zip(mol.bond_a1.tolist(), mol.bond_a2.tolist(), mol.bond_type.tolist()):
+            # Amide, aromatic and multiple bonds keep their geometry.
+            if str(btype).strip() != "1" or a1 not in row_of or a2 not in row_of:
+                continue
+            u, v = row_of[a1], row_of[a2]
+            side = self._side(graph, mol, a1, a2)
+            if side is None:
+                continue
+            moved = np.array([row_of[x] for x in side], dtype=np.int64)
+            fixed_heavy = self.heavy.sum() - self.heavy[moved].sum()
+            # Rotating a lone methyl or hydroxyl does not change the ESP enough to matter.
+            if self.heavy[moved].sum() < 2 or fixed_heavy < 2:
+                continue
+            self.torsions.append((u, v, moved))
+
+    @staticmethod
+    def _side(graph: CSRGraph, mol: Mol2Molecule, a1: int, a2: int) -> Optional[List[int]]:
+        """Smaller half of the molecule across the bond, or None when the bond is in a ring."""
+        seen = {a2}
+        stack = [a2]
+        while stack:
+            cur = stack.pop()
+            for nxt in graph.neighbors_of(cur):
+                if nxt == a1:
+                    if cur == a2:
+                        continue
+                    return None
+                if nxt not in seen:
+                    seen.add(nxt)
+                    stack.append(nxt)
+        if len(seen) * 2 > len(mol.atom_id):
+            return sorted(set(mol.atom_id.tolist()) - seen)
+        return sorted(seen)
+
+    def clash_mask(self, xyz: np.ndarray) -> np.ndarray:
+        d = np.linalg.norm(xyz[:, None, :] - xyz[None, :, :], axis=-1)
+        return self.far & (d < self.min_contact)
+
+    def clashes(self, xyz: np.ndarray, allowed: np.ndarray) -> bool:
+        """True when ``xyz`` has a close contact that is not in ``allowed``."""
+        return bool(np.any(self.clash_mask(xyz) & ~allowed))
+
+    def perturb(self, xyz: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+        out = xyz.copy()
+        for u, v, moved in self.torsions:
+            angle = float(rng.choice(_TORSION_STEPS))
+            # Turn about the bond, moving only the side that holds ``moved``.
+            out[moved] = _rotate(out[moved], out[u], out[v], angle)
+        return out
+
+
+def _native_conformers(mol: Mol2Molecule, base: np.ndarray, n: int, seed: int) -> List[np.ndarray]:
+    driver = _TorsionDriver(mol)
+    kept = [base]
+    if not driver.torsions:
+        return kept
+
+    # Contacts already present in the input geometry are not held against a conformer.
+    allowed = driver.clash_mask(base)
+    rng = np.random.default_rng(seed)
+    for _ in range(50 * n):
+        if len(kept) >= n:
+            break
+        xyz = driver.perturb(base, rng)
+        if driver.clashes(xyz, allowed) or not _is_distinct(xyz, kept, driver.heavy):
+            continue
+        kept.append(xyz)
+    return kept
+
+
+def _rdkit_conformers(mol: Mol2Molecule, base: np.ndarray, n: int, seed: int) -> Optional[List[np.ndarray]]:
+    try:
+        from rdkit import Chem
+        from rdkit.Chem import AllChem
+    except ImportError:
+        return None
+
+    rd = Chem.MolFromMol2Block(mol.to_text(), removeHs=False)
+    if rd is None or rd.GetNumAtoms() != len(base):
+        return None
+
+    conf_ids = list(AllChem.EmbedMultipleConfs(rd, numConfs=3 * n, randomSeed=seed))
+    if not conf_ids:
+        return None
+    try:
+        AllChem.MMFFOptimizeMoleculeConfs(rd)
+    except Exception:
+        pass
+
+    heavy = np.array([a.GetAtomicNum() != 1 for a in rd.GetAtoms()], dtype=bool)
+    kept = [base]
+    for cid in conf_ids:
+        if len(kept) >= n:
+            break
+        xyz = np.array(rd.GetConformer(cid).GetPositions(), dtype=np.float64)
+        if _is_distinct(xyz, kept, heavy):
+            kept.append(xyz)
+    return kept
+
+
+def generate_conformers(mol2: Mol2Source, n: int, *, seed: int = 0) -> List[np.ndarray]:
+    """
+    Up to ``n`` distinct conformers as (n_atoms, 3) arrays in MOL2 atom order.
+    The first one is the input geometry. RDKit embeds the rest when it is
+    installed and accepts the molecule; otherwise single, non-ring bonds are
+    driven through staggered torsions and clashing or duplicate geometries
+    are discarded. Fewer than ``n`` come back when the molecule is too rigid.
+    """
+    mol = require_atoms(mol2)
+    base = np.asarray(mol.xyz, dtype=np.float64)
+    if n <= 1:
+        return [base]
+
+    conformers = _rdkit_conformers(mol, base, n, seed)
+    if conformers is None:
+        conformers = _native_conformers(mol, base, n, seed)
+    return conformers
@@ -0,0 +1,180 @@
+from __future__ import annotations
+
+import os
+import re
+from dataclasses import dataclass
+from typing import Optional
+
+from modules.runner import RunAborted
+
+
+# ORCA: SCF iteration rows (DIIS and SOSCF tables), optimization cycles and their convergence table.
+_SCF_HEADER = re.compile(r"^\s*ITER\s+Energy\s+Delta-E")
+_SCF_ROW = re.compile(r"^\s*(\d+)\s+(-\d+\.\d+)\s+(-?\d+\.\d+(?:[eE][-+]?\d+)?)(?:\s|$)")
+_SCF_END = ("SCF CONVERGED", "SCF NOT CONVERGED", "TOTAL SCF ENERGY")
+_OPT_CYCLE = re.compile(r"GEOMETRY OPTIMIZATION CYCLE\s+(\d+)")
+_FINAL_ENERGY = re.compile(r"FINAL SINGLE POINT ENERGY\s+(-?\d+\.\d+)")
+_RMS_GRADIENT = re.compile(r"^\s*RMS gradient\s+(\d+\.\d+(?:[eE][-+]?\d+)?)")
+
+# sqm (sqm.out): minimization steps and the SCF failure antechamber would only report at the end.
+_SQM_STEP = re.compile(r"^\s*xmin\s+(\d+)\s+(-?\d+\.\d+)\s+(\d+\.\d+(?:[eE][-+]?\d+)?)")
+_SQM_SCF_FAILED = "Unable to achieve self consistency"
+
+
+def _env_window(name: str, default: int) -> int:
+    raw = os.environ.get(name)
+    if raw is None:
+        return default
+    try:
+        value = int(raw)
+    except ValueError as exc:
+        raise ValueError(f"Environment variable {name} must be an integer, got: {raw}") from exc
+    if value < 1:
+        raise ValueError(f"Environment variable {name} must be positive, got: {raw}")
+    return value
+
+
+@dataclass(frozen=True)
+class MonitorSettings:
+    """Iterations a run may go without progress before it is aborted, and whether to retry it."""
+
+    scf_window: int
+    opt_window: int
+    fallback: bool
+
+
+def monitor_settings() -> Optional[MonitorSettings]:
+    """
+    NSAA_MONITOR=0 turns the monitors off (None). NSAA_MONITOR_SCF_WINDOW
+    (default 40) and NSAA_MONITOR_OPT_WINDOW (default 25) are the SCF
+    iterations and optimization cycles allowed without progress;
+    NSAA_MONITOR_FALLBACK=0 fails an aborted run instead of retrying it.
+    """
+    if os.environ.get("NSAA_MONITOR", "1").strip().lower() in {"0", "false", "no"}:
+        return None
+    return MonitorSettings(
+        scf_window=_env_window("NSAA_MONITOR_SCF_WINDOW", 40),
+        opt_window=_env_window("NSAA_MONITOR_OPT_WINDOW", 25),
+        fallback=os.environ.get("NSAA_MONITOR_FALLBACK", "1").strip().lower() not in {"0", "false", "no"},
+    )
+
+
+class _Progress:
+    """Lowest value of a series and the number of values since it was reached."""
+
+    def __init__(self):
+        self.best: Optional[float] = None
+        self.since = 0
+
+    def add(self, value: float) -> int:
+        if self.best is None or value < self.best:
+            self.best, self.since = value, 0
+        else:
+            self.since += 1
+        return self.since
+
+
+# =========================
+# MONITORS
+# =========================
+class OrcaMonitor:
+    """
+    Line callback for an ORCA job. Raises ``RunAborted`` when an SCF goes
+    ``scf_window`` iterations without a smaller |Delta-E| (oscillating or
+    stuck), or an optimization goes ``opt_window`` cycles without reaching a
+    lower energy or a smaller RMS gradient. ``tripped`` is then "scf" or
+    "geometry".
+    """
+
+    def __init__(self, settings: MonitorSettings):
+        self.settings = settings
+        self.tripped: Optional[str] = None
+        self.in_scf = False
+        self.last_iter = -1
+        self.scf = _Progress()
+        self.cycle = 0
+        self.energy = _Progress()
+        self.gradient = _Progress()
+
+    def _abort(self, kind: str, reason: str) -> None:
+        self.tripped = kind
+        raise RunAborted(reason)
+
+    def __call__(self, stream: str, line: str) -> None:
+        if stream != "stdout" or self.tripped:
+            return
+        if _SCF_HEADER.match(line):
+            self.in_scf = True
+            return
+        if self.in_scf:
+            if any(marker in line for marker in _SCF_END):
+                self.in_scf, self.last_iter, self.scf = False, -1, _Progress()
+                return
+            m = _SCF_ROW.match(line)
+            if m:
+                it = int(m.group(1))
+                if it <= self.last_iter:
+                    self.scf = _Progress()
+                self.last_iter = it
+                # Iteration 0 has no Delta-E yet.
+                if it > 0 and self.scf.add(abs(float(m.group(3)))) >= self.settings.scf_window:
+                    self._abort(
+                        "scf",
+                        f"SCF not converging: no smaller |Delta-E| in {self.settings.scf_window} "
+                        f"iterations (best {self.scf.best:.3e} Eh, iteration {it})",
+                    )
+            return
+
+        m = _OPT_CYCLE.search(line)
+        if m:
+            self.cycle = int(m.group(1))
+            return
+        if not self.cycle:
+            return
+        m = _FINAL_ENERGY.search(line)
+        if m:
+            self.energy.add(float(m.group(1)))
+            return
+        m = _RMS_GRADIENT.match(line)
+        if m:
+            self.gradient.add(float(m.group(1)))
+            window = self.settings.opt_window
+            if min(self.energy.since, self.gradient.since) >= window:
+                self._abort(
+                    "geometry",
+                    f"optimization stalled: no lower energy or RMS gradient in {window} cycles "
+                    f"(best {self.energy.best:.8f} Eh, {self.gradient.best:.2e} Eh/bohr, cycle {self.cycle})",
+                )
+
+
+class SqmMonitor:
+    """
+    Line callback for the ``sqm.out`` antechamber leaves behind while it
+    runs sqm. Raises ``RunAborted`` on an SCF failure, or when the
+    minimization goes ``opt_window`` steps without reaching a lower energy
+    or a smaller RMS gradient; ``tripped`` is then "scf" or "geometry".
+    """
+
+    def __init__(self, settings: MonitorSettings):
+        self.settings = settings
+        self.tripped: Optional[str] = None
+        self.energy = _Progress()
+        self.gradient = _Progress()
+
+    def __call__(self, stream: str, line: str) -> None:
+        if stream != "sqm.out" or self.tripped:
+            return
+        if _SQM_SCF_FAILED in line:
+            self.tripped = "scf"
+            raise RunAborted("sqm SCF failed to converge")
+        m = _SQM_STEP.match(line)
+        if m:
+            self.energy.add(float(m.group(2)))
+            self.gradient.add(float(m.group(3)))
+            window = self.settings.opt_window
+            if min(self.energy.since, self.gradient.since) >= window:
+                self.tripped = "geometry"
+                raise RunAborted(
+                    f"sqm minimization stalled: no lower energy or RMS gradient in {window} steps "
+                    f"(best {self.energy.best:.4f} kcal/mol, {self.gradient.best:.4f}, step {m.group(1)})"
+                )
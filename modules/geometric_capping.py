@@ -0,0 +1,423 @@
+from __future__ import annotations
+
+import json
+import math
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from modules.capping import _make_unique_name, _normalize_name_arg
+from modules.utils import _guess_element, _parse_mol2_atoms, _parse_mol2_bonds_with_types
+
+
+@dataclass
+class _Atom:
+    name: str
+    element: str
+    atom_type: str
+    pos: np.ndarray
+    subst_name: str
+    charge: float = 0.0
+
+
+_XH_BOND_LENGTH = {"C": 1.09, "N": 1.01, "O": 0.96, "S": 1.34, "P": 1.42}
+
+_VALENCE = {"C": 4, "N": 3, "O": 2, "S": 2, "P": 3, "B": 3, "F": 1, "Cl": 1, "Br": 1, "I": 1}
+
+_TRIGONAL_TYPES = {"N.PL3", "N.AM", "C.AR", "C.CAT"}
+
+_BOND_ORDER = {"1": 1.0, "2": 2.0, "3": 3.0, "AM": 1.0, "AR": 1.5, "DU": 1.0, "UN": 1.0, "NC": 0.0}
+
+# Cap templates as internal coordinates placed with _place_atom(a, b, c, ...).
+# Atom order (and therefore AC1..AC6 / NM1..NM6 naming) follows PyMOL's
+# ace/nme fragments so both engines produce the same cap atom names.
+_ACE_ATOMS = [("C", "C", "C.2"), ("O", "O", "O.2"), ("CH3", "C", "C.3"), ("H1", "H", "H"), ("H2", "H", "H"), ("H3", "H", "H")]
+_NME_ATOMS = [("N", "N", "N.am"), ("CH3", "C", "C.3"), ("H", "H", "H"), ("H1", "H", "H"), ("H2", "H", "H"), ("H3", "H", "H")]
+
+
+# =========================
+# GEOMETRY HELPERS
+# =========================
+def _unit(v: np.ndarray) -> np.ndarray:
+    n = float(np.linalg.norm(v))
+    if n < 1e-8:
+        return np.array([1.0, 0.0, 0.0])
+    return v / n
+
+
+def _any_perpendicular(v: np.ndarray) -> np.ndarray:
+    trial = np.array([1.0, 0.0, 0.0]) if abs(v[0]) < 0.9 else np.array([0.0, 1.0, 0.0])
+    return _unit(np.cross(v, trial))
+
+
+def _place_atom(a: np.ndarray, b: np.ndarray, c: np.ndarray, bond: float, angle: float, torsion: float) -> np.ndarray:
+    """
+    Natural extension reference frame: position D with |CD| = bond,
+    angle(B, C, D) = angle and dihedral(A, B, C, D) = torsion (degrees).
+    """
+    bc = _unit(c - b)
+    n = np.cross(b - a, bc)
+    if np.linalg.norm(n) < 1e-6:
+        n = _any_perpendicular(bc)
+    n = _unit(n)
+    m = np.cross(n, bc)
+
+    theta = math.radians(angle)
+    phi = math.radians(torsion)
+    d = np.array([-bond * math.cos(theta), bond * math.sin(theta) * math.cos(phi), bond * math.sin(theta) * math.sin(phi)])
+    return c + d[0] * bc + d[1] * m + d[2] * n
+
+
+# =========================
+# MOLECULE HELPERS
+# =========================
+class _Molecule:
+    def __init__(self) -> None:
+        self.atoms: List[_Atom] = []
+        self.bonds: Dict[Tuple[int, int], str] = {}
+        self._adjacency: Dict[int, List[int]] = {}
+
+    def add_atom(self, atom: _Atom) -> int:
+        self.atoms.append(atom)
+        return len(self.atoms) - 1
+
+    def add_bond(self, i: int, j: int, bond_type: str) -> None:
+        key = (min(i, j), max(i, j))
+        if key not in self.bonds:
+            self._adjacency.setdefault(i, []).append(j)
+            self._adjacency.setdefault(j, []).append(i)
+        self.bonds[key] = bond_type
+
+    def neighbors(self, i: int) -> List[int]:
+        return list(self._adjacency.get(i, ()))
+
+    def bond_type(self, i: int, j: int) -> str:
+        return self.bonds.get((min(i, j), max(i, j)), "1")
+
+    def reference(self, center: int, anchor: int) -> np.ndarray:
+        """A neighbor of ``anchor`` other than ``center``, used to fix torsions."""
+        for k in self.neighbors(anchor):
+            if k != center and self.atoms[k].element != "H":
+                return self.atoms[k].pos
+        for k in self.neighbors(anchor):
+            if k != center:
+                return self.atoms[k].pos
+        axis = self.atoms[center].pos - self.atoms[anchor].pos
+        return self.atoms[anchor].pos + _any_perpendicular(axis)
+
+
+def _element_of(atom_name: str, atom_type: str) -> str:
+    # Sybyl types carry the element before the dot ("N.am", "C.ar", "Cl");
+    # utils._guess_element would read "N.am" as sodium.
+    head = str(atom_type or "").split(".", 1)[0].strip()
+    if "." in str(atom_type or "") and head:
+        return head[0].upper() + head[1:].lower()
+    return _guess_element(atom_name, atom_type)
+
+
+def _read_residue(mol2_path: Path) -> _Molecule:
+    atoms = _parse_mol2_atoms(str(mol2_path))
+    bonds = _parse_mol2_bonds_with_types(str(mol2_path))
+
+    mol = _Molecule()
+    index_by_id: Dict[int, int] = {}
+    for a in atoms:
+        element = _element_of(a.name, a.atype)
+        if element == "H" or a.name.strip().upper() == "OXT":
+            continue
+        index_by_id[a.atom_id] = mol.add_atom(
+            _Atom(a.name.strip(), element, a.atype, np.array([a.x, a.y, a.z], dtype=float), a.subst_name, a.charge)
+        )
+
+    for b in bonds:
+        if b.a1 in index_by_id and b.a2 in index_by_id:
+            mol.add_bond(index_by_id[b.a1], index_by_id[b.a2], b.btype)
+
+    # Dropping OXT leaves half a carboxylate; the remaining oxygen is a carbonyl.
+    for i, atom in enumerate(mol.atoms):
+        if atom.atom_type.upper() != "O.CO2" or len(mol.neighbors(i)) != 1:
+            continue
+        carbon = mol.neighbors(i)[0]
+        if sum(mol.atoms[j].atom_type.upper() == "O.CO2" for j in mol.neighbors(carbon)) == 1:
+            atom.atom_type = "O.2"
+            mol.add_bond(i, carbon, "2")
+    return mol
+
+
+def _effective_bond_order(mol: _Molecule, i: int, j: int) -> float:
+    order = _BOND_ORDER.get(str(mol.bond_type(i, j)).upper(), 1.0)
+    if order == 1.0:
+        # Files that flatten every bond to "1" still mark carbonyls through the
+        # terminal O.2/S.2 type; honour it so the carbon does not get an extra H.
+        for end in (i, j):
+            at = mol.atoms[end].atom_type.upper()
+            if at in {"O.2", "S.2"} and len(mol.neighbors(end)) == 1:
+                return 2.0
+    return order
+
+
+def _hybridization(mol: _Molecule, i: int) -> str:
+    atom_type = mol.atoms[i].atom_type.upper()
+    suffix = atom_type.split(".", 1)[1] if "." in atom_type else ""
+    if suffix in {"3", "4"}:
+        return "sp3"
+    if suffix in {"2", "AR", "AM", "PL3", "CO2", "CAT"}:
+        return "sp2"
+    if suffix == "1":
+        return "sp"
+
+    orders = [_effective_bond_order(mol, i, j) for j in mol.neighbors(i)]
+    if any(o >= 3.0 for o in orders):
+        return "sp"
+    if any(o >= 1.5 for o in orders):
+        return "sp2"
+    return "sp3"
+
+
+def _missing_hydrogens(mol: _Molecule, i: int) -> int:
+    atom = mol.atoms[i]
+    atom_type = atom.atom_type.upper()
+    if atom_type in {"O.CO2", "N.AR"}:
+        return 0
+    if atom_type in _TRIGONAL_TYPES:
+        # Planar centres carry exactly three sigma bonds whatever the
+        # aromatic/delocalised bond orders add up to (pyrrole N-H, Arg NE-H).
+        return max(0, 3 - len(mol.neighbors(i)))
+
+    valence = _VALENCE.get(atom.element)
+    if valence is None:
+        return 0
+    if atom_type == "N.4":
+        valence = 4
+
+    used = sum(_effective_bond_order(mol, i, j) for j in mol.neighbors(i))
+    return max(0, int(math.floor(valence - used + 0.5)))
+
+
+def _hydrogen_positions(mol: _Molecule, i: int, count: int) -> List[np.ndarray]:
+    center = mol.atoms[i].pos
+    nbrs = mol.neighbors(i)
+    length = _XH_BOND_LENGTH.get(mol.atoms[i].element, 1.0)
+    geometry = _hybridization(mol, i)
+    units = [_unit(mol.atoms[j].pos - center) for j in nbrs]
+
+    if not nbrs:
+        directions = [np.array(v, dtype=float) for v in ((1, 1, 1), (-1, -1, 1), (-1, 1, -1), (1, -1, -1))]
+        return [center + length * _unit(d) for d in directions[:count]]
+
+    if geometry == "sp":
+        return [center - length * units[0]][:count]
+
+    if len(nbrs) == 1:
+        anchor = nbrs[0]
+        ref = mol.reference(i, anchor)
+        if geometry == "sp2":
+            return [_place_atom(ref, mol.atoms[anchor].pos, center, length, 120.0, t) for t in (180.0, 0.0)][:count]
+        return [_place_atom(ref, mol.atoms[anchor].pos, center, length, 109.5, t) for t in (180.0, 60.0, -60.0)][:count]
+
+    bisector = -_unit(sum(units))
+    if geometry == "sp2" or len(nbrs) >= 3:
+        return [center + length * bisector][:count]
+
+    # sp3 with two heavy neighbors: the two H sit above and below their plane.
+    normal = _unit(np.cross(units[0], units[1]))
+    half = math.radians(109.5 / 2.0)
+    return [
+        center + length * _unit(bisector * math.cos(half) + s * normal * math.sin(half))
+        for s in (1.0, -1.0)
+    ][:count]
+
+
+def _hydrogen_names(parent: _Atom, count: int, used: set[str]) -> List[str]:
+    stem = parent.name
+    if stem.upper().startswith(parent.element.upper()):
+        stem = stem[len(parent.element):]
+    base = f"H{stem}"
+    candidates = [base] if count == 1 else [f"{base}{k}" for k in range(1, count + 1)]
+
+    names: List[str] = []
+    for cand in candidates:
+        name = _make_unique_name(cand, used)
+        used.add(name)
+        names.append(name)
+    return names
+
+
+def _add_hydrogens(mol: _Molecule, atom_indices: Sequence[int]) -> List[int]:
+    """Add missing hydrogens to ``atom_indices``; returns them in output order (each heavy atom then its H)."""
+    # Atom names only have to be unique within a residue.
+    used: Dict[str, set[str]] = {}
+    for a in mol.atoms:
+        used.setdefault(a.subst_name, set()).add(a.name)
+
+    order: List[int] = []
+    for i in atom_indices:
+        order.append(i)
+        count = _missing_hydrogens(mol, i)
+        if count == 0:
+            continue
+        parent = mol.atoms[i]
+        names = _hydrogen_names(parent, count, used[parent.subst_name])
+        for name, pos in zip(names, _hydrogen_positions(mol, i, count)):
+            h = mol.add_atom(_Atom(name, "H", "H", pos, parent.subst_name))
+            mol.add_bond(i, h, "1")
+            order.append(h)
+    return order
+
+
+# =========================
+# CAPS
+# =========================
+def _attach_ace(mol: _Molecule, head: int) -> List[int]:
+    n_pos = mol.atoms[head].pos
+    anchor = next((j for j in mol.neighbors(head) if mol.atoms[j].element != "H"), None)
+    if anchor is not None:
+        a_pos = mol.atoms[anchor].pos
+        r_pos = mol.reference(head, anchor)
+    else:
+        a_pos = n_pos + np.array([1.45, 0.0, 0.0])
+        r_pos = a_pos + np.array([0.0, 1.0, 0.0])
+
+    c = _place_atom(r_pos, a_pos, n_pos, 1.335, 121.9, 180.0)
+    o = _place_atom(a_pos, n_pos, c, 1.229, 122.5, 0.0)
+    ch3 = _place_atom(a_pos, n_pos, c, 1.522, 116.2, 180.0)
+    hs = [_place_atom(n_pos, c, ch3, 1.09, 109.5, t) for t in (60.0, 180.0, -60.0)]
+
+    idx = [
+        mol.add_atom(_Atom(name, element, atom_type, pos, "ACE"))
+        for (name, element, atom_type), pos in zip(_ACE_ATOMS, [c, o, ch3, *hs])
+    ]
+    mol.add_bond(head, idx[0], "am")
+    mol.add_bond(idx[0], idx[1], "2")
+    mol.add_bond(idx[0], idx[2], "1")
+    for h in idx[3:]:
+        mol.add_bond(idx[2], h, "1")
+    return idx
+
+
+def _attach_nme(mol: _Molecule, tail: int) -> List[int]:
+    c_pos = mol.atoms[tail].pos
+    heavy = [j for j in mol.neighbors(tail) if mol.atoms[j].element != "H"]
+    oxygen = next((j for j in heavy if mol.atoms[j].element == "O"), None)
+    anchor = next((j for j in heavy if j != oxygen), None)
+
+    a_pos = mol.atoms[anchor].pos if anchor is not None else c_pos + np.array([1.52, 0.0, 0.0])
+    r_pos = mol.atoms[oxygen].pos if oxygen is not None else (
+        mol.reference(tail, anchor) if anchor is not None else a_pos + np.array([0.0, 1.0, 0.0])
+    )
+
+    n = _place_atom(r_pos, a_pos, c_pos, 1.335, 116.2, 180.0)
+    ch3 = _place_atom(a_pos, c_pos, n, 1.449, 121.9, 180.0)
+    h = _place_atom(a_pos, c_pos, n, 1.01, 119.8, 0.0)
+    hs = [_place_atom(c_pos, n, ch3, 1.09, 109.5, t) for t in (60.0, 180.0, -60.0)]
+
+    idx = [
+        mol.add_atom(_Atom(name, element, atom_type, pos, "NME"))
+        for (name, element, atom_type), pos in zip(_NME_ATOMS, [n, ch3, h, *hs])
+    ]
+    mol.add_bond(tail, idx[0], "am")
+    mol.add_bond(idx[0], idx[1], "1")
+    mol.add_bond(idx[0], idx[2], "1")
+    for hh in idx[3:]:
+        mol.add_bond(idx[1], hh, "1")
+    return idx
+
+
+def _rename_cap(mol: _Molecule, idx: Sequence[int], prefix: str) -> None:
+    # Same scheme as capping._safe_unique_rename: <prefix><n>, uniquified against all names.
+    used = {a.name for a in mol.atoms}
+    for k, i in enumerate(idx, start=1):
+        used.discard(mol.atoms[i].name)
+        name = _make_unique_name(f"{prefix}{k}", used)
+        used.add(name)
+        mol.atoms[i].name = name
+
+
+def _find_atom(mol: _Molecule, name: Optional[str], exclude_subst: str = "") -> Optional[int]:
+    if not name:
+        return None
+    for i, a in enumerate(mol.atoms):
+        if a.name == name and a.subst_name.upper() != exclude_subst:
+            return i
+    return None
+
+
+# =========================
+# OUTPUT
+# =========================
+def _write_mol2(mol: _Molecule, order: List[int], out: Path, title: str) -> None:
+    subst_ids: Dict[str, int] = {}
+    for i in order:
+        subst_ids.setdefault(mol.atoms[i].subst_name, len(subst_ids) + 1)
+
+    new_id = {i: k for k, i in enumerate(order, start=1)}
+    bonds = sorted((min(new_id[a], new_id[b]), max(new_id[a], new_id[b]), t) for (a, b), t in mol.bonds.items())
+
+    lines = ["@<TRIPOS>MOLECULE", title, f"{len(order)} {len(bonds)} {len(subst_ids)}", "SMALL", "USER_CHARGES", "", "@<TRIPOS>ATOM"]
+    for i in order:
+        a = mol.atoms[i]
+        x, y, z = (float(v) for v in a.pos)
+        lines.append(
+            f"{new_id[i]:>7} {a.name:<6} {x:>10.4f} {y:>10.4f} {z:>10.4f} "
+            f"{a.atom_type:<6} {subst_ids[a.subst_name]:>4} {a.subst_name:<6} {a.charge:>10.6f}"
+        )
+
+    lines.append("@<TRIPOS>BOND")
+    for k, (a1, a2, t) in enumerate(bonds, start=1):
+        lines.append(f"{k:>6} {a1:>5} {a2:>5} {t}")
+
+    lines.append("@<TRIPOS>SUBSTRUCTURE")
+    for subst_name, sid in subst_ids.items():
+        root = new_id[next(i for i in order if mol.atoms[i].subst_name == subst_name)]
+        lines.append(f"{sid:>6} {subst_name:<6} {root:>5} RESIDUE")
+
+    out.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+
+def cap_residue_geometric(residue_folder: Path, head_name: Optional[str], tail_name: Optional[str]) -> dict:
+    """
+    PyMOL-free equivalent of capping.cap_residue: strips hydrogens and OXT from
+    residue.mol2, attaches ACE/NME on the head/tail atoms, re-adds hydrogens and
+    writes residue_capped.mol2 plus residue_capping_meta.json.
+    """
+    residue_folder = Path(residue_folder).resolve()
+    input_file = residue_folder / "residue.mol2"
+    output_file = residue_folder / "residue_capped.mol2"
+    meta_file = residue_folder / "residue_capping_meta.json"
+
+    if not input_file.exists():
+        raise FileNotFoundError(f"{input_file} not found!")
+
+    head_name = _normalize_name_arg(head_name)
+    tail_name = _normalize_name_arg(tail_name)
+
+    mol = _read_residue(input_file)
+    residue_atoms = list(range(len(mol.atoms)))
+
+    head = _find_atom(mol, head_name)
+    ace = _attach_ace(mol, head) if head is not None else []
+    if ace:
+        _rename_cap(mol, ace, "AC")
+
+    tail = _find_atom(mol, tail_name, exclude_subst="ACE")
+    nme = _attach_nme(mol, tail) if tail is not None else []
+    if nme:
+        _rename_cap(mol, nme, "NM")
+
+    residue_order = _add_hydrogens(mol, residue_atoms)
+    title = mol.atoms[0].subst_name if mol.atoms else "UNK"
+    _write_mol2(mol, ace + residue_order + nme, output_file, title)
+
+    applied_caps = (["ACE"] if ace else []) + (["NME"] if nme else [])
+    meta = {
+        "requested_head_name": head_name,
+        "requested_tail_name": tail_name,
+        "has_head": bool(ace),
+        "has_tail": bool(nme),
+        "applied_caps": applied_caps,
+        "capping_engine": "geometric",
+    }
+    meta_file.write_text(json.dumps(meta, indent=2), encoding="utf-8")
+    return meta
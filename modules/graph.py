@@ -0,0 +1,238 @@
+from __future__ import annotations
+
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+# =========================
+# CSR GRAPH
+# =========================
+class CSRGraph:
+    """
+    Undirected molecular graph in compressed sparse row form.
+
+    Nodes carry external labels (MOL2 atom ids, atom indices, ...) and every
+    method takes and returns labels. Row ``r`` has the neighbor rows
+    ``neighbors[offsets[r]:offsets[r + 1]]``, sorted ascending; duplicate bonds
+    and self bonds are dropped, as are bonds to labels that are not nodes.
+    """
+
+    __slots__ = ("labels", "offsets", "neighbors", "_row", "_off", "_nbr", "_lab")
+
+    def __init__(self, labels: np.ndarray, offsets: np.ndarray, neighbors: np.ndarray):
+        self.labels = labels
+        self.offsets = offsets
+        self.neighbors = neighbors
+        self._row: Optional[Dict[int, int]] = None
+        self._off: Optional[List[int]] = None
+        self._nbr: Optional[List[int]] = None
+        self._lab: Optional[List[int]] = None
+
+    # ---- construction --------------------------------------------------
+    @classmethod
+    def from_edges(cls, nodes: Iterable[int], a1: Sequence[int], a2: Sequence[int]) -> "CSRGraph":
+        labels = np.asarray(list(nodes) if not isinstance(nodes, np.ndarray) else nodes, dtype=np.int64)
+        a1 = np.asarray(a1, dtype=np.int64)
+        a2 = np.asarray(a2, dtype=np.int64)
+        n = len(labels)
+
+        if n and len(a1):
+            order = np.argsort(labels, kind="stable")
+            sorted_labels = labels[order]
+            rows = []
+            known = np.ones(len(a1), dtype=bool)
+            for col in (a1, a2):
+                pos = np.minimum(np.searchsorted(sorted_labels, col), n - 1)
+                known &= sorted_labels[pos] == col
+                rows.append(order[pos])
+            u, v = rows[0][known], rows[1][known]
+            keep = u != v
+            u, v = u[keep], v[keep]
+        else:
+            u = v = np.zeros(0, dtype=np.int64)
+
+        src = np.concatenate([u, v])
+        dst = np.concatenate([v, u])
+        if len(src):
+            key = np.sort(src * n + dst)
+            key = key[np.concatenate([[True], key[1:] != key[:-1]])]
+            src, dst = key // n, key % n
+        offsets = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=n), out=offsets[1:])
+        return cls(labels, offsets, dst.astype(np.int32))
+
+    @classmethod
+    def from_pairs(cls, nodes: Iterable[int], pairs: Iterable[Tuple[int, int]]) -> "CSRGraph":
+        flat = np.asarray(list(pairs), dtype=np.int64).reshape(-1, 2)
+        return cls.from_edges(nodes, flat[:, 0], flat[:, 1])
+
+    @classmethod
+    def from_bonds(cls, nodes: Iterable[int], bonds: Iterable) -> "CSRGraph":
+        """Graph over ``nodes`` from objects with ``a1`` / ``a2`` attributes."""
+        return cls.from_pairs(nodes, ((b.a1, b.a2) for b in bonds))
+
+    # ---- lookup --------------------------------------------------------
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def __contains__(self, label: object) -> bool:
+        return label in self._rows()
+
+    def _rows(self) -> Dict[int, int]:
+        if self._row is None:
+            self._row = {label: i for i, label in enumerate(self._label_list())}
+        return self._row
+
+    def _label_list(self) -> List[int]:
+        if self._lab is None:
+            self._lab = self.labels.tolist()
+        return self._lab
+
+    def _lists(self) -> Tuple[List[int], List[int]]:
+        # Plain-int mirrors of the CSR arrays for the Python traversals below.
+        if self._off is None:
+            self._off = self.offsets.tolist()
+            self._nbr = self.neighbors.tolist()
+        return self._off, self._nbr
+
+    def neighbors_of(self, label: int) -> List[int]:
+        row = self._rows().get(label)
+        if row is None:
+            return []
+        off, nbr = self._lists()
+        lab = self._label_list()
+        return [lab[j] for j in nbr[off[row] : off[row + 1]]]
+
+    def degree(self, label: int) -> int:
+        row = self._rows().get(label)
+        return 0 if row is None else int(self.offsets[row + 1] - self.offsets[row])
+
+    def degrees(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    def edges(self) -> np.ndarray:
+        """(n_edges, 2) label pairs with the smaller row first."""
+        src = np.repeat(np.arange(len(self.labels)), np.diff(self.offsets))
+        mask = src < self.neighbors
+        return np.stack([self.labels[src[mask]], self.labels[self.neighbors[mask]]], axis=1)
+
+    # ---- traversal -----------------------------------------------------
+    def shortest_path(self, start: int, goal: int) -> Optional[List[int]]:
+        """BFS path of labels from ``start`` to ``goal``, or None."""
+        if start == goal:
+            return [start]
+        rows = self._rows()
+        s, g = rows.get(start), rows.get(goal)
+        if s is None or g is None:
+            return None
+
+        off, nbr = self._lists()
+        prev = [-1] * len(self.labels)
+        prev[s] = s
+        queue = deque([s])
+        while queue:
+            cur = queue.popleft()
+            for nxt in nbr[off[cur] : off[cur + 1]]:
+                if prev[nxt] != -1:
+                    continue
+                prev[nxt] = cur
+                if nxt == g:
+                    path = [g]
+                    while path[-1] != s:
+                        path.append(prev[path[-1]])
+                    lab = self._label_list()
+                    return [lab[r] for r in reversed(path)]
+                queue.append(nxt)
+        return None
+
+    def _hop_rows(self, row: int, k: Optional[int]) -> Dict[int, int]:
+        off, nbr = self._lists()
+        depth = {row: 0}
+        queue = deque([row])
+        while queue:
+            cur = queue.popleft()
+            d = depth[cur]
+            if k is not None and d >= k:
+                continue
+            for nxt in nbr[off[cur] : off[cur + 1]]:
+                if nxt not in depth:
+                    depth[nxt] = d + 1
+                    queue.append(nxt)
+        return depth
+
+    def k_hop(self, label: int, k: int) -> Dict[int, int]:
+        """``{label: distance}`` of every node within ``k`` bonds of ``label``."""
+        row = self._rows().get(label)
+        if row is None:
+            return {}
+        lab = self._label_list()
+        return {lab[r]: d for r, d in self._hop_rows(row, k).items()}
+
+    def component_labels(self) -> np.ndarray:
+        """Component number per row, numbered in order of first row."""
+        off, nbr = self._lists()
+        comp = np.full(len(self.labels), -1, dtype=np.int64)
+        seen = bytearray(len(self.labels))
+        count = 0
+        for root in range(len(self.labels)):
+            if seen[root]:
+                continue
+            seen[root] = 1
+            stack = [root]
+            members = []
+            while stack:
+                cur = stack.pop()
+                members.append(cur)
+                for nxt in nbr[off[cur] : off[cur + 1]]:
+                    if not seen[nxt]:
+                        seen[nxt] = 1
+                        stack.append(nxt)
+            comp[members] = count
+            count += 1
+        return comp
+
+    def connected_components(self) -> List[List[int]]:
+        comp = self.component_labels()
+        if not len(comp):
+            return []
+        order = np.argsort(comp, kind="stable")
+        starts = np.flatnonzero(np.diff(comp[order])) + 1
+        return [self.labels[part].tolist() for part in np.split(order, starts)]
+
+    def is_connected(self) -> bool:
+        return len(self.labels) <= 1 or int(self.component_labels().max()) == 0
+
+    def rings(self, max_size: int = 6) -> List[Tuple[int, ...]]:
+        """Smallest ring through every bond, up to ``max_size`` atoms, as label tuples."""
+        off, nbr = self._lists()
+        rings: Dict[frozenset, Tuple[int, ...]] = {}
+        for a, b in self._edge_rows():
+            # BFS from a to b without using the a-b bond.
+            parent = {a: -1}
+            depth = {a: 0}
+            queue = deque([a])
+            while queue and b not in parent:
+                cur = queue.popleft()
+                if depth[cur] >= max_size - 1:
+                    continue
+                for nxt in nbr[off[cur] : off[cur + 1]]:
+                    if nxt in parent or (cur == a and nxt == b):
+                        continue
+                    parent[nxt] = cur
+                    depth[nxt] = depth[cur] + 1
+                    queue.append(nxt)
+
+            if b not in parent:
+                continue
+            path = [b]
+            while parent[path[-1]] != -1:
+                path.append(parent[path[-1]])
+            if len(path) <= max_size:
+                rings.setdefault(frozenset(path), tuple(self._label_list()[r] for r in path))
+        return list(rings.values())
+
+    def _edge_rows(self) -> List[Tuple[int, int]]:
+        off, nbr = self._lists()
+        return [(r, j) for r in range(len(self.labels)) for j in nbr[off[r] : off[r + 1]] if r < j]
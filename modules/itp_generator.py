@@ -1,34 +1,39 @@
 # modules/itp_generator.py
 from __future__ import annotations
 
+from typing import TextIO
+
+import numpy as np
+
+from .mol2 import require_atoms
+from .topology import build_topology
 from .utils import (
     get_atomtypes,
     get_mass,
     extract_charges,
-    get_bonds_angles_dihedrals,
-    get_impropers,
-    get_pairs,
-    fix_duplicates,
 )
 
 
+def _write_terms(f: TextIO, header: str, terms: np.ndarray, funct: int) -> None:
+    f.write(f"\n{header}\n")
+    if not len(terms):
+        return
+    line = " ".join(["%5d"] * terms.shape[1]) + f" {funct}\n"
+    f.write((line * len(terms)) % tuple(terms.ravel().tolist()))
+
+
 def generate_gromacs_itp(mol2_path: str, frcmod_paths, output_path: str, resname: str) -> None:
     """
-    Generates a *structure-level* ITP (atoms/bonds/angles/dihedrals/pairs).
+    Generates a *structure-level* ITP (atoms/bonds/pairs/angles/dihedrals/impropers).
     It does not invent LJ/dihedral parameters; those should come from a GROMACS forcefield
     or from an Amber-export route (ParmEd recommended).
     """
-    atoms, atomtypes = get_atomtypes(mol2_path)
-    charges = extract_charges(mol2_path)
-    masses = [get_mass(a["type"]) for a in atoms]
-
-    bonds, angles, dihedrals = get_bonds_angles_dihedrals(mol2_path)
-    impropers = get_impropers(mol2_path)
-    pairs = get_pairs(dihedrals)
-
-    # Fix duplicate issues
-    angles = fix_duplicates(angles)
-    dihedrals = fix_duplicates(dihedrals)
+    mol = require_atoms(mol2_path)
+    atoms, atomtypes = get_atomtypes(mol)
+    charges = extract_charges(mol)
+    mass_of = {t: get_mass(t) for t in {a["type"] for a in atoms}}
+    masses = [mass_of[a["type"]] for a in atoms]
+    topology = build_topology(mol)
 
     with open(output_path, "w", encoding="utf-8") as f:
         f.write("; nsaa-paramgen structure-level itp\n")
@@ -48,22 +53,8 @@ def generate_gromacs_itp(mol2_path: str, frcmod_paths, output_path: str, resname
                 f"{charges[i-1]:>10.6f} {masses[i-1]:>10.5f}\n"
             )
 
-        f.write("\n[ bonds ]\n")
-        for b in bonds:
-            f.write(f"{b}\n")
-
-        f.write("\n[ pairs ]\n")
-        for p in pairs:
-            f.write(f"{p}\n")
-
-        f.write("\n[ angles ]\n")
-        for a in angles:
-            f.write(f"{a}\n")
-
-        f.write("\n[ dihedrals ]\n")
-        for d in dihedrals:
-            f.write(f"{d}\n")
-
-        f.write("\n[ dihedrals ] ; impropers\n")
-        for imp in impropers:
-            f.write(f"{imp}\n")
\ No newline at end of file
+        _write_terms(f, "[ bonds ]", topology.bonds, 1)
+        _write_terms(f, "[ pairs ]", topology.pairs, 1)
+        _write_terms(f, "[ angles ]", topology.angles, 1)
+        _write_terms(f, "[ dihedrals ]", topology.dihedrals, 1)
+        _write_terms(f, "[ dihedrals ] ; impropers", topology.impropers, 4)
\ No newline at end of file
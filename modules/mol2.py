@@ -0,0 +1,492 @@
+from __future__ import annotations
+
+from functools import cached_property
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+
+ATOM_SECTION = "@<TRIPOS>ATOM"
+BOND_SECTION = "@<TRIPOS>BOND"
+
+
+def _find_section(text: str, marker: str, start: int) -> int:
+    """Offset of the next ``marker`` that starts a line (after optional blanks), or -1."""
+    pos = text.find(marker, start)
+    while pos >= 0:
+        line_start = text.rfind("\n", 0, pos) + 1
+        if not text[line_start:pos].strip(" \t"):
+            return pos
+        pos = text.find(marker, pos + 1)
+    return -1
+
+
+# =========================
+# ATOM / BOND VIEWS
+# =========================
+class AtomView:
+    """Read-only view of one atom row of a Mol2Molecule (no per-atom storage)."""
+
+    __slots__ = ("_mol", "_i")
+
+    def __init__(self, mol: "Mol2Molecule", index: int):
+        self._mol = mol
+        self._i = index
+
+    @property
+    def index(self) -> int:
+        return self._i
+
+    @property
+    def atom_id(self) -> int:
+        return int(self._mol.atom_id[self._i])
+
+    @property
+    def name(self) -> str:
+        mol = self._mol
+        return mol._names[mol.name_code[self._i]]
+
+    @property
+    def x(self) -> float:
+        return float(self._mol.xyz[self._i, 0])
+
+    @property
+    def y(self) -> float:
+        return float(self._mol.xyz[self._i, 1])
+
+    @property
+    def z(self) -> float:
+        return float(self._mol.xyz[self._i, 2])
+
+    @property
+    def atom_type(self) -> str:
+        mol = self._mol
+        return mol._atom_types[mol.atom_type_code[self._i]]
+
+    atype = atom_type
+
+    @property
+    def subst_id(self) -> int:
+        return int(self._mol.subst_id[self._i])
+
+    @property
+    def subst_name(self) -> str:
+        mol = self._mol
+        return mol._subst_names[mol.subst_name_code[self._i]]
+
+    @property
+    def charge(self) -> float:
+        return float(self._mol.charge[self._i])
+
+    def _key(self) -> tuple:
+        return (self.atom_id, self.name, self.atom_type, self.subst_id, self.subst_name, self.x, self.y, self.z, self.charge)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, AtomView):
+            return NotImplemented
+        if other._mol is self._mol and other._i == self._i:
+            return True
+        return self._key() == other._key()
+
+    def __hash__(self) -> int:
+        return hash(self._key())
+
+    def __repr__(self) -> str:
+        return f"AtomView(atom_id={self.atom_id}, name={self.name!r}, atom_type={self.atom_type!r}, subst_name={self.subst_name!r})"
+
+
+class BondView:
+    """Read-only view of one bond row of a Mol2Molecule."""
+
+    __slots__ = ("_mol", "_i")
+
+    def __init__(self, mol: "Mol2Molecule", index: int):
+        self._mol = mol
+        self._i = index
+
+    @property
+    def bond_id(self) -> int:
+        return int(self._mol.bond_id[self._i])
+
+    @property
+    def a1(self) -> int:
+        return int(self._mol.bond_a1[self._i])
+
+    @property
+    def a2(self) -> int:
+        return int(self._mol.bond_a2[self._i])
+
+    @property
+    def bond_type(self) -> str:
+        mol = self._mol
+        return mol._bond_types[mol.bond_type_code[self._i]]
+
+    btype = bond_type
+
+    def _key(self) -> tuple:
+        return (self.a1, self.a2, self.bond_type)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, BondView):
+            return NotImplemented
+        return self._key() == other._key()
+
+    def __hash__(self) -> int:
+        return hash(self._key())
+
+    def __repr__(self) -> str:
+        return f"BondView(a1={self.a1}, a2={self.a2}, bond_type={self.bond_type!r})"
+
+
+# Historical names used throughout the utils helpers.
+AtomRec = AtomView
+BondRec = BondView
+
+
+class _Rows(Sequence):
+    __slots__ = ("_mol", "_view", "_size")
+
+    def __init__(self, mol: "Mol2Molecule", view: type, size: int):
+        self._mol = mol
+        self._view = view
+        self._size = size
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._view(self._mol, i) for i in range(*index.indices(self._size))]
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError(index)
+        return self._view(self._mol, index)
+
+    def __iter__(self) -> Iterator:
+        view, mol = self._view, self._mol
+        return (view(mol, i) for i in range(self._size))
+
+
+# =========================
+# COLUMN PARSING
+# =========================
+def _categorical(values: Sequence[str]) -> tuple[np.ndarray, List[str]]:
+    """Encode repeated strings as int32 codes into a lookup table."""
+    lookup: dict[str, int] = {}
+    codes = np.fromiter((lookup.setdefault(v, len(lookup)) for v in values), dtype=np.int32, count=len(values))
+    return codes, list(lookup)
+
+
+def _split_rows(block: str, min_cols: int, uniform: bool = True) -> tuple[Optional[List[str]], int, List[List[str]], List[int]]:
+    """
+    Tokenize a section body. When every row has the same number of columns and
+    there are no blank or short lines in between (what every writer produces),
+    the flat token list is returned for strided column slicing; otherwise the
+    per-line rows of at least ``min_cols`` columns and their line offsets.
+    """
+    body = block.strip()
+    if uniform and body:
+        # Every line must have ncols columns: a matching total alone would hide
+        # rows one column short next to rows one column long.
+        counts = set(map(len, map(str.split, body.split("\n"))))
+        ncols = counts.pop() if len(counts) == 1 else 0
+        if ncols >= min_cols:
+            return body.split(), ncols, [], []
+
+    rows: List[List[str]] = []
+    line_no: List[int] = []
+    for k, line in enumerate(block.split("\n")):
+        parts = line.split()
+        if len(parts) >= min_cols:
+            rows.append(parts)
+            line_no.append(k)
+    return None, 0, rows, line_no
+
+
+def _column(tokens: Optional[List[str]], ncols: int, rows: List[List[str]], k: int, default: Optional[str] = None) -> List[str]:
+    if tokens is not None:
+        return tokens[k::ncols]
+    if default is None:
+        return [r[k] for r in rows]
+    return [r[k] if len(r) > k else default for r in rows]
+
+
+# =========================
+# MOLECULE
+# =========================
+class Mol2Molecule:
+    """
+    Columnar MOL2 molecule. Numeric fields live in NumPy columns (``atom_id``,
+    ``xyz``, ``subst_id``, ``charge``; ``bond_id``, ``bond_a1``, ``bond_a2``)
+    and the repetitive string fields (atom names, atom types, subst names, bond
+    types) as int32 codes into small lookup tables. ``atoms`` / ``bonds`` hand
+    out lightweight views.
+
+    With ``keep_text`` the original text is kept, so an unmodified molecule
+    writes back byte for byte; without it the source file is re-read the first
+    time an edit needs the raw lines. Edits only rewrite the atom lines they
+    touch. Only the first ATOM and BOND blocks are read, as every reader here
+    has always stopped at the first molecule of a multi-molecule file.
+    """
+
+    def __init__(self, text: str, source: Optional[Path] = None, *, keep_text: bool = True):
+        self.source = source
+        self._text: Optional[str] = text if keep_text else None
+        self._lines: Optional[List[str]] = None
+        self._dirty = False
+        self._parse(text)
+
+    # ---- parsing -------------------------------------------------------
+    @staticmethod
+    def _block(text: str, header: str) -> tuple[str, int]:
+        """Body of the first ``header`` section and the line number of its first row."""
+        pos = _find_section(text, header, 0)
+        if pos < 0:
+            return "", 0
+        eol = text.find("\n", pos)
+        start = len(text) if eol < 0 else eol + 1
+        end = _find_section(text, "@<TRIPOS>", start)
+        return text[start : end if end >= 0 else len(text)], text.count("\n", 0, start)
+
+    def _parse(self, text: str) -> None:
+        block, first_line = self._block(text, ATOM_SECTION)
+        tokens, ncols, rows, line_no = _split_rows(block, 8)
+        if tokens is not None:
+            try:
+                self._parse_atom_columns(tokens, ncols, [])
+                # Uniform block: row k sits k lines below the first non-blank line.
+                self._atom_line: Union[int, np.ndarray] = first_line + block[: len(block) - len(block.lstrip())].count("\n")
+            except ValueError:
+                tokens = None
+                _, _, rows, line_no = _split_rows(block, 8, uniform=False)
+        if tokens is None:
+            self._parse_atom_columns(None, 0, rows)
+            self._atom_line = first_line + np.asarray(line_no, dtype=np.int32)
+
+        block, _ = self._block(text, BOND_SECTION)
+        tokens, ncols, rows, _ = _split_rows(block, 4)
+        try:
+            self._parse_bond_columns(tokens, ncols, rows)
+        except ValueError:
+            if tokens is None:
+                raise
+            _, _, rows, _ = _split_rows(block, 4, uniform=False)
+            self._parse_bond_columns(None, 0, rows)
+
+    def _parse_atom_columns(self, tokens: Optional[List[str]], ncols: int, rows: List[List[str]]) -> None:
+        col = lambda k, default=None: _column(tokens, ncols, rows, k, default)  # noqa: E731
+
+        self.atom_id = np.array(col(0), dtype=np.int32)
+        n = len(self.atom_id)
+        self.xyz = np.empty((n, 3), dtype=np.float64)
+        for k in range(3):
+            self.xyz[:, k] = np.array(col(2 + k), dtype=np.float64)
+        self.subst_id = np.array(col(6), dtype=np.int32)
+        if tokens is not None:
+            self.has_charge = np.full(n, ncols >= 9, dtype=bool)
+            self.charge = np.array(col(8), dtype=np.float64) if ncols >= 9 else np.zeros(n, dtype=np.float64)
+        else:
+            self.has_charge = np.array([len(r) >= 9 for r in rows], dtype=bool)
+            self.charge = np.array(col(8, "0.0"), dtype=np.float64)
+
+        self.name_code, self._names = _categorical(col(1))
+        self.atom_type_code, self._atom_types = _categorical(col(5))
+        self.subst_name_code, self._subst_names = _categorical(col(7))
+
+    def _parse_bond_columns(self, tokens: Optional[List[str]], ncols: int, rows: List[List[str]]) -> None:
+        col = lambda k: _column(tokens, ncols, rows, k)  # noqa: E731
+
+        self.bond_id = np.array(col(0), dtype=np.int32)
+        self.bond_a1 = np.array(col(1), dtype=np.int32)
+        self.bond_a2 = np.array(col(2), dtype=np.int32)
+        self.bond_type_code, self._bond_types = _categorical(col(3))
+
+    # ---- access --------------------------------------------------------
+    @property
+    def atoms(self) -> _Rows:
+        return _Rows(self, AtomView, len(self.atom_id))
+
+    @property
+    def bonds(self) -> _Rows:
+        return _Rows(self, BondView, len(self.bond_a1))
+
+    @property
+    def name(self) -> np.ndarray:
+        return np.array(self._names, dtype=np.str_)[self.name_code]
+
+    @property
+    def atom_type(self) -> np.ndarray:
+        return np.array(self._atom_types, dtype=np.str_)[self.atom_type_code]
+
+    @property
+    def subst_name(self) -> np.ndarray:
+        return np.array(self._subst_names, dtype=np.str_)[self.subst_name_code]
+
+    @property
+    def bond_type(self) -> np.ndarray:
+        return np.array(self._bond_types, dtype=np.str_)[self.bond_type_code]
+
+    @property
+    def bond_pairs(self) -> np.ndarray:
+        """(n_bonds, 2) array of atom ids."""
+        return np.stack([self.bond_a1, self.bond_a2], axis=1)
+
+    @property
+    def label(self) -> str:
+        return str(self.source) if self.source is not None else "<mol2>"
+
+    @property
+    def modified(self) -> bool:
+        return self._dirty
+
+    def index_of_id(self) -> dict[int, int]:
+        return {a: i for i, a in enumerate(self.atom_id.tolist())}
+
+    # ---- residue grouping ----------------------------------------------
+    @staticmethod
+    def _group_rows(rows: np.ndarray, keys: np.ndarray) -> Dict[int, np.ndarray]:
+        order = np.lexsort((rows, keys))
+        rows, keys = rows[order], keys[order]
+        if not len(keys):
+            return {}
+        starts = np.flatnonzero(keys[1:] != keys[:-1]) + 1
+        return dict(zip(keys[np.concatenate([[0], starts])].tolist(), np.split(rows, starts)))
+
+    @cached_property
+    def subst_rows(self) -> Dict[int, np.ndarray]:
+        """subst id -> atom row indices in file order, subst ids ascending."""
+        return self._group_rows(np.arange(len(self.subst_id)), self.subst_id)
+
+    @cached_property
+    def bond_substs(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        (subst id of a1, subst id of a2, known) per bond; ``known`` is False for
+        bonds that reference an atom id missing from the ATOM block.
+        """
+        n = len(self.bond_a1)
+        if not len(self.atom_id):
+            return np.zeros(n, dtype=np.int32), np.zeros(n, dtype=np.int32), np.zeros(n, dtype=bool)
+
+        id_order = np.argsort(self.atom_id, kind="stable")
+        sorted_ids = self.atom_id[id_order]
+        ends = []
+        known = np.ones(n, dtype=bool)
+        for col in (self.bond_a1, self.bond_a2):
+            pos = np.minimum(np.searchsorted(sorted_ids, col), len(sorted_ids) - 1)
+            known &= sorted_ids[pos] == col
+            ends.append(self.subst_id[id_order[pos]])
+        return ends[0], ends[1], known
+
+    @cached_property
+    def bonds_by_subst(self) -> Tuple[Dict[int, np.ndarray], Dict[int, np.ndarray]]:
+        """
+        (internal, boundary) bond row indices per subst id, in file order.
+        Internal bonds have both ends in the subst, boundary bonds exactly one.
+        """
+        s1, s2, known = self.bond_substs
+        internal = np.flatnonzero(known & (s1 == s2))
+        boundary = np.flatnonzero(known & (s1 != s2))
+        return (
+            self._group_rows(internal, s1[internal]),
+            self._group_rows(np.concatenate([boundary, boundary]), np.concatenate([s1[boundary], s2[boundary]])),
+        )
+
+    def residue_atoms(self, subst_id: int) -> List["AtomView"]:
+        rows = self.subst_rows.get(int(subst_id))
+        return [] if rows is None else [AtomView(self, i) for i in rows.tolist()]
+
+    def residue_bonds(self, subst_id: int, *, boundary: bool = False) -> List["BondView"]:
+        rows = self.bonds_by_subst[1 if boundary else 0].get(int(subst_id))
+        return [] if rows is None else [BondView(self, i) for i in rows.tolist()]
+
+    # ---- editing -------------------------------------------------------
+    def _line_list(self) -> List[str]:
+        if self._lines is None:
+            text = self._text
+            if text is None:
+                if self.source is None:
+                    raise ValueError("MOL2 molecule was parsed without its text and has no source file")
+                text = self.source.read_text(encoding="utf-8", errors="replace")
+            self._lines = text.split("\n")
+        return self._lines
+
+    def _line_of(self, index: int) -> int:
+        if isinstance(self._atom_line, np.ndarray):
+            return int(self._atom_line[index])
+        return self._atom_line + int(index)
+
+    def atom_parts(self, index: int) -> List[str]:
+        return self._line_list()[self._line_of(index)].split()
+
+    def set_atom(
+        self,
+        index: int,
+        *,
+        name: Optional[str] = None,
+        atype: Optional[str] = None,
+        subst_name: Optional[str] = None,
+        charge: Optional[float] = None,
+    ) -> None:
+        parts = self.atom_parts(index)
+        if name is not None:
+            parts[1] = name
+            if name not in self._names:
+                self._names.append(name)
+            self.name_code[index] = self._names.index(name)
+        if subst_name is not None:
+            if len(parts) < 8:
+                raise ValueError(f"Atom line {parts[0]} in {self.label} has no substructure name column")
+            parts[7] = subst_name
+            if subst_name not in self._subst_names:
+                self._subst_names.append(subst_name)
+            self.subst_name_code[index] = self._subst_names.index(subst_name)
+        if atype is not None:
+            parts[5] = atype
+            if atype not in self._atom_types:
+                self._atom_types.append(atype)
+            self.atom_type_code[index] = self._atom_types.index(atype)
+        if charge is not None:
+            if len(parts) < 9:
+                raise ValueError(f"Atom line {parts[0]} in {self.label} has no charge column")
+            parts[8] = f"{charge:.6f}"
+            self.charge[index] = float(parts[8])
+
+        self._line_list()[self._line_of(index)] = " ".join(parts)
+        self._dirty = True
+
+    def to_text(self) -> str:
+        if not self._dirty and self._text is not None:
+            return self._text
+        text = "\n".join(self._line_list())
+        return text if text.endswith("\n") or not self._dirty else text + "\n"
+
+    def write(self, path: Union[str, Path, None] = None) -> Path:
+        out = Path(path) if path is not None else self.source
+        if out is None:
+            raise ValueError("No output path for MOL2 molecule")
+        out.write_text(self.to_text(), encoding="utf-8")
+        return out
+
+
+Mol2Source = Union[str, Path, Mol2Molecule]
+
+
+def parse_mol2(mol2_path: str | Path, *, keep_text: bool = True) -> Mol2Molecule:
+    path = Path(mol2_path)
+    return Mol2Molecule(path.read_text(encoding="utf-8", errors="replace"), source=path, keep_text=keep_text)
+
+
+def as_molecule(mol2: Mol2Source) -> Mol2Molecule:
+    """Accept a path or an already parsed molecule."""
+    if isinstance(mol2, Mol2Molecule):
+        return mol2
+    return parse_mol2(mol2)
+
+
+def require_atoms(mol2: Mol2Source) -> Mol2Molecule:
+    mol = as_molecule(mol2)
+    if not len(mol.atom_id):
+        raise ValueError(f"No atoms parsed from MOL2: {mol.label}")
+    return mol
@@ -0,0 +1,570 @@
+from __future__ import annotations
+
+import argparse
+import itertools
+import math
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, FrozenSet, Iterable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from modules.geometric_capping import _add_hydrogens, _Atom, _Molecule, _write_mol2
+from modules.graph import CSRGraph
+
+
+@dataclass
+class PDBAtom:
+    serial: int
+    name: str
+    alt_loc: str
+    resname: str
+    chain: str
+    resseq: str
+    icode: str
+    x: float
+    y: float
+    z: float
+    element: str
+    hetatm: bool = False
+
+
+# Single-bond covalent radii (Angstrom). Elements missing here (metals, ions)
+# never get distance-inferred bonds; only explicit CONECT records bond them.
+_COVALENT_RADIUS = {
+    "H": 0.31, "B": 0.84, "C": 0.76, "N": 0.71, "O": 0.66, "F": 0.57, "Si": 1.11,
+    "P": 1.07, "S": 1.05, "Cl": 1.02, "Se": 1.20, "Br": 1.20, "I": 1.39,
+}
+_BOND_TOLERANCE = 0.45
+_MIN_BOND_DISTANCE = 0.40
+
+_TWO_LETTER_ELEMENTS = {"CL", "BR", "SE", "SI", "NA", "MG", "ZN", "FE", "CA", "MN", "CU", "CO", "NI", "CD", "LI"}
+
+# (max triple, max double) bond length per element pair, used for bond orders
+# that geometry alone cannot decide (terminal atoms, non-aromatic sp2 pairs).
+_MULTIPLE_BOND_LENGTH: Dict[FrozenSet[str], Tuple[Optional[float], float]] = {
+    frozenset(("C",)): (1.25, 1.42),
+    frozenset(("C", "N")): (1.20, 1.30),
+    frozenset(("C", "O")): (None, 1.30),
+    frozenset(("C", "S")): (None, 1.70),
+    frozenset(("N",)): (1.15, 1.28),
+    frozenset(("N", "O")): (None, 1.28),
+    frozenset(("P", "O")): (None, 1.55),
+    frozenset(("S", "O")): (None, 1.50),
+}
+
+_PLANAR_RING_TORSION = 15.0
+
+_NEIGHBOR_CELLS = list(itertools.product((-1, 0, 1), repeat=3))
+
+_PROTONATED_RING_N = {"HID": {"ND1"}, "HSD": {"ND1"}, "HIE": {"NE2"}, "HSE": {"NE2"}, "HIS": {"NE2"}, "HIP": {"ND1", "NE2"}, "HSP": {"ND1", "NE2"}}
+
+
+# =========================
+# PDB PARSING
+# =========================
+def _element_of_record(line: str, name: str) -> str:
+    symbol = line[76:78].strip() if len(line) >= 78 else ""
+    if not symbol:
+        raw = line[12:16]
+        letters = "".join(ch for ch in raw if ch.isalpha())
+        if raw[:1].isalpha() and letters[:2].upper() in _TWO_LETTER_ELEMENTS:
+            symbol = letters[:2]
+        else:
+            symbol = letters[:1] or name[:1]
+    return symbol[0].upper() + symbol[1:].lower()
+
+
+def _conect_serials(line: str) -> List[int]:
+    serials: List[int] = []
+    for start in range(6, 31, 5):
+        field = line[start:start + 5].strip()
+        if not field:
+            continue
+        try:
+            serials.append(int(field))
+        except ValueError:
+            return [int(tok) for tok in line.split()[1:] if tok.lstrip("-").isdigit()]
+    return serials
+
+
+def parse_pdb(pdb_path: str | Path) -> Tuple[List[PDBAtom], Set[Tuple[int, int]]]:
+    """
+    Read ATOM/HETATM records of the first model and the CONECT bonds between
+    them (as pairs of serial numbers). Only the first alternate location of an
+    atom is kept.
+    """
+    atoms: List[PDBAtom] = []
+    conect: Set[Tuple[int, int]] = set()
+    seen: Set[Tuple[str, str, str, str]] = set()
+
+    for line in Path(pdb_path).read_text(encoding="utf-8", errors="replace").splitlines():
+        record = line[:6].strip().upper()
+
+        if record in {"ATOM", "HETATM"}:
+            name = line[12:16].strip()
+            chain = line[21:22].strip()
+            resseq = line[22:26].strip()
+            icode = line[26:27].strip()
+            key = (chain, resseq, icode, name)
+            if key in seen:
+                continue
+            seen.add(key)
+
+            try:
+                x, y, z = float(line[30:38]), float(line[38:46]), float(line[46:54])
+                serial = int(line[6:11])
+            except ValueError as e:
+                raise ValueError(f"Malformed {record} record in {pdb_path}: {line!r}") from e
+
+            atoms.append(
+                PDBAtom(
+                    serial=serial,
+                    name=name,
+                    alt_loc=line[16:17].strip(),
+                    resname=line[17:20].strip(),
+                    chain=chain,
+                    resseq=resseq,
+                    icode=icode,
+                    x=x,
+                    y=y,
+                    z=z,
+                    element=_element_of_record(line, name),
+                    hetatm=record == "HETATM",
+                )
+            )
+        elif record == "CONECT":
+            serials = _conect_serials(line)
+            for other in serials[1:]:
+                if other != serials[0]:
+                    conect.add((min(serials[0], other), max(serials[0], other)))
+        elif record == "ENDMDL" and atoms:
+            break
+
+    return atoms, conect
+
+
+# =========================
+# BOND PERCEPTION
+# =========================
+def _distance_bonds(coords: np.ndarray, radii: np.ndarray, candidates: Sequence[int]) -> List[Tuple[int, int]]:
+    """
+    Covalent bonds by distance among ``candidates`` using a cell list: atoms are
+    binned into cubes of the largest possible bond length, so each atom is only
+    compared with the 27 surrounding cells instead of the whole structure.
+    """
+    if len(candidates) < 2:
+        return []
+
+    idx = np.asarray(candidates, dtype=int)
+    cell_size = 2.0 * float(radii[idx].max()) + _BOND_TOLERANCE
+    cells = np.floor(coords[idx] / cell_size).astype(int)
+
+    grid: Dict[Tuple[int, int, int], List[int]] = {}
+    for i, cell in zip(idx.tolist(), map(tuple, cells.tolist())):
+        grid.setdefault(cell, []).append(i)
+
+    bonds: List[Tuple[int, int]] = []
+    for (cx, cy, cz), members in grid.items():
+        nearby = np.array(
+            [j for dx, dy, dz in _NEIGHBOR_CELLS for j in grid.get((cx + dx, cy + dy, cz + dz), ())],
+            dtype=int,
+        )
+        for i in members:
+            others = nearby[nearby > i]
+            if others.size == 0:
+                continue
+            dist = np.linalg.norm(coords[others] - coords[i], axis=1)
+            ok = (dist > _MIN_BOND_DISTANCE) & (dist <= radii[i] + radii[others] + _BOND_TOLERANCE)
+            bonds.extend((i, int(j)) for j in others[ok])
+    return bonds
+
+
+def _bond_length(mol: _Molecule, i: int, j: int) -> float:
+    return float(np.linalg.norm(mol.atoms[i].pos - mol.atoms[j].pos))
+
+
+def _length_order(mol: _Molecule, i: int, j: int) -> int:
+    limits = _MULTIPLE_BOND_LENGTH.get(frozenset((mol.atoms[i].element, mol.atoms[j].element)))
+    if limits is None:
+        return 1
+    triple, double = limits
+    d = _bond_length(mol, i, j)
+    if triple is not None and d <= triple:
+        return 3
+    if d <= double:
+        return 2
+    return 1
+
+
+def _angle(a: np.ndarray, center: np.ndarray, b: np.ndarray) -> float:
+    u, v = a - center, b - center
+    cos = float(np.dot(u, v) / max(np.linalg.norm(u) * np.linalg.norm(v), 1e-8))
+    return math.degrees(math.acos(max(-1.0, min(1.0, cos))))
+
+
+def _geometry(mol: _Molecule, i: int) -> str:
+    nbrs = mol.neighbors(i)
+    if len(nbrs) >= 4:
+        return "sp3"
+    if len(nbrs) == 1:
+        order = _length_order(mol, i, nbrs[0])
+        return {3: "sp", 2: "sp2"}.get(order, "sp3")
+    if not nbrs:
+        return "sp3"
+
+    center = mol.atoms[i].pos
+    angles = [_angle(mol.atoms[a].pos, center, mol.atoms[b].pos) for a, b in itertools.combinations(nbrs, 2)]
+    mean = sum(angles) / len(angles)
+    if len(nbrs) == 2 and mean >= 155.0:
+        return "sp"
+    return "sp2" if mean >= 115.0 else "sp3"
+
+
+def _small_rings(mol: _Molecule, max_size: int = 6) -> List[Tuple[int, ...]]:
+    """Smallest ring through every bond, up to ``max_size`` atoms."""
+    return CSRGraph.from_pairs(range(len(mol.atoms)), mol.bonds).rings(max_size)
+
+
+def _dihedral(p0: np.ndarray, p1: np.ndarray, p2: np.ndarray, p3: np.ndarray) -> float:
+    b0, b1, b2 = p0 - p1, p2 - p1, p3 - p2
+    b1 = b1 / max(float(np.linalg.norm(b1)), 1e-8)
+    v = b0 - np.dot(b0, b1) * b1
+    w = b2 - np.dot(b2, b1) * b1
+    return math.degrees(math.atan2(float(np.dot(np.cross(b1, v), w)), float(np.dot(v, w))))
+
+
+def _is_aromatic_ring(mol: _Molecule, ring: Sequence[int], geometry: Sequence[str]) -> bool:
+    """
+    A flat 5/6-ring of C/N (plus one O/S in five-membered rings) whose
+    substituted atoms are trigonal. Hydrogens are stripped at this point, so
+    two-connected ring atoms are judged by ring planarity alone.
+    """
+    if len(ring) not in (5, 6):
+        return False
+
+    for i in ring:
+        el = mol.atoms[i].element
+        if el in {"O", "S"}:
+            if len(ring) != 5 or len(mol.neighbors(i)) != 2:
+                return False
+        elif el not in {"C", "N"}:
+            return False
+        elif len(mol.neighbors(i)) == 3 and geometry[i] != "sp2":
+            return False
+        elif len(mol.neighbors(i)) > 3:
+            return False
+
+    pos = [mol.atoms[i].pos for i in ring]
+    size = len(ring)
+    torsions = [abs(_dihedral(*(pos[(k + m) % size] for m in range(4)))) for k in range(size)]
+    return max(torsions) <= _PLANAR_RING_TORSION
+
+
+def _protonated_ring_nitrogen(mol: _Molecule, ring: Sequence[int], resname: str) -> Set[int]:
+    """Pick the pyrrole-type N(-H) atoms of a five-membered aromatic ring."""
+    ring_set = set(ring)
+    nitrogens = [i for i in ring if mol.atoms[i].element == "N"]
+    donors = {i for i in ring if mol.atoms[i].element in {"O", "S"}}
+    donors |= {i for i in nitrogens if len(mol.neighbors(i)) == 3}
+    if donors:
+        return {i for i in donors if mol.atoms[i].element == "N"}
+
+    candidates = [i for i in nitrogens if len(mol.neighbors(i)) == 2]
+    if not candidates:
+        return set()
+
+    hinted = _PROTONATED_RING_N.get(resname.upper())
+    if hinted:
+        chosen = {i for i in candidates if mol.atoms[i].name.upper() in hinted}
+        if chosen:
+            return chosen
+
+    # An N-H widens the internal C-N-C angle (~109 vs ~105 degrees for =N-).
+    def internal_angle(i: int) -> float:
+        a, b = [j for j in mol.neighbors(i) if j in ring_set]
+        return _angle(mol.atoms[a].pos, mol.atoms[i].pos, mol.atoms[b].pos)
+
+    return {max(candidates, key=internal_angle)}
+
+
+def perceive_atom_and_bond_types(mol: _Molecule, resnames: Sequence[str]) -> None:
+    """
+    Assign Sybyl atom types and MOL2 bond types to a heavy-atom graph from its
+    geometry: hybridization from bond angles (bond lengths for terminal atoms),
+    aromatic 5/6-rings of planar atoms, amides, carboxylates, guanidinium and
+    remaining C=C/C=N/C=O double bonds.
+    """
+    n = len(mol.atoms)
+    geometry = [_geometry(mol, i) for i in range(n)]
+    orders: Dict[Tuple[int, int], str] = {key: "1" for key in mol.bonds}
+    aromatic: Set[int] = set()
+    pyrrole_n: Set[int] = set()
+
+    def key(i: int, j: int) -> Tuple[int, int]:
+        return (min(i, j), max(i, j))
+
+    # Aromatic rings
+    for ring in _small_rings(mol):
+        if not _is_aromatic_ring(mol, ring, geometry):
+            continue
+        aromatic.update(ring)
+        for i in ring:
+            geometry[i] = "sp2"
+        for a, b in zip(ring, ring[1:] + ring[:1]):
+            orders[key(a, b)] = "ar"
+        if len(ring) == 5:
+            pyrrole_n |= _protonated_ring_nitrogen(mol, ring, resnames[ring[0]])
+
+    # Terminal multiple bonds (C=O, C=S, C#N, P=O, ...)
+    terminal_multiple: Dict[int, int] = {}
+    for i in range(n):
+        nbrs = mol.neighbors(i)
+        if len(nbrs) == 1 and mol.atoms[i].element in {"O", "S", "N", "C"}:
+            order = _length_order(mol, i, nbrs[0])
+            if order > 1 and orders[key(i, nbrs[0])] == "1":
+                terminal_multiple[i] = order
+
+    carboxylate: Set[int] = set()
+    for i in range(n):
+        if mol.atoms[i].element != "C":
+            continue
+        oxygens = [j for j in mol.neighbors(i) if mol.atoms[j].element == "O" and terminal_multiple.get(j) == 2]
+        if len(oxygens) >= 2:
+            carboxylate.update(oxygens[:2])
+            for j in oxygens[:2]:
+                orders[key(i, j)] = "ar"
+        elif oxygens:
+            orders[key(i, oxygens[0])] = "2"
+
+    for i, order in terminal_multiple.items():
+        j = mol.neighbors(i)[0]
+        if orders[key(i, j)] == "1" and not (mol.atoms[i].element == "O" and mol.atoms[j].element == "C"):
+            # Only one terminal double bond per centre unless it is a sulfonyl/phosphoryl.
+            if mol.atoms[j].element in {"S", "P"} or not any(
+                orders[key(j, k)] in {"2", "3"} for k in mol.neighbors(j)
+            ):
+                orders[key(i, j)] = str(order)
+
+    def has_multiple(i: int) -> bool:
+        return any(orders[key(i, j)] in {"2", "3", "ar"} for j in mol.neighbors(i))
+
+    carbonyl_c = {
+        i
+        for i in range(n)
+        if mol.atoms[i].element == "C"
+        and any(orders[key(i, j)] == "2" and mol.atoms[j].element in {"O", "S"} for j in mol.neighbors(i))
+    }
+
+    guanidinium_c = {
+        i
+        for i in range(n)
+        if mol.atoms[i].element == "C"
+        and i not in aromatic
+        and geometry[i] == "sp2"
+        and len(mol.neighbors(i)) == 3
+        and all(mol.atoms[j].element == "N" and j not in aromatic for j in mol.neighbors(i))
+    }
+
+    # Remaining double bonds between planar non-aromatic atoms, shortest first.
+    pairs = sorted(
+        (
+            (i, j)
+            for i, j in mol.bonds
+            if orders[(i, j)] == "1"
+            and geometry[i] in {"sp2", "sp"}
+            and geometry[j] in {"sp2", "sp"}
+            and i not in aromatic | guanidinium_c | carbonyl_c
+            and j not in aromatic | guanidinium_c | carbonyl_c
+        ),
+        key=lambda p: _bond_length(mol, *p),
+    )
+    for i, j in pairs:
+        if has_multiple(i) or has_multiple(j):
+            continue
+        order = _length_order(mol, i, j)
+        if order > 1:
+            orders[(i, j)] = str(order)
+
+    amide_n: Set[int] = set()
+    for i in range(n):
+        if mol.atoms[i].element != "N" or i in aromatic or len(mol.neighbors(i)) > 3:
+            continue
+        for j in mol.neighbors(i):
+            if j in carbonyl_c and orders[key(i, j)] == "1":
+                amide_n.add(i)
+                orders[key(i, j)] = "am"
+                break
+
+    for i, atom in enumerate(mol.atoms):
+        el = atom.element
+        nbrs = mol.neighbors(i)
+        geo = geometry[i]
+
+        if el == "C":
+            if i in aromatic:
+                atom.atom_type = "C.ar"
+            elif i in guanidinium_c:
+                atom.atom_type = "C.cat"
+            elif geo == "sp" or any(orders[key(i, j)] == "3" for j in nbrs):
+                atom.atom_type = "C.1"
+            elif geo == "sp2" or has_multiple(i):
+                atom.atom_type = "C.2"
+            else:
+                atom.atom_type = "C.3"
+        elif el == "N":
+            if i in aromatic:
+                atom.atom_type = "N.pl3" if i in pyrrole_n else "N.ar"
+            elif i in amide_n:
+                atom.atom_type = "N.am"
+            elif len(nbrs) == 4:
+                atom.atom_type = "N.4"
+            elif any(orders[key(i, j)] == "3" for j in nbrs):
+                atom.atom_type = "N.1"
+            elif any(orders[key(i, j)] == "2" for j in nbrs):
+                atom.atom_type = "N.2"
+            elif any(j in guanidinium_c for j in nbrs) or geo == "sp2":
+                atom.atom_type = "N.pl3"
+            else:
+                atom.atom_type = "N.3"
+        elif el == "O":
+            if i in carboxylate:
+                atom.atom_type = "O.co2"
+            elif any(orders[key(i, j)] == "2" for j in nbrs):
+                atom.atom_type = "O.2"
+            else:
+                atom.atom_type = "O.3"
+        elif el == "S":
+            terminal_o = [j for j in nbrs if mol.atoms[j].element == "O" and orders[key(i, j)] == "2"]
+            if len(terminal_o) >= 2:
+                atom.atom_type = "S.o2"
+            elif terminal_o:
+                atom.atom_type = "S.o"
+            elif any(orders[key(i, j)] == "2" for j in nbrs):
+                atom.atom_type = "S.2"
+            else:
+                atom.atom_type = "S.3"
+        elif el == "P":
+            atom.atom_type = "P.3"
+        else:
+            atom.atom_type = el
+
+    for bond_key, bond_type in orders.items():
+        mol.bonds[bond_key] = bond_type
+
+
+# =========================
+# CONVERSION
+# =========================
+def read_pdb(pdb_path: str | Path) -> _Molecule:
+    """Heavy-atom molecule with perceived bonds and Sybyl types (input hydrogens are dropped)."""
+    atoms, conect = parse_pdb(pdb_path)
+    atoms = [a for a in atoms if a.element != "H"]
+    if not atoms:
+        raise ValueError(f"No heavy atoms found in {pdb_path}")
+
+    mol = _Molecule()
+    index_by_serial: Dict[int, int] = {}
+    for a in atoms:
+        idx = mol.add_atom(_Atom(a.name, a.element, a.element, np.array([a.x, a.y, a.z], dtype=float), f"{a.resname}{a.resseq}"))
+        index_by_serial[a.serial] = idx
+
+    with_conect: Set[int] = set()
+    for s1, s2 in sorted(conect):
+        if s1 in index_by_serial and s2 in index_by_serial:
+            i, j = index_by_serial[s1], index_by_serial[s2]
+            mol.add_bond(i, j, "1")
+            with_conect.update((i, j))
+
+    # Standard residues normally come without CONECT records; infer bonds for
+    # every atom not covered by one (this also links ligands to the protein).
+    coords = np.array([a.pos for a in mol.atoms], dtype=float)
+    radii = np.array([_COVALENT_RADIUS.get(a.element, 0.0) for a in mol.atoms], dtype=float)
+    candidates = [i for i in range(len(mol.atoms)) if radii[i] > 0.0]
+    for i, j in _distance_bonds(coords, radii, candidates):
+        if i not in with_conect or j not in with_conect:
+            mol.add_bond(i, j, "1")
+
+    perceive_atom_and_bond_types(mol, [a.resname for a in atoms])
+    return mol
+
+
+def convert_pdb_file(input_pdb: str | Path, output_mol2: str | Path) -> dict:
+    """
+    Native replacement for pdb_to_mol2.py: read a PDB, drop its hydrogens,
+    perceive bonds and types, add hydrogens and write Tripos MOL2.
+    """
+    input_pdb = Path(input_pdb).resolve()
+    output_mol2 = Path(output_mol2).resolve()
+    if not input_pdb.exists():
+        raise FileNotFoundError(f"{input_pdb} not found!")
+
+    mol = read_pdb(input_pdb)
+    heavy = list(range(len(mol.atoms)))
+    bonds_before = len(mol.bonds)
+    order = _add_hydrogens(mol, heavy)
+
+    title = mol.atoms[0].subst_name.rstrip("0123456789-") or "UNK"
+    output_mol2.parent.mkdir(parents=True, exist_ok=True)
+    _write_mol2(mol, order, output_mol2, title)
+
+    return {
+        "input": str(input_pdb),
+        "output": str(output_mol2),
+        "heavy_atoms": len(heavy),
+        "hydrogens_added": len(order) - len(heavy),
+        "bonds": len(mol.bonds),
+        "heavy_bonds": bonds_before,
+    }
+
+
+def convert_pdb_directory(
+    input_dir: str | Path,
+    output_dir: str | Path,
+    pattern: str = "*.pdb",
+) -> Tuple[List[dict], List[Tuple[Path, str]]]:
+    """Convert every PDB in ``input_dir`` to ``output_dir/<stem>.mol2`` in this process."""
+    input_dir = Path(input_dir).resolve()
+    output_dir = Path(output_dir).resolve()
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    converted: List[dict] = []
+    failed: List[Tuple[Path, str]] = []
+    for pdb in sorted(p for p in input_dir.glob(pattern) if p.is_file()):
+        try:
+            converted.append(convert_pdb_file(pdb, output_dir / f"{pdb.stem}.mol2"))
+        except Exception as e:
+            failed.append((pdb, str(e)))
+    return converted, failed
+
+
+def _print_summary(converted: Iterable[dict], failed: Iterable[Tuple[Path, str]]) -> None:
+    for info in converted:
+        print(f"Conversion successful: {info['output']} ({info['heavy_atoms']} heavy atoms, +{info['hydrogens_added']} H)")
+    for path, err in failed:
+        print(f"[FAILED] {path}: {err}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Convert PDB files to MOL2 without PyMOL")
+    parser.add_argument("input", help="PDB file or directory of PDB files")
+    parser.add_argument("output", help="Output MOL2 file, or output directory when input is a directory")
+    parser.add_argument("--pattern", default="*.pdb", help="Glob used in directory mode (default: *.pdb)")
+    args = parser.parse_args()
+
+    src = Path(args.input)
+    if src.is_dir():
+        converted, failed = convert_pdb_directory(src, args.output, pattern=args.pattern)
+    else:
+        converted, failed = [], []
+        try:
+            converted.append(convert_pdb_file(src, args.output))
+        except Exception as e:
+            failed.append((src, str(e)))
+
+    _print_summary(converted, failed)
+    return 1 if failed or not converted else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
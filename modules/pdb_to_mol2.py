@@ -9,6 +9,21 @@ except Exception:
     pymol = None
 
 
+def convert_pdb_to_mol2(input_pdb: Path, output_mol2: Path) -> int:
+    """Strip and re-add hydrogens with PyMOL and save as MOL2. PyMOL must already be launched."""
+    if not input_pdb.exists():
+        print(f"ERROR: {input_pdb} not found!")
+        return 1
+
+    pymol.cmd.reinitialize()  
+    pymol.cmd.load(str(input_pdb), "prot")  
+    pymol.cmd.remove("hydro")  
+    pymol.cmd.h_add("prot")  
+    pymol.cmd.save(str(output_mol2), "prot")  
+    print(f"Conversion successful: {output_mol2}")
+    return 0
+
+
 def main() -> int:
     if pymol is None:
         print("ERROR: PyMOL is not available in this Python environment. Install/enable PyMOL to use pdb_to_mol2.")
@@ -23,17 +38,7 @@ def main() -> int:
     input_pdb = Path(sys.argv[1]).resolve()
     output_mol2 = Path(sys.argv[2]).resolve()
 
-    if not input_pdb.exists():
-        print(f"ERROR: {input_pdb} not found!")
-        return 1
-
-    pymol.cmd.reinitialize()  
-    pymol.cmd.load(str(input_pdb), "prot")  
-    pymol.cmd.remove("hydro")  
-    pymol.cmd.h_add("prot")  
-    pymol.cmd.save(str(output_mol2), "prot")  
-    print(f"Conversion successful: {output_mol2}")
-    return 0
+    return convert_pdb_to_mol2(input_pdb, output_mol2)
 
 
 if __name__ == "__main__":
@@ -1,12 +1,31 @@
 from __future__ import annotations
 
 import json
+import os
 import subprocess
 from pathlib import Path
 from typing import Any
 
+from modules.canonical import CanonicalForm, mol2_canonical_form, mol2_graph_hashes
+from modules.convergence import SqmMonitor, monitor_settings
+from modules.geometric_capping import cap_residue_geometric
+from modules.mol2 import Mol2Molecule, parse_mol2
+from modules.pdb_reader import convert_pdb_file
+from modules.pymol_worker import get_pymol_worker
+from modules.result_cache import ResultCache, stable_digest
 from modules.run_resp_orca import run_resp_charge_workflow
+from modules.runner import RunAborted, run_streaming
 from modules.split_nonstandard_residues import extract_nonstandard_residues
+from modules.templates import (
+    BACKBONE_FRCMOD,
+    CHARGED_MOL2,
+    LIB,
+    PREPIN,
+    SIDECHAIN_FRCMOD,
+    TemplateLibrary,
+    capped_name_mapping,
+    rename_mol2,
+)
 from modules.utils import (
     classify_residue_net_charge,
     fix_backbone_atom_types,
@@ -17,6 +36,60 @@ from modules.utils import (
 )
 
 
+# sqm settings antechamber uses for AM1-BCC, minus the minimization (maxcyc=0) and with a looser SCF.
+_SQM_FALLBACK_KEYWORDS = "qm_theory='AM1', grms_tol=0.0005, scfconv=1.d-8, ndiis_attempts=700, maxcyc=0"
+
+
+def residue_name_from_file(file_path: str) -> str:
+    p = Path(file_path)
+
+    if p.suffix.lower() == ".mol2":
+        lines = p.read_text(encoding="utf-8", errors="ignore").splitlines()
+
+        in_sub = False
+        for line in lines:
+            if line.startswith("@<TRIPOS>SUBSTRUCTURE"):
+                in_sub = True
+                continue
+            if line.startswith("@<TRIPOS>") and in_sub:
+                break
+            if in_sub:
+                parts = line.split()
+                if len(parts) >= 2:
+                    return normalize_resname(parts[1])
+
+        in_atoms = False
+        for line in lines:
+            if line.startswith("@<TRIPOS>ATOM"):
+                in_atoms = True
+                continue
+            if line.startswith("@<TRIPOS>") and in_atoms:
+                break
+            if in_atoms:
+                parts = line.split()
+                if len(parts) >= 8:
+                    return normalize_resname(parts[7])
+
+    return normalize_resname(p.stem)
+
+
+def read_split_meta(input_path: Path) -> dict:
+    candidates = [
+        input_path.with_suffix(".split.json"),
+        input_path.parent / f"{input_path.stem}.split.json",
+    ]
+    for meta_path in candidates:
+        if not meta_path.exists():
+            continue
+        try:
+            data = json.loads(meta_path.read_text(encoding="utf-8"))
+            if isinstance(data, dict):
+                return data
+        except Exception:
+            continue
+    return {}
+
+
 class NonStandardAminoAcidProcessor:
     def __init__(
         self,
@@ -26,6 +99,14 @@ class NonStandardAminoAcidProcessor:
         default_net_charge: int = 0,
         net_charge_override: int | None = None,
         output_base: str = ".",
+        charge_cache_dir: str | None = None,
+        charge_cache_max_mb: int | None = None,
+        use_pymol_worker: bool | None = None,
+        capping_engine: str | None = None,
+        pdb_converter: str | None = None,
+        template_dir: str | None = None,
+        backbone: str = "ff19SB",
+        sidechain: str = "gaff2",
     ):
         self.input_file = input_file
         self.charge_model = str(charge_model).strip().lower()
@@ -34,45 +115,42 @@ class NonStandardAminoAcidProcessor:
         self.net_charge_override = net_charge_override
         self.output_base = Path(output_base).resolve()
 
-    def _run(self, cmd: list[str], cwd: Path | None = None) -> subprocess.CompletedProcess:
-        return subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            cwd=str(cwd) if cwd else None,
+        cache_dir = charge_cache_dir or os.environ.get("NSAA_CHARGE_CACHE_DIR")
+        if charge_cache_max_mb is None:
+            charge_cache_max_mb = int(os.environ.get("NSAA_CHARGE_CACHE_MAX_MB", "2048"))
+        self.charge_cache = (
+            ResultCache(cache_dir, max_bytes=int(charge_cache_max_mb) * 1024 * 1024) if cache_dir else None
         )
 
+        # Templates hold finished parameters, so they are keyed by the force fields too.
+        self.backbone = backbone
+        self.sidechain = sidechain
+        template_dir = template_dir or os.environ.get("NSAA_TEMPLATE_DIR")
+        template_max_mb = os.environ.get("NSAA_TEMPLATE_MAX_MB")
+        self.templates = (
+            TemplateLibrary(template_dir, max_bytes=int(template_max_mb) * 1024 * 1024 if template_max_mb else None)
+            if template_dir
+            else None
+        )
+
+        if use_pymol_worker is None:
+            use_pymol_worker = os.environ.get("NSAA_PYMOL_WORKER", "1").strip().lower() not in {"0", "false", "no"}
+        self.use_pymol_worker = bool(use_pymol_worker)
+
+        self.capping_engine = str(capping_engine or os.environ.get("NSAA_CAPPING_ENGINE", "pymol")).strip().lower()
+        if self.capping_engine not in {"pymol", "geometric"}:
+            raise ValueError(f"Unsupported capping engine: {self.capping_engine}")
+
+        self.pdb_converter = str(pdb_converter or os.environ.get("NSAA_PDB_CONVERTER", "native")).strip().lower()
+        if self.pdb_converter not in {"native", "pymol"}:
+            raise ValueError(f"Unsupported PDB converter: {self.pdb_converter}")
+
+    def _run(self, cmd: list[str], cwd: Path | None = None, **kwargs: Any) -> subprocess.CompletedProcess:
+        # No log here: the tail kept by the runner goes into the error message.
+        return run_streaming(cmd, cwd=cwd, **kwargs)
+
     def _get_residue_name(self, file_path: str) -> str:
-        p = Path(file_path)
-
-        if p.suffix.lower() == ".mol2":
-            lines = p.read_text(encoding="utf-8", errors="ignore").splitlines()
-
-            in_sub = False
-            for line in lines:
-                if line.startswith("@<TRIPOS>SUBSTRUCTURE"):
-                    in_sub = True
-                    continue
-                if line.startswith("@<TRIPOS>") and in_sub:
-                    break
-                if in_sub:
-                    parts = line.split()
-                    if len(parts) >= 2:
-                        return normalize_resname(parts[1])
-
-            in_atoms = False
-            for line in lines:
-                if line.startswith("@<TRIPOS>ATOM"):
-                    in_atoms = True
-                    continue
-                if line.startswith("@<TRIPOS>") and in_atoms:
-                    break
-                if in_atoms:
-                    parts = line.split()
-                    if len(parts) >= 8:
-                        return normalize_resname(parts[7])
-
-        return normalize_resname(p.stem)
+        return residue_name_from_file(file_path)
 
     def _normalize_nullable_name(self, value: object, default: str | None) -> str | None:
         if value is None:
@@ -85,20 +163,7 @@ class NonStandardAminoAcidProcessor:
         return s
 
     def _read_split_meta(self, input_path: Path) -> dict:
-        candidates = [
-            input_path.with_suffix(".split.json"),
-            input_path.parent / f"{input_path.stem}.split.json",
-        ]
-        for meta_path in candidates:
-            if not meta_path.exists():
-                continue
-            try:
-                data = json.loads(meta_path.read_text(encoding="utf-8"))
-                if isinstance(data, dict):
-                    return data
-            except Exception:
-                continue
-        return {}
+        return read_split_meta(input_path)
 
     def _get_residue_cfg(self, resname: str, input_path: Path | None = None) -> dict:
         raw = dict(self.residue_map.get(resname, {}))
@@ -137,34 +202,66 @@ class NonStandardAminoAcidProcessor:
             "split_meta": split_meta,
         }
 
-    def _prepare_input_mol2(self, input_path: Path, residue_dir: Path) -> Path:
+    def _prepare_input_mol2(self, input_path: Path, residue_dir: Path) -> Mol2Molecule:
         residue_file = residue_dir / "residue.mol2"
         suffix = input_path.suffix.lower()
 
         if suffix == ".mol2":
-            residue_file.write_text(
-                input_path.read_text(encoding="utf-8", errors="replace"),
-                encoding="utf-8",
-            )
-            return residue_file
+            molecule = parse_mol2(input_path)
+            molecule.write(residue_file)
+            molecule.source = residue_file
+            return molecule
 
         if suffix == ".pdb":
-            convert_script = Path(__file__).parent / "pdb_to_mol2.py"
-            result = self._run(
-                ["python", str(convert_script), str(input_path), str(residue_file)],
-                cwd=residue_dir,
-            )
+            if self.pdb_converter == "native":
+                try:
+                    convert_pdb_file(input_path, residue_file)
+                except Exception as e:
+                    raise RuntimeError(f"PDB conversion failed\n{e}") from e
+                return parse_mol2(residue_file)
+
+            if self.use_pymol_worker:
+                result = get_pymol_worker().pdb_to_mol2(input_path, residue_file)
+            else:
+                convert_script = Path(__file__).parent / "pdb_to_mol2.py"
+                result = self._run(
+                    ["python", str(convert_script), str(input_path), str(residue_file)],
+                    cwd=residue_dir,
+                )
             if result.returncode != 0:
                 raise RuntimeError(
                     "PDB conversion failed\n"
                     f"STDOUT:\n{result.stdout}\n"
                     f"STDERR:\n{result.stderr}"
                 )
-            return residue_file
+            return parse_mol2(residue_file)
 
         raise ValueError(f"Unsupported format: {input_path.suffix}")
 
-    def _resolve_input_net_charge(self, resname: str, input_mol2_path: str, split_meta: dict) -> tuple[int, str]:
+    def _run_capping(self, residue_dir: Path, head_arg: str, tail_arg: str) -> subprocess.CompletedProcess:
+        if self.capping_engine == "geometric":
+            args = ["geometric", str(residue_dir), head_arg, tail_arg]
+            try:
+                meta = cap_residue_geometric(residue_dir, head_arg, tail_arg)
+            except Exception as e:
+                return subprocess.CompletedProcess(args=args, returncode=1, stdout="", stderr=str(e))
+            return subprocess.CompletedProcess(
+                args=args,
+                returncode=0,
+                stdout=f"Capping successful: {residue_dir / 'residue_capped.mol2'}\n{json.dumps(meta)}\n",
+                stderr="",
+            )
+
+        if self.use_pymol_worker:
+            return get_pymol_worker().cap(residue_dir, head_arg, tail_arg)
+
+        cap_script = Path(__file__).parent / "capping.py"
+        return self._run(
+            ["python", str(cap_script), str(residue_dir), str(head_arg), str(tail_arg)],
+            cwd=residue_dir,
+        )
+
+    def _resolve_input_net_charge(self, resname: str, input_mol: Mol2Molecule, split_meta: dict) -> tuple[int, str]:
         if resname in self.residue_map and "net_charge" in self.residue_map[resname]:
             return int(self.residue_map[resname]["net_charge"]), "map"
 
@@ -175,7 +272,7 @@ class NonStandardAminoAcidProcessor:
         if full_context is not None:
             return int(full_context), str(split_meta.get("full_context_charge_source", "split_full_context"))
 
-        classified, source = classify_residue_net_charge(input_mol2_path, resname=resname)
+        classified, source = classify_residue_net_charge(input_mol, resname=resname)
         if classified is not None:
             return int(classified), source
 
@@ -191,11 +288,15 @@ class NonStandardAminoAcidProcessor:
         net_charge: int,
         charge_source: str,
         validation_warnings: list[str],
+        graph_hashes: tuple[str, str],
         charge_backend_meta: dict[str, Any] | None = None,
+        template_meta: dict[str, Any] | None = None,
     ) -> None:
         split_meta = cfg.get("split_meta", {}) or {}
         meta = {
             "resname": resname,
+            "graph_hash": graph_hashes[0],
+            "graph_hash_stereo": graph_hashes[1],
             "head_name": cfg.get("head_name"),
             "tail_name": cfg.get("tail_name"),
             "main_chain": cfg.get("main_chain"),
@@ -223,8 +324,16 @@ class NonStandardAminoAcidProcessor:
             "full_context_net_charge": split_meta.get("full_context_net_charge"),
             "full_context_charge_source": split_meta.get("full_context_charge_source"),
         }
+        if template_meta is not None:
+            meta["template"] = template_meta
         (residue_dir / "residue_meta.json").write_text(json.dumps(meta, indent=2), encoding="utf-8")
 
+    def _residue_graph_hashes(self, input_mol: Mol2Molecule, split_meta: dict) -> tuple[str, str]:
+        # The splitter already hashed this residue; capping does not touch the input graph.
+        if split_meta.get("graph_hash") and split_meta.get("graph_hash_stereo"):
+            return str(split_meta["graph_hash"]), str(split_meta["graph_hash_stereo"])
+        return mol2_graph_hashes(input_mol)
+
     def _assign_charges_with_antechamber(
         self,
         *,
@@ -245,7 +354,34 @@ class NonStandardAminoAcidProcessor:
             "-nc", str(net_charge),
         ]
 
-        charge_result = self._run(cmd, cwd=charged_file.parent)
+        # AM1-BCC runs sqm, which reports progress only in sqm.out.
+        settings = monitor_settings() if self.charge_model == "bcc" else None
+        sqm_out = charged_file.parent / "sqm.out"
+        aborted = None
+        while True:
+            monitor = SqmMonitor(settings) if settings is not None else None
+            if monitor is not None:
+                # A stale sqm.out from an earlier run would be read as this run's progress.
+                sqm_out.unlink(missing_ok=True)
+            try:
+                charge_result = self._run(
+                    cmd,
+                    cwd=charged_file.parent,
+                    on_line=monitor,
+                    tail_files=[sqm_out] if monitor is not None else None,
+                )
+                break
+            except RunAborted as exc:
+                if aborted is not None or not settings.fallback:
+                    raise RuntimeError(
+                        f"antechamber charge assignment aborted for {resname}: {exc.reason}\n"
+                        f"STDOUT:\n{exc.stdout}\n"
+                        f"STDERR:\n{exc.stderr}"
+                    ) from exc
+                aborted = exc.reason
+                print(f"[{resname}] warning: {exc.reason}; retrying sqm as a single point at the capped geometry")
+                cmd = cmd + ["-ek", _SQM_FALLBACK_KEYWORDS]
+
         if charge_result.returncode != 0:
             raise RuntimeError(
                 f"antechamber charge assignment failed for {resname}\n"
@@ -257,6 +393,7 @@ class NonStandardAminoAcidProcessor:
             "charge_method": self.charge_model,
             "charge_backend": "antechamber",
             "net_charge": int(net_charge),
+            "charge_fallback": aborted,
             "files": {
                 "input_mol2": str(capped_file),
                 "output_mol2": str(charged_file),
@@ -305,30 +442,169 @@ class NonStandardAminoAcidProcessor:
 
         raise ValueError(f"Unsupported charge model: {self.charge_model}")
 
+    def _resp_settings(self) -> dict:
+        # Environment knobs that change RESP charges, for cache and template keys.
+        # Later knobs only enter when set, so keys written before them stay valid.
+        settings = {"resp_multiplicity": os.environ.get("NSAA_RESP_MULTIPLICITY")}
+        for key, env_var in (
+            ("resp_conformers", "NSAA_RESP_CONFORMERS"),
+            ("resp_conformer_weights", "NSAA_RESP_CONFORMER_WEIGHTS"),
+            ("resp_backend", "NSAA_RESP_BACKEND"),
+            ("resp_grid_density", "NSAA_RESP_GRID_DENSITY"),
+            ("resp_geometry", "NSAA_RESP_GEOMETRY"),
+            ("resp_gradient_check", "NSAA_RESP_GRADIENT_CHECK"),
+        ):
+            if os.environ.get(env_var):
+                settings[key] = os.environ[env_var]
+        return settings
+
+    def _charge_cache_key(
+        self,
+        input_mol: Mol2Molecule,
+        form: CanonicalForm,
+        *,
+        cfg: dict,
+        net_charge: int,
+    ) -> str | None:
+        # Atom names and order do not enter the key; a hit is renamed onto this residue's capping.
+        if form.atom_order is None:
+            return None
+
+        row_of = {atom_id: i for i, atom_id in enumerate(input_mol.atom_id.tolist())}
+        rows = [row_of[i] for i in form.atom_order]
+        names = input_mol.name.tolist()
+        position = {names[r]: k for k, r in enumerate(rows)}
+        atom_types = input_mol.atom_type.tolist()
+        xyz = input_mol.xyz
+
+        payload = {
+            "version": 2,
+            "graph": form.stereo_hash,
+            "atom_types": [atom_types[r] for r in rows],
+            "coordinates": [[f"{v:.3f}" for v in xyz[r]] for r in rows],
+            "charge_model": self.charge_model,
+            "net_charge": int(net_charge),
+            "head": position.get(cfg.get("head_name")),
+            "tail": position.get(cfg.get("tail_name")),
+            "capping_engine": self.capping_engine,
+        }
+        if self.charge_model == "resp":
+            payload.update(self._resp_settings())
+        return stable_digest(payload)
+
+    def _template_meta(
+        self,
+        input_mol: Mol2Molecule,
+        form: CanonicalForm,
+        *,
+        cfg: dict,
+        net_charge: int,
+    ) -> dict | None:
+        if form.atom_order is None:
+            return None
+
+        name_of = dict(zip(input_mol.atom_id.tolist(), input_mol.name.tolist()))
+        atom_names = [name_of[i] for i in form.atom_order]
+        position = {name: i for i, name in enumerate(atom_names)}
+        main_chain = cfg.get("main_chain") or []
+
+        payload = {
+            "version": 1,
+            "graph": form.stereo_hash,
+            "head": position.get(cfg.get("head_name")),
+            "tail": position.get(cfg.get("tail_name")),
+            "main_chain": [position.get(name) for name in main_chain],
+            "pre_head_type": cfg.get("pre_head_type"),
+            "post_tail_type": cfg.get("post_tail_type"),
+            "charge_model": self.charge_model,
+            "net_charge": int(net_charge),
+            "capping_engine": self.capping_engine,
+            "backbone": self.backbone,
+            "sidechain": self.sidechain,
+        }
+        if self.charge_model == "resp":
+            payload.update(self._resp_settings())
+        return {"key": stable_digest(payload), "hit": False, "atom_names": atom_names}
+
+    def _restore_template(self, template_meta: dict, residue_dir: Path, resname: str, capped_file: Path) -> dict | None:
+        outputs = {
+            CHARGED_MOL2: residue_dir / f"{resname}.mol2",
+            PREPIN: residue_dir / f"{resname}.prepin",
+            BACKBONE_FRCMOD: residue_dir / f"{resname}_{self.backbone}.frcmod",
+            SIDECHAIN_FRCMOD: residue_dir / f"{resname}_{self.sidechain}.frcmod",
+            LIB: residue_dir / f"{resname}.lib",
+        }
+        return self.templates.restore(
+            template_meta["key"],
+            residue_dir=residue_dir,
+            resname=resname,
+            capped_file=capped_file,
+            outputs=outputs,
+        )
+
+    def _restore_cached_charges(
+        self,
+        cache_key: str,
+        charged_file: Path,
+        resname: str,
+        capped_file: Path,
+    ) -> dict | None:
+        entry = self.charge_cache.get(cache_key) if self.charge_cache else None
+        if entry is None:
+            return None
+
+        try:
+            info = json.loads((entry / "entry.json").read_text(encoding="utf-8"))
+            old_resname = normalize_resname(info.get("resname"))
+            if not (entry / "residue_capped.mol2").exists():
+                return None
+            mapping = capped_name_mapping(entry / "residue_capped.mol2", capped_file, old_resname, resname)
+            if mapping is None:
+                return None
+            cached_meta = json.loads((entry / "residue_meta.json").read_text(encoding="utf-8"))
+            rename_mol2(entry / "charged.mol2", charged_file, mapping, old_resname, resname)
+        except (OSError, ValueError):
+            # Entry evicted or half-written by another process; treat as a miss.
+            return None
+
+        return cached_meta
+
+    def _store_cached_charges(self, cache_key: str, residue_dir: Path, charged_file: Path, resname: str) -> None:
+        files = {
+            "charged.mol2": charged_file,
+            "residue_meta.json": residue_dir / "residue_meta.json",
+        }
+        for name in ("residue_capped.mol2", "residue_capping_meta.json"):
+            if (residue_dir / name).exists():
+                files[name] = residue_dir / name
+
+        try:
+            self.charge_cache.put(cache_key, files, info={"resname": resname, "charge_model": self.charge_model})
+        except OSError as e:
+            print(f"[{resname}] warning: could not store charges in cache: {e}")
+
     def _process_input_path(self, input_path: Path):
         resname = self._get_residue_name(str(input_path))
         residue_dir = self.output_base / resname
         residue_dir.mkdir(parents=True, exist_ok=True)
 
         cfg = self._get_residue_cfg(resname, input_path=input_path)
-        input_mol2 = self._prepare_input_mol2(input_path, residue_dir)
+        # Parsed once; validation, charge classification and the cache key share it.
+        input_mol = self._prepare_input_mol2(input_path, residue_dir)
 
         net_charge, charge_source = self._resolve_input_net_charge(
             resname,
-            str(input_mol2),
+            input_mol,
             cfg.get("split_meta", {}) or {},
         )
 
-        input_warnings = validate_molecule(str(input_mol2), expected_charge=net_charge)
+        charged_file = residue_dir / f"{resname}.mol2"
 
-        cap_script = Path(__file__).parent / "capping.py"
+        # Capping is cheap and comes first: cached results are renamed onto its atoms.
         head_arg = cfg["head_name"] if cfg["head_name"] else "NONE"
         tail_arg = cfg["tail_name"] if cfg["tail_name"] else "NONE"
 
-        cap_result = self._run(
-            ["python", str(cap_script), str(residue_dir), str(head_arg), str(tail_arg)],
-            cwd=residue_dir,
-        )
+        cap_result = self._run_capping(residue_dir, str(head_arg), str(tail_arg))
         if cap_result.returncode != 0:
             raise RuntimeError(
                 f"Capping failed for {resname}\n"
@@ -349,13 +625,74 @@ class NonStandardAminoAcidProcessor:
         except Exception:
             capping_meta = {}
 
-        validation_warnings = input_warnings + validate_molecule(str(capped_file), expected_charge=net_charge)
+        template_meta = None
+        form = None
+        if self.templates is not None or self.charge_cache is not None:
+            form = mol2_canonical_form(input_mol)
+            graph_hashes = (form.graph_hash, form.stereo_hash)
+        else:
+            graph_hashes = self._residue_graph_hashes(input_mol, cfg.get("split_meta", {}) or {})
+        if self.templates is not None:
+            template_meta = self._template_meta(input_mol, form, cfg=cfg, net_charge=net_charge)
+
+        if template_meta is not None:
+            restored = self._restore_template(template_meta, residue_dir, resname, capped_file)
+            if restored is not None:
+                template_meta.update(hit=True, source_resname=restored.get("resname"))
+                stored_meta = restored["residue_meta"]
+                print(f"[{resname}] template hit ({template_meta['key'][:12]}, from {restored.get('resname')})")
+                print(f"[{resname}] net charge = {net_charge}")
+                print(f"[{resname}] charge model = {self.charge_model}")
+
+                self._write_residue_meta(
+                    residue_dir,
+                    resname=resname,
+                    cfg=cfg,
+                    capping_meta=capping_meta,
+                    net_charge=net_charge,
+                    charge_source=charge_source,
+                    validation_warnings=list(stored_meta.get("validation_warnings", [])),
+                    graph_hashes=graph_hashes,
+                    charge_backend_meta=stored_meta.get("charge_backend_meta") or {},
+                    template_meta=template_meta,
+                )
+                return [str(charged_file)]
+
+        cache_key = None
+        if self.charge_cache is not None:
+            cache_key = self._charge_cache_key(input_mol, form, cfg=cfg, net_charge=net_charge)
+        if cache_key is not None:
+            cached_meta = self._restore_cached_charges(cache_key, charged_file, resname, capped_file)
+            if cached_meta is not None:
+                print(f"[{resname}] charge cache hit ({cache_key[:12]})")
+                print(f"[{resname}] net charge = {net_charge}")
+                print(f"[{resname}] charge model = {self.charge_model}")
+
+                charge_backend_meta = dict(cached_meta.get("charge_backend_meta") or {})
+                charge_backend_meta["cache"] = {"hit": True, "key": cache_key}
+
+                self._write_residue_meta(
+                    residue_dir,
+                    resname=resname,
+                    cfg=cfg,
+                    capping_meta=capping_meta,
+                    net_charge=net_charge,
+                    charge_source=charge_source,
+                    validation_warnings=list(cached_meta.get("validation_warnings", [])),
+                    graph_hashes=graph_hashes,
+                    charge_backend_meta=charge_backend_meta,
+                    template_meta=template_meta,
+                )
+                return [str(charged_file)]
+
+        input_warnings = validate_molecule(input_mol, expected_charge=net_charge)
+
+        validation_warnings = input_warnings + validate_molecule(parse_mol2(capped_file), expected_charge=net_charge)
         print(f"[{resname}] net charge = {net_charge}")
         print(f"[{resname}] charge model = {self.charge_model}")
         for w in validation_warnings:
             print(f"[{resname}] warning: {w}")
 
-        charged_file = residue_dir / f"{resname}.mol2"
         charge_backend_meta = self._assign_charges(
             capped_file=capped_file,
             charged_file=charged_file,
@@ -363,8 +700,11 @@ class NonStandardAminoAcidProcessor:
             net_charge=int(net_charge),
         )
 
-        renormalize_mol2_partial_charges_to_integer(str(charged_file), int(net_charge))
-        fix_backbone_atom_types(str(charged_file))
+        charged_mol = parse_mol2(charged_file)
+        renormalize_mol2_partial_charges_to_integer(charged_mol, int(net_charge))
+        fix_backbone_atom_types(charged_mol)
+        if charged_mol.modified:
+            charged_mol.write()
 
         self._write_residue_meta(
             residue_dir,
@@ -374,9 +714,17 @@ class NonStandardAminoAcidProcessor:
             net_charge=net_charge,
             charge_source=charge_source,
             validation_warnings=validation_warnings,
+            graph_hashes=graph_hashes,
             charge_backend_meta=charge_backend_meta,
+            template_meta=template_meta,
         )
 
+        if charge_backend_meta.get("charge_fallback"):
+            # Fallback settings give different charges than the key describes.
+            print(f"[{resname}] charges came from fallback settings; not caching them")
+        elif cache_key is not None:
+            self._store_cached_charges(cache_key, residue_dir, charged_file, resname)
+
         return [str(charged_file)]
 
     def process_single_residue(self):
@@ -0,0 +1,165 @@
+from __future__ import annotations
+
+import atexit
+import contextlib
+import io
+import json
+import subprocess
+import sys
+import threading
+from pathlib import Path
+from typing import Optional
+
+
+# Replies are written on their own line behind this marker so that anything
+# PyMOL prints to the same pipe can never be mistaken for protocol data.
+REPLY_MARKER = "@@NSAA_PYMOL_REPLY@@ "
+
+WORKER_SCRIPT = Path(__file__).resolve()
+
+
+# =========================
+# CLIENT
+# =========================
+class PyMOLWorker:
+    """
+    Long-lived ``python pymol_worker.py`` subprocess with one initialized PyMOL
+    session. Jobs are sent as JSON lines on stdin; the worker is restarted
+    transparently if it dies.
+    """
+
+    def __init__(self, python_exe: str = "python"):
+        self.python_exe = python_exe
+        self._proc: Optional[subprocess.Popen] = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self) -> subprocess.Popen:
+        if self._proc is None or self._proc.poll() is not None:
+            self._proc = subprocess.Popen(
+                [self.python_exe, str(WORKER_SCRIPT)],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                text=True,
+                bufsize=1,
+                cwd=str(WORKER_SCRIPT.parent),
+            )
+        return self._proc
+
+    def run(self, job: dict) -> subprocess.CompletedProcess:
+        with self._lock:
+            proc = self._ensure_started()
+            proc.stdin.write(json.dumps(job) + "\n")
+            proc.stdin.flush()
+
+            output: list[str] = []
+            for line in proc.stdout:
+                if line.startswith(REPLY_MARKER):
+                    reply = json.loads(line[len(REPLY_MARKER):])
+                    output.append(reply.get("stdout", ""))
+                    return subprocess.CompletedProcess(
+                        args=job,
+                        returncode=int(reply.get("returncode", 1)),
+                        stdout="".join(output),
+                        stderr="",
+                    )
+                output.append(line)
+
+            self._proc = None
+            output.append("ERROR: PyMOL worker exited unexpectedly.\n")
+            return subprocess.CompletedProcess(args=job, returncode=99, stdout="".join(output), stderr="")
+
+    def cap(self, residue_dir: Path, head_name: str, tail_name: str) -> subprocess.CompletedProcess:
+        return self.run({"job": "cap", "residue_dir": str(residue_dir), "head": head_name, "tail": tail_name})
+
+    def pdb_to_mol2(self, input_pdb: Path, output_mol2: Path) -> subprocess.CompletedProcess:
+        return self.run({"job": "pdb_to_mol2", "input": str(input_pdb), "output": str(output_mol2)})
+
+    def close(self) -> None:
+        with self._lock:
+            if self._proc is not None and self._proc.poll() is None:
+                try:
+                    self._proc.stdin.close()
+                    self._proc.wait(timeout=10)
+                except Exception:
+                    self._proc.kill()
+            self._proc = None
+
+
+_WORKER: Optional[PyMOLWorker] = None
+_WORKER_LOCK = threading.Lock()
+
+
+def get_pymol_worker() -> PyMOLWorker:
+    """Per-process shared worker; every batch process ends up with its own."""
+    global _WORKER
+    with _WORKER_LOCK:
+        if _WORKER is None:
+            _WORKER = PyMOLWorker()
+            atexit.register(_WORKER.close)
+        return _WORKER
+
+
+# =========================
+# SERVER
+# =========================
+_PYMOL_LAUNCHED = False
+
+
+def _ensure_pymol_launched() -> bool:
+    global _PYMOL_LAUNCHED
+    import capping
+
+    if capping.pymol is None:
+        return False
+    if not _PYMOL_LAUNCHED:
+        capping.pymol.finish_launching(["pymol", "-cq"])
+        _PYMOL_LAUNCHED = True
+    return True
+
+
+def _handle_job(job: dict) -> int:
+    from capping import _normalize_name_arg, cap_residue
+    from pdb_to_mol2 import convert_pdb_to_mol2
+
+    kind = job.get("job")
+    if kind == "cap":
+        return cap_residue(
+            Path(job["residue_dir"]).resolve(),
+            _normalize_name_arg(job.get("head")),
+            _normalize_name_arg(job.get("tail")),
+        )
+    if kind == "pdb_to_mol2":
+        return convert_pdb_to_mol2(Path(job["input"]).resolve(), Path(job["output"]).resolve())
+
+    print(f"ERROR: unknown PyMOL worker job: {kind}")
+    return 1
+
+
+def serve() -> int:
+    reply_stream = sys.stdout
+    for raw in sys.stdin:
+        if not raw.strip():
+            continue
+
+        buf = io.StringIO()
+        with contextlib.redirect_stdout(buf):
+            try:
+                job = json.loads(raw)
+                if not _ensure_pymol_launched():
+                    print("ERROR: PyMOL is not available in this Python environment.")
+                    returncode = 2
+                else:
+                    returncode = _handle_job(job)
+            except Exception as e:
+                print(f"ERROR: {type(e).__name__}: {e}")
+                returncode = 1
+
+        reply_stream.write(REPLY_MARKER + json.dumps({"returncode": returncode, "stdout": buf.getvalue()}) + "\n")
+        reply_stream.flush()
+
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(serve())
@@ -0,0 +1,187 @@
+from __future__ import annotations
+
+import contextlib
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator, Optional
+
+
+LEDGER = "ledger.json"
+LOCK = "ledger.lock"
+
+# ORCA overshoots %maxcore; keep a quarter of each core's share in reserve.
+_MAXCORE_FRACTION = 0.75
+
+# Atoms per core a HF/6-31G* job still scales to; smaller residues get fewer cores.
+_ATOMS_PER_CORE = 6
+
+_POLL_SECONDS = 0.5
+
+
+def _env_number(name: str) -> Optional[float]:
+    raw = os.environ.get(name)
+    if not raw:
+        return None
+    try:
+        return float(raw)
+    except ValueError as exc:
+        raise ValueError(f"Environment variable {name} must be a number, got: {raw}") from exc
+
+
+def _machine_cores() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except (AttributeError, OSError):
+        return os.cpu_count() or 1
+
+
+def _machine_memory_mb() -> int:
+    try:
+        return int(os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 2**20)
+    except (ValueError, OSError, AttributeError):
+        return 4096
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def cores_for_atoms(n_atoms: int) -> int:
+    """Cores one QM job of this size is worth, before the budget caps it."""
+    return max(1, round(n_atoms / _ATOMS_PER_CORE))
+
+
+@dataclass(frozen=True)
+class Allocation:
+    """Share of the machine granted to one QM job: ``%pal nprocs``, ``%maxcore`` and thread count."""
+
+    nprocs: int
+    maxcore_mb: int
+
+
+# =========================
+# SCHEDULER
+# =========================
+class QMScheduler:
+    """
+    Core and memory budget shared by every QM job on the machine.
+
+    Reservations live in a JSON ledger under ``root``, guarded by a file lock,
+    so batch workers in separate processes draw from one budget; entries of
+    processes that died are dropped. A job that does not fit waits until
+    enough of the budget is released.
+    """
+
+    def __init__(
+        self,
+        root: str | Path,
+        *,
+        cores: Optional[int] = None,
+        memory_mb: Optional[int] = None,
+        maxcore_mb: Optional[int] = None,
+    ):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.cores = max(1, int(cores or _machine_cores()))
+        self.memory_mb = max(1, int(memory_mb or _machine_memory_mb()))
+        self.maxcore_mb = int(maxcore_mb or self.memory_mb * _MAXCORE_FRACTION / self.cores)
+
+    @contextlib.contextmanager
+    def _locked_ledger(self) -> Iterator[dict]:
+        with (self.root / LOCK).open("a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                path = self.root / LEDGER
+                try:
+                    ledger = json.loads(path.read_text(encoding="utf-8"))
+                except (OSError, ValueError):
+                    ledger = {}
+                ledger = {k: v for k, v in ledger.items() if _alive(int(v["pid"]))}
+                yield ledger
+                tmp = path.with_name(f"{LEDGER}.{os.getpid()}.tmp")
+                tmp.write_text(json.dumps(ledger, indent=2), encoding="utf-8")
+                os.replace(tmp, path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _try_reserve(self, job_id: str, want: int, least: int, label: str) -> Optional[Allocation]:
+        with self._locked_ledger() as ledger:
+            free_cores = self.cores - sum(int(v["cores"]) for v in ledger.values())
+            free_mb = self.memory_mb - sum(int(v["memory_mb"]) for v in ledger.values())
+            nprocs = min(want, free_cores, free_mb // self.maxcore_mb)
+            # An idle machine always runs the job, whatever it asked for.
+            if not ledger:
+                nprocs = max(1, min(want, self.cores))
+            if nprocs < least and ledger:
+                return None
+            ledger[job_id] = {
+                "pid": os.getpid(),
+                "label": label,
+                "cores": nprocs,
+                "memory_mb": nprocs * self.maxcore_mb,
+                "since": time.time(),
+            }
+        return Allocation(nprocs=nprocs, maxcore_mb=self.maxcore_mb)
+
+    def _release(self, job_id: str) -> None:
+        with self._locked_ledger() as ledger:
+            ledger.pop(job_id, None)
+
+    @contextlib.contextmanager
+    def reserve(self, want: int, *, label: str = "") -> Iterator[Allocation]:
+        """
+        Hold up to ``want`` cores for the duration of the block. A partially
+        used machine may grant down to half of ``want`` so that small jobs
+        fill idle cores instead of queueing behind large ones.
+        """
+        want = max(1, min(int(want), self.cores))
+        least = max(1, want // 2)
+        job_id = f"{os.getpid()}.{threading.get_ident()}.{uuid.uuid4().hex[:8]}"
+        while True:
+            allocation = self._try_reserve(job_id, want, least, label)
+            if allocation is not None:
+                break
+            time.sleep(_POLL_SECONDS)
+        try:
+            yield allocation
+        finally:
+            self._release(job_id)
+
+
+_DEFAULT: Optional[QMScheduler] = None
+_DEFAULT_LOCK = threading.Lock()
+
+
+def default_scheduler() -> QMScheduler:
+    """
+    Process-wide scheduler configured from the environment: NSAA_QM_CORES,
+    NSAA_QM_MEMORY_MB and NSAA_QM_MAXCORE_MB override the machine's totals;
+    processes that share NSAA_QM_SCHEDULER_DIR share one budget.
+    """
+    global _DEFAULT
+    with _DEFAULT_LOCK:
+        if _DEFAULT is None:
+            root = os.environ.get("NSAA_QM_SCHEDULER_DIR") or Path(tempfile.gettempdir()) / f"nsaa_qm_{os.getuid()}"
+            cores = _env_number("NSAA_QM_CORES")
+            memory = _env_number("NSAA_QM_MEMORY_MB")
+            maxcore = _env_number("NSAA_QM_MAXCORE_MB")
+            _DEFAULT = QMScheduler(
+                root,
+                cores=int(cores) if cores else None,
+                memory_mb=int(memory) if memory else None,
+                maxcore_mb=int(maxcore) if maxcore else None,
+            )
+        return _DEFAULT
@@ -1,117 +1,15 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
 from pathlib import Path
-from collections import Counter, deque
+from collections import Counter
 from typing import Dict, List, Tuple, Optional, Set
 
+from .graph import CSRGraph
+from .mol2 import AtomView, as_molecule
 from .utils import normalize_resname
 
 
-@dataclass(frozen=True)
-class Mol2Atom:
-    atom_id: int
-    name: str
-    atom_type: str
-    subst_name: str
-
-
-def _parse_mol2_atoms(mol2_path: str) -> List[Mol2Atom]:
-    atoms: List[Mol2Atom] = []
-    in_atoms = False
-
-    with open(mol2_path, "r", encoding="utf-8", errors="replace") as f:
-        for line in f:
-            s = line.strip()
-
-            if s.startswith("@<TRIPOS>ATOM"):
-                in_atoms = True
-                continue
-
-            if s.startswith("@<TRIPOS>") and in_atoms:
-                break
-
-            if not in_atoms or not s:
-                continue
-
-            parts = line.split()
-            if len(parts) < 8:
-                continue
-
-            atoms.append(
-                Mol2Atom(
-                    atom_id=int(parts[0]),
-                    name=parts[1],
-                    atom_type=parts[5],
-                    subst_name=parts[7],
-                )
-            )
-
-    return atoms
-
-
-def _parse_mol2_bonds(mol2_path: str) -> List[Tuple[int, int]]:
-    bonds: List[Tuple[int, int]] = []
-    in_bonds = False
-
-    with open(mol2_path, "r", encoding="utf-8", errors="replace") as f:
-        for line in f:
-            s = line.strip()
-
-            if s.startswith("@<TRIPOS>BOND"):
-                in_bonds = True
-                continue
-
-            if s.startswith("@<TRIPOS>") and in_bonds:
-                break
-
-            if not in_bonds or not s:
-                continue
-
-            parts = line.split()
-            if len(parts) < 4:
-                continue
-
-            bonds.append((int(parts[1]), int(parts[2])))
-
-    return bonds
-
-
-def _shortest_path(graph: Dict[int, Set[int]], start: int, goal: int) -> Optional[List[int]]:
-    if start == goal:
-        return [start]
-
-    q = deque([start])
-    prev: Dict[int, int] = {}
-    seen = {start}
-
-    while q:
-        v = q.popleft()
-
-        for n in graph.get(v, set()):
-            if n in seen:
-                continue
-
-            seen.add(n)
-            prev[n] = v
-
-            if n == goal:
-                path = [goal]
-                cur = goal
-
-                while cur != start:
-                    cur = prev[cur]
-                    path.append(cur)
-
-                path.reverse()
-                return path
-
-            q.append(n)
-
-    return None
-
-
-def _looks_like_backbone_candidate(atom: Mol2Atom) -> bool:
+def _looks_like_backbone_candidate(atom: AtomView) -> bool:
     name = atom.name.upper()
     atype = atom.atom_type.upper()
 
@@ -135,7 +33,7 @@ def _dedupe_preserve_order(items: List[str]) -> List[str]:
     return out
 
 
-def _select_anchor_atom(atoms: List[Mol2Atom]) -> Optional[str]:
+def _select_anchor_atom(atoms: List[AtomView]) -> Optional[str]:
     for a in atoms:
         if a.name.upper().startswith("C"):
             return a.name
@@ -156,7 +54,7 @@ def _select_anchor_atom(atoms: List[Mol2Atom]) -> Optional[str]:
 
 
 def _collect_backbone_candidates(
-    atoms: List[Mol2Atom],
+    atoms: List[AtomView],
     *,
     exclude_names: Set[str],
 ) -> List[str]:
@@ -201,8 +99,8 @@ def process_mol2_file(
     - OMIT_NAME contains atoms belonging to applied caps.
     - Cap-only molecules are handled gracefully.
     """
-    atoms = _parse_mol2_atoms(file_path)
-    bonds = _parse_mol2_bonds(file_path)
+    mol = as_molecule(file_path)
+    atoms = list(mol.atoms)
 
     norm_cap_set = {normalize_resname(c) for c in cap_resnames}
 
@@ -235,11 +133,7 @@ def process_mol2_file(
     for a in central_atoms:
         name_to_ids.setdefault(a.name, []).append(a.atom_id)
 
-    graph: Dict[int, Set[int]] = {a.atom_id: set() for a in central_atoms}
-    for a1, a2 in bonds:
-        if a1 in graph and a2 in graph:
-            graph[a1].add(a2)
-            graph[a2].add(a1)
+    graph = CSRGraph.from_edges(list(id_to_atom), mol.bond_a1, mol.bond_a2)
 
     has_head = bool(head_name) and head_name in name_to_ids
     has_tail = bool(tail_name) and tail_name in name_to_ids
@@ -254,7 +148,7 @@ def process_mol2_file(
     elif infer_mainchain_from_connectivity and has_head and has_tail:
         head_id = name_to_ids[head_name][0]
         tail_id = name_to_ids[tail_name][0]
-        path = _shortest_path(graph, head_id, tail_id)
+        path = graph.shortest_path(head_id, tail_id)
 
         if path and len(path) >= 3:
             path_names = [id_to_atom[i].name for i in path]
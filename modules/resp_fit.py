@@ -0,0 +1,209 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+ANGSTROM_TO_BOHR = 1.0 / 0.529177210903
+
+# Merz-Kollman radii (A); other elements get 2.0.
+_MK_RADII = {
+    "H": 1.20,
+    "C": 1.50,
+    "N": 1.50,
+    "O": 1.40,
+    "F": 1.35,
+    "P": 1.80,
+    "S": 1.75,
+    "CL": 1.70,
+    "BR": 1.85,
+    "I": 1.98,
+}
+
+# Shells of the fitting grid, as multiples of the atomic radii.
+_MK_SHELLS = (1.4, 1.6, 1.8, 2.0)
+
+# Hyperbolic restraint of the two RESP stages (Bayly et al. 1993).
+_STAGE1_A = 0.0005
+_STAGE2_A = 0.001
+_RESTRAINT_B = 0.1
+
+_MAX_ITER = 100
+_TOLERANCE = 1e-6
+
+
+# =========================
+# FITTING GRID
+# =========================
+def _sphere_points(n: int) -> np.ndarray:
+    """``n`` near-uniform unit vectors on a Fibonacci spiral."""
+    k = np.arange(n) + 0.5
+    z = 1.0 - 2.0 * k / n
+    r = np.sqrt(1.0 - z * z)
+    phi = np.pi * (3.0 - np.sqrt(5.0)) * k
+    return np.stack([r * np.cos(phi), r * np.sin(phi), z], axis=1)
+
+
+def esp_grid(
+    coords: np.ndarray,
+    elements: Sequence[str],
+    *,
+    density: float = 6.0,
+    shells: Sequence[float] = _MK_SHELLS,
+) -> np.ndarray:
+    """
+    Merz-Kollman fitting points (A) around a molecule given in A: ``density``
+    points per A^2 on each scaled van der Waals shell, minus the points that
+    fall inside another atom's sphere of the same scale.
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    radii = np.array([_MK_RADII.get(str(e).upper(), 2.0) for e in elements])
+    out = []
+    for scale in shells:
+        scaled = radii * scale
+        for i, r in enumerate(scaled):
+            n = max(1, int(round(4.0 * np.pi * r * r * density)))
+            pts = coords[i] + r * _sphere_points(n)
+            d = np.linalg.norm(pts[:, None, :] - coords[None, :, :], axis=-1)
+            inside = d < scaled[None, :] - 1e-8
+            out.append(pts[~inside.any(axis=1)])
+    return np.concatenate(out) if out else np.zeros((0, 3))
+
+
+# =========================
+# RESTRAINED FIT
+# =========================
+@dataclass(frozen=True)
+class RespFit:
+    """Fitted charges in MOL2 atom order, with the relative RMS error of each stage."""
+
+    charges: np.ndarray
+    rrms: float
+    stage_rrms: Tuple[float, float]
+    iterations: Tuple[int, int]
+
+
+def _normal_equations(
+    conformers: Sequence[Tuple[np.ndarray, np.ndarray, np.ndarray]],
+    weights: Sequence[float],
+) -> Tuple[np.ndarray, np.ndarray, float]:
+    """Weighted sum of A^T A, A^T V and V^T V over conformers (A: inverse distances)."""
+    n = len(conformers[0][0])
+    G = np.zeros((n, n))
+    g = np.zeros(n)
+    vv = 0.0
+    for (atoms, points, values), w in zip(conformers, weights):
+        A = 1.0 / np.linalg.norm(points[:, None, :] - atoms[None, :, :], axis=-1)
+        G += w * (A.T @ A)
+        g += w * (A.T @ values)
+        vv += w * float(values @ values)
+    return G, g, vv
+
+
+def _group_matrix(groups: List[int], free: np.ndarray) -> np.ndarray:
+    """(atoms, groups) 0/1 matrix mapping one charge per group onto its free atoms."""
+    labels = sorted({groups[i] for i in np.flatnonzero(free)})
+    col = {label: c for c, label in enumerate(labels)}
+    T = np.zeros((len(groups), len(labels)))
+    for i in np.flatnonzero(free):
+        T[i, col[groups[i]]] = 1.0
+    return T
+
+
+def _solve_stage(
+    G: np.ndarray,
+    g: np.ndarray,
+    T: np.ndarray,
+    fixed: np.ndarray,
+    restrained: np.ndarray,
+    total: float,
+    a: float,
+) -> Tuple[np.ndarray, int]:
+    """
+    Minimise the ESP misfit plus ``a * sum(sqrt(q^2 + b^2) - b)`` over the
+    restrained atoms, with sum(q) == total. The restraint is linearised
+    around the previous charges until they stop changing.
+    """
+    H = T.T @ G @ T
+    h = T.T @ (g - G @ fixed)
+    count = T.T @ restrained.astype(np.float64)
+    ones = T.sum(axis=0)
+    k = len(h)
+
+    kkt = np.zeros((k + 1, k + 1))
+    kkt[:k, k] = ones
+    kkt[k, :k] = ones
+    rhs = np.append(h, total - fixed.sum())
+
+    p = np.zeros(k)
+    for it in range(1, _MAX_ITER + 1):
+        kkt[:k, :k] = H + np.diag(count * a / np.sqrt(p * p + _RESTRAINT_B ** 2))
+        new = np.linalg.solve(kkt, rhs)[:k]
+        if np.max(np.abs(new - p)) < _TOLERANCE:
+            return T @ new + fixed, it
+        p = new
+    return T @ p + fixed, _MAX_ITER
+
+
+def _rrms(G: np.ndarray, g: np.ndarray, vv: float, q: np.ndarray) -> float:
+    chi2 = vv - 2.0 * float(q @ g) + float(q @ G @ q)
+    return float(np.sqrt(max(chi2, 0.0) / vv)) if vv > 0 else 0.0
+
+
+def fit_resp(
+    conformers: Sequence[Tuple[np.ndarray, np.ndarray, np.ndarray]],
+    *,
+    total_charge: float,
+    elements: Sequence[str],
+    bonds: Sequence[Tuple[int, int]],
+    classes: Optional[Sequence[int]] = None,
+    weights: Optional[Sequence[float]] = None,
+) -> RespFit:
+    """
+    Two-stage RESP fit. ``conformers`` holds (atom coordinates, grid points,
+    ESP values) per conformer in atomic units; ``bonds`` are 0-based atom
+    index pairs and ``classes`` the symmetry class of each atom, whose
+    charges are made equal.
+
+    Stage 1 fits every charge under the weak restraint, keeping the
+    hydrogens of methyl and methylene groups independent. Stage 2 refits
+    only those sp3 carbons and their hydrogens under the strong restraint,
+    with full equivalencing, the other charges held at their stage 1 values.
+    """
+    n = len(elements)
+    elements = [str(e).upper() for e in elements]
+    classes = list(classes) if classes is not None else list(range(n))
+    weights = list(weights) if weights is not None else [1.0 / len(conformers)] * len(conformers)
+    # Normalised weights, scaled so that equal weights sum plain chi^2 terms.
+    scale = len(conformers) / float(sum(weights))
+    G, g, vv = _normal_equations(conformers, [w * scale for w in weights])
+
+    neighbors: List[List[int]] = [[] for _ in range(n)]
+    for i, j in bonds:
+        neighbors[i].append(j)
+        neighbors[j].append(i)
+
+    heavy = np.array([e != "H" for e in elements], dtype=bool)
+    refit = np.zeros(n, dtype=bool)
+    for i, e in enumerate(elements):
+        hydrogens = [j for j in neighbors[i] if elements[j] == "H"]
+        if e == "C" and len(neighbors[i]) == 4 and len(hydrogens) >= 2:
+            refit[i] = True
+            refit[hydrogens] = True
+
+    # Stage 1: refit atoms get groups of their own.
+    stage1_groups = [(-1 - i) if refit[i] else classes[i] for i in range(n)]
+    T1 = _group_matrix(stage1_groups, np.ones(n, dtype=bool))
+    q1, it1 = _solve_stage(G, g, T1, np.zeros(n), heavy, total_charge, _STAGE1_A)
+    rrms1 = _rrms(G, g, vv, q1)
+
+    if not refit.any():
+        return RespFit(charges=q1, rrms=rrms1, stage_rrms=(rrms1, rrms1), iterations=(it1, 0))
+
+    T2 = _group_matrix(classes, refit)
+    fixed = np.where(refit, 0.0, q1)
+    q2, it2 = _solve_stage(G, g, T2, fixed, heavy & refit, total_charge, _STAGE2_A)
+    rrms2 = _rrms(G, g, vv, q2)
+    return RespFit(charges=q2, rrms=rrms2, stage_rrms=(rrms1, rrms2), iterations=(it1, it2))
@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Optional
+
+
+ENTRY_META = "entry.json"
+
+
+def stable_digest(payload: Any) -> str:
+    """sha256 of a JSON-serializable payload with sorted keys."""
+    blob = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    Content-addressed directory cache with a size cap and LRU eviction.
+
+    Layout: ``<root>/<key[:2]>/<key>/`` holds the cached files plus ``entry.json``.
+    The mtime of ``entry.json`` is the last-access time used for eviction, so
+    several processes (or hosts on shared scratch) can use the same root without
+    a separate index. Entries are published with an atomic directory rename.
+    """
+
+    def __init__(self, root: str | Path, max_bytes: Optional[int] = None):
+        self.root = Path(root).resolve()
+        self.max_bytes = max_bytes
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _entry_dir(self, key: str) -> Path:
+        return self.root / key[:2] / key
+
+    def get(self, key: str) -> Optional[Path]:
+        entry = self._entry_dir(key)
+        meta = entry / ENTRY_META
+        if not meta.exists():
+            return None
+        try:
+            os.utime(meta, None)
+        except OSError:
+            return None
+        return entry
+
+    def put(self, key: str, files: dict[str, Path], info: Optional[dict] = None) -> Path:
+        """Store ``{name_in_cache: source_path}`` under ``key`` and return the entry directory."""
+        entry = self._entry_dir(key)
+        if (entry / ENTRY_META).exists():
+            return entry
+
+        tmp_root = self.root / "tmp"
+        tmp_root.mkdir(parents=True, exist_ok=True)
+        staging = tmp_root / f"{key}.{os.getpid()}.{uuid.uuid4().hex[:8]}"
+        staging.mkdir(parents=True)
+
+        try:
+            size = 0
+            for name, src in files.items():
+                dst = staging / name
+                shutil.copyfile(src, dst)
+                size += dst.stat().st_size
+
+            meta = {"key": key, "created": time.time(), "size_bytes": size, "files": sorted(files)}
+            meta.update(info or {})
+            (staging / ENTRY_META).write_text(json.dumps(meta, indent=2), encoding="utf-8")
+
+            entry.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                os.rename(staging, entry)
+            except OSError:
+                # Another process published the same key first.
+                shutil.rmtree(staging, ignore_errors=True)
+        except Exception:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+
+        self.evict()
+        return entry
+
+    def _entries(self) -> list[tuple[float, int, Path]]:
+        out: list[tuple[float, int, Path]] = []
+        for meta in self.root.glob(f"??/*/{ENTRY_META}"):
+            try:
+                last_access = meta.stat().st_mtime
+                size = sum(f.stat().st_size for f in meta.parent.iterdir() if f.is_file())
+            except OSError:
+                continue
+            out.append((last_access, size, meta.parent))
+        return out
+
+    def evict(self) -> int:
+        """Remove least recently used entries until the cache fits ``max_bytes``."""
+        if not self.max_bytes:
+            return 0
+
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+
+        for _, size, entry in sorted(entries, key=lambda e: e[0]):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+            removed += 1
+
+        return removed
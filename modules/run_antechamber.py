@@ -2,11 +2,25 @@ from __future__ import annotations
 
 import json
 import os
-import subprocess
+import threading
 import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from pathlib import Path
+from typing import Callable
 
 from modules.remove import process_mol2_file
+from modules.runner import run_streaming
+from modules.templates import (
+    BACKBONE_FRCMOD,
+    CAPPED_MOL2,
+    CAPPING_META,
+    CHARGED_MOL2,
+    LIB,
+    PREPIN,
+    RESIDUE_META,
+    SIDECHAIN_FRCMOD,
+    TemplateLibrary,
+)
 from modules.utils import (
     classify_residue_net_charge,
     normalize_resname,
@@ -15,22 +29,52 @@ from modules.utils import (
 )
 
 
-def _run(cmd, cwd: Path, log_file: Path) -> bool:
-    result = subprocess.run(cmd, capture_output=True, text=True, cwd=str(cwd))
+_LOG_LOCK = threading.Lock()
 
-    with log_file.open("a", encoding="utf-8") as f:
-        f.write("\n\n=== CMD ===\n")
-        f.write(" ".join(cmd) if isinstance(cmd, list) else str(cmd))
-        f.write("\n=== STDOUT ===\n")
-        f.write(result.stdout)
-        f.write("\n=== STDERR ===\n")
-        f.write(result.stderr)
-        f.write("\n=== RETURN CODE ===\n")
-        f.write(str(result.returncode) + "\n")
 
+def _run(cmd, cwd: Path, log_file: Path, tag: str | None = None) -> bool:
+    # Steps of one residue run concurrently; the tag tells their lines apart in the log.
+    result = run_streaming(list(cmd), cwd=cwd, log_path=log_file, log_lock=_LOG_LOCK, tag=tag or Path(cmd[0]).name)
     return result.returncode == 0
 
 
+def _run_step_graph(steps: dict[str, tuple[tuple[str, ...], Callable[[], bool]]]) -> dict[str, str]:
+    """
+    Run ``{name: (dependencies, step)}`` as a dependency graph.
+
+    Each step starts as soon as all its dependencies succeeded; independent steps
+    run concurrently. A step that returns False or raises is "failed" and every
+    step depending on it is "skipped".
+    """
+    status: dict[str, str] = {}
+    running: dict[Future, str] = {}
+
+    with ThreadPoolExecutor(max_workers=max(1, len(steps))) as pool:
+        while len(status) < len(steps):
+            for name, (deps, step) in steps.items():
+                if name in status or name in running.values():
+                    continue
+                if any(status.get(d) in {"failed", "skipped"} for d in deps):
+                    status[name] = "skipped"
+                    continue
+                if all(status.get(d) == "ok" for d in deps):
+                    running[pool.submit(step)] = name
+
+            if not running:
+                continue
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                name = running.pop(fut)
+                try:
+                    status[name] = "ok" if fut.result() else "failed"
+                except Exception as e:
+                    print(f"step {name} raised: {e}")
+                    status[name] = "failed"
+
+    return status
+
+
 def _read_json_if_exists(path: Path) -> dict:
     if not path.exists():
         return {}
@@ -84,6 +128,7 @@ def run_antechamber_for_all(
     sidechain: str = "gaff2",
     charge: str = "bcc",
     generate_gmx: bool = False,
+    template_dir: str | None = None,
 ):
     amberhome = os.environ.get("AMBERHOME")
     if not amberhome:
@@ -108,6 +153,14 @@ def run_antechamber_for_all(
     backbone_parm_path = os.path.join(amberhome, "dat", "leap", "parm", backbone_map[backbone])
     gaff_parm_path = os.path.join(amberhome, "dat", "leap", "parm", sidechain_map[sidechain])
 
+    template_dir = template_dir or os.environ.get("NSAA_TEMPLATE_DIR")
+    template_max_mb = os.environ.get("NSAA_TEMPLATE_MAX_MB")
+    templates = (
+        TemplateLibrary(template_dir, max_bytes=int(template_max_mb) * 1024 * 1024 if template_max_mb else None)
+        if template_dir
+        else None
+    )
+
     for input_mol2 in mol2_files:
         #start_time = time.perf_counter()
 
@@ -116,6 +169,12 @@ def run_antechamber_for_all(
         resname = normalize_resname(mol2_path.stem)
         meta = _read_residue_meta(residue_dir)
 
+        template = meta.get("template") or {}
+        if template.get("hit"):
+            print(f"[{resname}] parameters reused from template {template.get('source_resname')}")
+            print(f"\033[1m\n{resname} parametrization complete\033[0m")
+            continue
+
         log_file = residue_dir / f"{resname}.log"
         log_file.write_text("", encoding="utf-8")
 
@@ -139,27 +198,6 @@ def run_antechamber_for_all(
             "-at", "amber",
             "-nc", str(net_charge),
         ]
-        if not _run(antechamber_cmd, residue_dir, log_file):
-            print(f"{resname} failed at AC generation.")
-            continue
-
-        fix_backbone_atom_types_in_ac(str(ac_output))
-
-        applied_caps = tuple(str(x).upper() for x in meta.get("applied_caps", []))
-        process_mol2_file(
-            str(mol2_path),
-            str(mc_file),
-            head_name=meta.get("head_name", "N"),
-            tail_name=meta.get("tail_name", "C"),
-            main_chain=meta.get("main_chain"),
-            charge=float(net_charge),
-            central_resname=resname,
-            cap_resnames=applied_caps if applied_caps else ("ACE", "NME"),
-            pre_head_type=str(meta.get("pre_head_type", "C")),
-            post_tail_type=str(meta.get("post_tail_type", "N")),
-            infer_mainchain_from_connectivity=True,
-        )
-
         prepgen_cmd = [
             "prepgen",
             "-i", ac_output.name,
@@ -167,13 +205,6 @@ def run_antechamber_for_all(
             "-m", mc_file.name,
             "-rn", resname,
         ]
-        if not _run(prepgen_cmd, residue_dir, log_file):
-            print(f"{resname} failed at prepgen.")
-            continue
-
-        if fix_backbone_atom_types_in_prepin(str(prepin_file)):
-            print(f"[{resname}] corrected backbone atom types in PREPIN file")
-
         parmchk_backbone_cmd = [
             "parmchk2",
             "-i", ac_output.name,
@@ -191,31 +222,95 @@ def run_antechamber_for_all(
             "-p", gaff_parm_path,
         ]
 
-        if not _run(parmchk_backbone_cmd, residue_dir, log_file):
-            print(f"{resname} failed at parmchk2 (backbone).")
-            continue
-        if not _run(parmchk_sidechain_cmd, residue_dir, log_file):
-            print(f"{resname} failed at parmchk2 (sidechain).")
-            continue
+        def step_ac() -> bool:
+            if not _run(antechamber_cmd, residue_dir, log_file):
+                return False
+            fix_backbone_atom_types_in_ac(str(ac_output))
+            return True
+
+        def step_mc() -> bool:
+            applied_caps = tuple(str(x).upper() for x in meta.get("applied_caps", []))
+            process_mol2_file(
+                str(mol2_path),
+                str(mc_file),
+                head_name=meta.get("head_name", "N"),
+                tail_name=meta.get("tail_name", "C"),
+                main_chain=meta.get("main_chain"),
+                charge=float(net_charge),
+                central_resname=resname,
+                cap_resnames=applied_caps if applied_caps else ("ACE", "NME"),
+                pre_head_type=str(meta.get("pre_head_type", "C")),
+                post_tail_type=str(meta.get("post_tail_type", "N")),
+                infer_mainchain_from_connectivity=True,
+            )
+            return True
+
+        def step_prepgen() -> bool:
+            if not _run(prepgen_cmd, residue_dir, log_file):
+                return False
+            if fix_backbone_atom_types_in_prepin(str(prepin_file)):
+                print(f"[{resname}] corrected backbone atom types in PREPIN file")
+            return True
+
+        def step_tleap() -> bool:
+            leap_script = residue_dir / "leap.in"
+            leap_script.write_text(
+                (
+                    f"source leaprc.protein.{backbone}\n"
+                    f"source leaprc.{sidechain}\n"
+                    f"loadamberparams {backbone_frcmod_output.name}\n"
+                    f"loadamberparams {gaff_frcmod_output.name}\n"
+                    f"{resname} = loadmol2 {mol2_path.name}\n"
+                    f"saveoff {resname} {lib_file.name}\n"
+                    f"quit\n"
+                ),
+                encoding="utf-8",
+            )
+            return _run(["tleap", "-f", leap_script.name], residue_dir, log_file)
+
+        # Both parmchk2 runs only read the .ac file, so they run side by side
+        # (and alongside prepgen); tleap waits for prepgen and both frcmods.
+        steps = {
+            "ac": ((), step_ac),
+            "mc": (("ac",), step_mc),
+            "prepgen": (("ac", "mc"), step_prepgen),
+            "parmchk_backbone": (("ac",), lambda: _run(parmchk_backbone_cmd, residue_dir, log_file, "parmchk2 backbone")),
+            "parmchk_sidechain": (("ac",), lambda: _run(parmchk_sidechain_cmd, residue_dir, log_file, "parmchk2 sidechain")),
+            "tleap": (("prepgen", "parmchk_backbone", "parmchk_sidechain"), step_tleap),
+        }
+        failure_messages = {
+            "ac": "failed at AC generation.",
+            "mc": "failed at MC file generation.",
+            "prepgen": "failed at prepgen.",
+            "parmchk_backbone": "failed at parmchk2 (backbone).",
+            "parmchk_sidechain": "failed at parmchk2 (sidechain).",
+            "tleap": "failed at tleap.",
+        }
 
-        leap_script = residue_dir / "leap.in"
-        leap_script.write_text(
-            (
-                f"source leaprc.protein.{backbone}\n"
-                f"source leaprc.{sidechain}\n"
-                f"loadamberparams {backbone_frcmod_output.name}\n"
-                f"loadamberparams {gaff_frcmod_output.name}\n"
-                f"{resname} = loadmol2 {mol2_path.name}\n"
-                f"saveoff {resname} {lib_file.name}\n"
-                f"quit\n"
-            ),
-            encoding="utf-8",
-        )
-
-        if not _run(["tleap", "-f", leap_script.name], residue_dir, log_file):
-            print(f"{resname} failed at tleap.")
+        status = _run_step_graph(steps)
+        failed = [name for name in steps if status.get(name) == "failed"]
+        if failed:
+            print(f"{resname} {failure_messages[failed[0]]}")
             continue
 
+        charge_fallback = (meta.get("charge_backend_meta") or {}).get("charge_fallback")
+        if templates is not None and template.get("key") and not charge_fallback:
+            templates.store(
+                template["key"],
+                resname=resname,
+                atom_names=template.get("atom_names") or [],
+                files={
+                    CHARGED_MOL2: mol2_path,
+                    CAPPED_MOL2: residue_dir / "residue_capped.mol2",
+                    PREPIN: prepin_file,
+                    BACKBONE_FRCMOD: backbone_frcmod_output,
+                    SIDECHAIN_FRCMOD: gaff_frcmod_output,
+                    LIB: lib_file,
+                    RESIDUE_META: residue_dir / "residue_meta.json",
+                    CAPPING_META: residue_dir / "residue_capping_meta.json",
+                },
+            )
+
         #total_time = time.perf_counter() - start_time
         print(f"\033[1m\n{resname} parametrization complete\033[0m")
         #print(f"Time taken: {total_time:.2f} s\n")
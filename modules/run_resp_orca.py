@@ -1,14 +1,28 @@
 from __future__ import annotations
 
+import gzip
+import hashlib
+import json
 import os
 import re
-import shlex
 import shutil
 import subprocess
-from dataclasses import dataclass
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import List, Optional
 
+import numpy as np
+
+from modules.canonical import symmetry_classes
+from modules.conformers import generate_conformers
+from modules.convergence import OrcaMonitor, monitor_settings
+from modules.mol2 import AtomView, require_atoms
+from modules.qm_scheduler import Allocation, cores_for_atoms, default_scheduler
+from modules.resp_fit import ANGSTROM_TO_BOHR, esp_grid, fit_resp
+from modules.result_cache import ResultCache, stable_digest
+from modules.runner import LineCallback, RunAborted, fan_out, run_streaming
+
 
 # =========================
 # EXECUTABLE RESOLVER
@@ -36,21 +50,8 @@ def _resolve_executable(*, cli_value: Optional[str], env_var: str, program_name:
 
 
 # =========================
-# DATA STRUCTURES
+# ELEMENT TABLES
 # =========================
-@dataclass(frozen=True)
-class Mol2Atom:
-    atom_id: int
-    name: str
-    x: float
-    y: float
-    z: float
-    atom_type: str
-    subst_id: int
-    subst_name: str
-    charge: float
-
-
 _TWO_LETTER_ELEMENTS = {
     "CL": "Cl",
     "BR": "Br",
@@ -89,39 +90,8 @@ _ATOMIC_NUMBERS = {
 # =========================
 # BASIC HELPERS
 # =========================
-def _parse_mol2_atoms(mol2_path: str) -> List[Mol2Atom]:
-    atoms: List[Mol2Atom] = []
-    in_atoms = False
-    with open(mol2_path, "r", encoding="utf-8", errors="replace") as f:
-        for line in f:
-            s = line.strip()
-            if s.startswith("@<TRIPOS>ATOM"):
-                in_atoms = True
-                continue
-            if s.startswith("@<TRIPOS>") and in_atoms:
-                break
-            if not in_atoms or not s:
-                continue
-            parts = line.split()
-            if len(parts) < 8:
-                continue
-            charge = float(parts[8]) if len(parts) >= 9 else 0.0
-            atoms.append(
-                Mol2Atom(
-                    atom_id=int(parts[0]),
-                    name=parts[1],
-                    x=float(parts[2]),
-                    y=float(parts[3]),
-                    z=float(parts[4]),
-                    atom_type=parts[5],
-                    subst_id=int(parts[6]),
-                    subst_name=parts[7],
-                    charge=charge,
-                )
-            )
-    if not atoms:
-        raise ValueError(f"No atoms parsed from MOL2: {mol2_path}")
-    return atoms
+def _parse_mol2_atoms(mol2_path: str) -> List[AtomView]:
+    return list(require_atoms(mol2_path).atoms)
 
 
 def _guess_element(atom_name: str, atom_type: str) -> str:
@@ -174,22 +144,70 @@ def _env_int(name: str, default: int) -> int:
         raise ValueError(f"Environment variable {name} must be an integer, got: {raw}") from exc
 
 
-def _run(cmd: list[str], *, cwd: Path, log_path: Path) -> subprocess.CompletedProcess:
-    result = subprocess.run(cmd, capture_output=True, text=True, cwd=str(cwd))
-    with log_path.open("a", encoding="utf-8") as log:
-        log.write("\n\n=== CMD ===\n")
-        log.write(f"CWD: {cwd}\n")
-        log.write("CMD: " + " ".join(shlex.quote(x) for x in cmd) + "\n")
-        log.write("=== STDOUT ===\n")
-        log.write(result.stdout)
-        log.write("\n=== STDERR ===\n")
-        log.write(result.stderr)
-        log.write("\n=== RETURN CODE ===\n")
-        log.write(str(result.returncode) + "\n")
-    return result
+def _env_float(name: str, default: float) -> float:
+    raw = os.environ.get(name)
+    if raw is None:
+        return default
+    try:
+        return float(raw)
+    except Exception as exc:
+        raise ValueError(f"Environment variable {name} must be a number, got: {raw}") from exc
+
+
+# ORCA optimization level and its gradient thresholds (Eh/bohr: max, RMS) per policy.
+_GEOMETRY_POLICIES = {
+    "xtb": None,
+    "loose": ("LooseOpt", 100, 2e-3, 5e-4),
+    "tight": ("TightOpt", 300, 1e-4, 3e-5),
+}
+
+
+def _geometry_policy() -> str:
+    """
+    NSAA_RESP_GEOMETRY: ``xtb`` fits on the xtb geometry, ``loose`` and
+    ``tight`` (default) follow it with an ORCA HF/6-31G* optimization.
+    """
+    policy = os.environ.get("NSAA_RESP_GEOMETRY", "tight").strip().lower()
+    if policy not in _GEOMETRY_POLICIES:
+        raise ValueError(f"Unsupported NSAA_RESP_GEOMETRY: {policy}")
+    return policy
 
 
-def _write_xyz_from_mol2(mol2_path: Path, xyz_path: Path) -> list[Mol2Atom]:
+def _resp_backend() -> str:
+    backend = os.environ.get("NSAA_RESP_BACKEND", "multiwfn").strip().lower()
+    if backend not in {"multiwfn", "native"}:
+        raise ValueError(f"Unsupported NSAA_RESP_BACKEND: {backend}")
+    return backend
+
+
+# Conformer chains run side by side and share one log.
+_LOG_LOCK = threading.Lock()
+
+HARTREE_TO_KCAL = 627.509474
+BOLTZMANN_KCAL = 0.0019872041
+
+
+def _run(
+    cmd: list[str],
+    *,
+    cwd: Path,
+    log_path: Path,
+    env: Optional[dict] = None,
+    on_line: Optional[LineCallback] = None,
+) -> subprocess.CompletedProcess:
+    # Lines carry the work directory name: conformer chains write to one log at once.
+    return run_streaming(
+        cmd,
+        cwd=cwd,
+        env=env,
+        log_path=log_path,
+        log_lock=_LOG_LOCK,
+        tag=cwd.name,
+        on_line=on_line,
+    )
+
+
+def _write_xyz_from_mol2(mol2_path: Path, xyz_path: Path) -> list[AtomView]:
     atoms = _parse_mol2_atoms(str(mol2_path))
 
     lines = [str(len(atoms)), f"Generated from {mol2_path.name}"]
@@ -201,6 +219,20 @@ def _write_xyz_from_mol2(mol2_path: Path, xyz_path: Path) -> list[Mol2Atom]:
     return atoms
 
 
+def _write_xyz(atoms: list[AtomView], coords: np.ndarray, xyz_path: Path, comment: str) -> None:
+    lines = [str(len(atoms)), comment]
+    for atom, (x, y, z) in zip(atoms, coords.tolist()):
+        element = _guess_element(atom.name, atom.atom_type)
+        lines.append(f"{element:<2} {x: .10f} {y: .10f} {z: .10f}")
+    xyz_path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+
+def _read_xyz_elements(xyz_path: Path) -> list[str]:
+    lines = xyz_path.read_text(encoding="utf-8", errors="replace").splitlines()
+    natoms = int(lines[0].strip())
+    return [line.split()[0] for line in lines[2:2 + natoms]]
+
+
 def _read_xyz_coordinates(xyz_path: Path) -> list[tuple[float, float, float]]:
     lines = xyz_path.read_text(encoding="utf-8", errors="replace").splitlines()
     if len(lines) < 3:
@@ -222,7 +254,7 @@ def _read_xyz_coordinates(xyz_path: Path) -> list[tuple[float, float, float]]:
     return coords
 
 
-def _run_xtb(xyz: Path, work_dir: Path, xtb_exe: str, charge: int, log: Path) -> Path:
+def _run_xtb(xyz: Path, work_dir: Path, xtb_exe: str, charge: int, log: Path, nprocs: Optional[int] = None) -> Path:
     cmd = [xtb_exe, xyz.name, "--opt", "--chrg", str(charge)]
 
     env = os.environ.copy()
@@ -230,25 +262,11 @@ def _run_xtb(xyz: Path, work_dir: Path, xtb_exe: str, charge: int, log: Path) ->
         xtb_share = Path(xtb_exe).parent.parent / "share" / "xtb"
         if xtb_share.exists():
             env["XTBPATH"] = str(xtb_share)
+    if nprocs is not None:
+        env["OMP_NUM_THREADS"] = f"{nprocs},1"
+        env["MKL_NUM_THREADS"] = str(nprocs)
 
-    result = subprocess.run(
-        cmd,
-        capture_output=True,
-        text=True,
-        cwd=str(work_dir),
-        env=env,
-    )
-
-    with log.open("a", encoding="utf-8") as fh:
-        fh.write("\n\n=== CMD ===\n")
-        fh.write(f"CWD: {work_dir}\n")
-        fh.write("CMD: " + " ".join(shlex.quote(x) for x in cmd) + "\n")
-        fh.write("=== STDOUT ===\n")
-        fh.write(result.stdout)
-        fh.write("\n=== STDERR ===\n")
-        fh.write(result.stderr)
-        fh.write("\n=== RETURN CODE ===\n")
-        fh.write(str(result.returncode) + "\n")
+    result = _run(cmd, cwd=work_dir, log_path=log, env=env)
 
     if result.returncode != 0:
         raise RuntimeError(
@@ -264,15 +282,36 @@ def _run_xtb(xyz: Path, work_dir: Path, xtb_exe: str, charge: int, log: Path) ->
     return out
 
 
-def _write_orca_opt_input(xyz: Path, out: Path, charge: int, mult: int, nprocs: int):
-    text = f"""! HF 6-31G* TightSCF Opt TightOpt
+def _maxcore_line(maxcore: Optional[int]) -> str:
+    return f"\n%maxcore {int(maxcore)}\n" if maxcore else ""
+
+
+def _moread_block(guess_gbw: Optional[Path]) -> tuple[str, str]:
+    if guess_gbw is None:
+        return "", ""
+    return " MORead", f'\n%moinp "{guess_gbw.name}"\n'
 
+
+def _write_orca_opt_input(
+    xyz: Path,
+    out: Path,
+    charge: int,
+    mult: int,
+    nprocs: int,
+    level: str = "TightOpt",
+    max_iter: int = 300,
+    guess_gbw: Optional[Path] = None,
+    maxcore: Optional[int] = None,
+):
+    moread, moinp = _moread_block(guess_gbw)
+    text = f"""! HF 6-31G* TightSCF Opt {level}{moread}
+{moinp}
 %pal
   nprocs {nprocs}
 end
-
+{_maxcore_line(maxcore)}
 %geom
-  MaxIter 300
+  MaxIter {max_iter}
 end
 
 * xyzfile {charge} {mult} {xyz.name}
@@ -280,18 +319,54 @@ end
     out.write_text(text, encoding="utf-8")
 
 
-def _write_orca_sp_input(xyz: Path, out: Path, charge: int, mult: int, nprocs: int):
-    text = f"""! HF 6-31G* TightSCF
-
+def _write_orca_sp_input(
+    xyz: Path,
+    out: Path,
+    charge: int,
+    mult: int,
+    nprocs: int,
+    keep_density: bool = False,
+    guess_gbw: Optional[Path] = None,
+    maxcore: Optional[int] = None,
+):
+    # orca_vpot reads the SCF density, which ORCA deletes unless asked to keep it.
+    keywords = "HF 6-31G* TightSCF KeepDens" if keep_density else "HF 6-31G* TightSCF"
+    # Start from converged orbitals of an earlier job at the same level of theory.
+    moread, moinp = _moread_block(guess_gbw)
+    text = f"""! {keywords}{moread}
+{moinp}
 %pal
   nprocs {nprocs}
 end
+{_maxcore_line(maxcore)}
+* xyzfile {charge} {mult} {xyz.name}
+"""
+    out.write_text(text, encoding="utf-8")
+
+
+def _write_orca_grad_input(xyz: Path, out: Path, charge: int, mult: int, nprocs: int, maxcore: Optional[int] = None):
+    text = f"""! HF 6-31G* TightSCF EnGrad
 
+%pal
+  nprocs {nprocs}
+end
+{_maxcore_line(maxcore)}
 * xyzfile {charge} {mult} {xyz.name}
 """
     out.write_text(text, encoding="utf-8")
 
 
+def _read_engrad(path: Path) -> np.ndarray:
+    """Cartesian gradient (Eh/bohr) from an ORCA .engrad file."""
+    values = [
+        line.strip()
+        for line in path.read_text(encoding="utf-8", errors="replace").splitlines()
+        if line.strip() and not line.lstrip().startswith("#")
+    ]
+    natoms = int(values[0])
+    return np.array([float(v) for v in values[2:2 + 3 * natoms]], dtype=np.float64)
+
+
 def _parse_multiwfn_resp_output(raw_output: Path) -> list[float]:
     lines = raw_output.read_text(encoding="utf-8", errors="replace").splitlines()
     start_index = None
@@ -417,22 +492,7 @@ def _run_antechamber_resp_rc(
         "-s", "2",
     ]
 
-    result = subprocess.run(
-        cmd,
-        capture_output=True,
-        text=True,
-        cwd=str(output_mol2.parent),
-    )
-
-    with log_path.open("a", encoding="utf-8") as log:
-        log.write("\n\n=== ANTECHAMBER RESP RC ===\n")
-        log.write("CMD: " + " ".join(shlex.quote(x) for x in cmd) + "\n")
-        log.write("=== STDOUT ===\n")
-        log.write(result.stdout)
-        log.write("\n=== STDERR ===\n")
-        log.write(result.stderr)
-        log.write("\n=== RETURN CODE ===\n")
-        log.write(str(result.returncode) + "\n")
+    result = _run(cmd, cwd=output_mol2.parent, log_path=log_path)
 
     if result.returncode != 0:
         raise RuntimeError(
@@ -460,20 +520,31 @@ def _expect_or_raise(child, patterns, step: str, timeout: int):
 
 def _run_multiwfn_resp(
     *,
-    molden_path: Path,
+    molden_paths: list[Path],
     fitting_dir: Path,
     log_path: Path,
     multiwfn_exe: str,
+    weights: Optional[list[float]] = None,
 ) -> list[float]:
     import pexpect
 
-    if not molden_path.exists():
-        raise FileNotFoundError(f"Molden file not found: {molden_path}")
+    for molden_path in molden_paths:
+        if not molden_path.exists():
+            raise FileNotFoundError(f"Molden file not found: {molden_path}")
+    molden_path = molden_paths[0]
 
     fitting_dir.mkdir(parents=True, exist_ok=True)
 
     conformer_list = fitting_dir / "resp_conformers.txt"
-    conformer_list.write_text(f"{molden_path.name}\n", encoding="utf-8")
+    if len(molden_paths) == 1:
+        conformer_list.write_text(f"{molden_path.name}\n", encoding="utf-8")
+    else:
+        # One "file weight" line per conformer; Multiwfn fits all of them at once.
+        weights = weights or [1.0 / len(molden_paths)] * len(molden_paths)
+        conformer_list.write_text(
+            "".join(f"{p.name} {w:.8f}\n" for p, w in zip(molden_paths, weights)),
+            encoding="utf-8",
+        )
 
     raw_output = fitting_dir / "MultiWfn_raw_outputs.txt"
 
@@ -569,45 +640,691 @@ def _run_multiwfn_resp(
     return _parse_multiwfn_resp_output(raw_output)
 
 # =========================
-# MAIN WORKFLOW
+# NATIVE ESP
 # =========================
-def run_resp_charge_workflow(
+def _write_vpot_grid(points_bohr: np.ndarray, path: Path) -> None:
+    lines = [str(len(points_bohr))]
+    lines.extend(f"{x: .8f} {y: .8f} {z: .8f}" for x, y, z in points_bohr.tolist())
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+
+def _read_vpot(path: Path) -> tuple[np.ndarray, np.ndarray]:
+    """Grid points (bohr) and potential (a.u.) from an orca_vpot output file."""
+    lines = path.read_text(encoding="utf-8", errors="replace").splitlines()
+    try:
+        n = int(lines[0].split()[0])
+        data = np.array([[float(x) for x in line.split()[:4]] for line in lines[1:1 + n]], dtype=np.float64)
+    except (IndexError, ValueError) as exc:
+        raise RuntimeError(f"Malformed orca_vpot output: {path}") from exc
+    if data.shape != (n, 4):
+        raise RuntimeError(f"orca_vpot output has {len(data)} points, expected {n}: {path}")
+    return data[:, :3], data[:, 3]
+
+
+def _run_orca_vpot(work_dir: Path, opt_xyz: Path, *, orca_vpot: str, log: Path, env: Optional[dict] = None) -> Path:
+    """ESP of the single point on a Merz-Kollman grid around the optimized geometry."""
+    coords = np.array(_read_xyz_coordinates(opt_xyz), dtype=np.float64)
+    points = esp_grid(coords, _read_xyz_elements(opt_xyz), density=_env_float("NSAA_RESP_GRID_DENSITY", 6.0))
+
+    grid = work_dir / "resp_sp.vpot.xyz"
+    _write_vpot_grid(points * ANGSTROM_TO_BOHR, grid)
+
+    # ORCA 4 keeps the density as .scfp, ORCA 5 and later as .densities.
+    density = next(
+        (work_dir / f"resp_sp.{ext}" for ext in ("scfp", "densities") if (work_dir / f"resp_sp.{ext}").exists()),
+        None,
+    )
+    if density is None:
+        raise FileNotFoundError("SP density not found (resp_sp.scfp or resp_sp.densities)")
+
+    out = work_dir / "resp_sp.vpot.out"
+    result = _run([orca_vpot, "resp_sp.gbw", density.name, grid.name, out.name], cwd=work_dir, log_path=log, env=env)
+    if result.returncode != 0:
+        raise RuntimeError(
+            "orca_vpot failed.\n"
+            f"STDOUT:\n{result.stdout}\n\n"
+            f"STDERR:\n{result.stderr}"
+        )
+    if not out.exists() or out.stat().st_size == 0:
+        raise RuntimeError("orca_vpot did not write the ESP file")
+    return out
+
+
+def _run_native_resp(
     *,
-    capped_file: str,
-    charged_file: str,
-    resname: str,
+    mol2: Path,
+    atoms: list[AtomView],
+    chains: list[dict],
+    weights: list[float],
     net_charge: int,
-    residue_dir: str,
-    orca_path: Optional[str] = None,
-    orca_2mkl_path: Optional[str] = None,
-    multiwfn_path: Optional[str] = None,
-    xtb_path: Optional[str] = None,
+    fitting_dir: Path,
+) -> list[float]:
+    mol = require_atoms(str(mol2))
+    row_of = {a.atom_id: i for i, a in enumerate(atoms)}
+    bonds = [(row_of[b.a1], row_of[b.a2]) for b in mol.bonds if b.a1 in row_of and b.a2 in row_of]
+
+    conformers = []
+    for result in chains:
+        points, values = _read_vpot(result["esp"])
+        coords = np.array(_read_xyz_coordinates(result["opt_xyz"]), dtype=np.float64) * ANGSTROM_TO_BOHR
+        if len(coords) != len(atoms):
+            raise RuntimeError(
+                f"Optimized XYZ has {len(coords)} atoms, but capped MOL2 has {len(atoms)} atoms."
+            )
+        conformers.append((coords, points, values))
+
+    fit = fit_resp(
+        conformers,
+        total_charge=float(net_charge),
+        elements=[_guess_element(a.name, a.atom_type) for a in atoms],
+        bonds=bonds,
+        classes=symmetry_classes(atoms, mol.bonds),
+        weights=weights,
+    )
+
+    report = {
+        "charges": [float(q) for q in fit.charges],
+        "atom_names": [a.name for a in atoms],
+        "rrms": fit.rrms,
+        "stage_rrms": list(fit.stage_rrms),
+        "iterations": list(fit.iterations),
+        "grid_points": [len(c[1]) for c in conformers],
+        "weights": list(weights),
+    }
+    (fitting_dir / "resp_native.json").write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"[RESP] native fit: RRMS {fit.rrms:.4f} over {sum(report['grid_points'])} ESP points")
+    return [float(q) for q in fit.charges]
+
+
+# =========================
+# STAGE CHECKPOINTS
+# =========================
+def _file_digest(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as fh:
+        for block in iter(lambda: fh.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _checkpointed(work_dir: Path, stage: str, inputs: dict, outputs: list[str], run, *, log: Path) -> dict:
+    """
+    Run one QM stage unless its marker records the same inputs and every
+    output it recorded is still on disk unchanged. ``run`` returns the JSON
+    result of the stage, which a reused stage returns from its marker.
+    Outputs in ``outputs`` that a run does not produce are not recorded.
+    A run that needed fallback settings (``result["fallback"]``) leaves no
+    marker: its outputs do not match the recorded inputs.
+    NSAA_RESP_RESUME=0 reruns every stage.
+    """
+    marker = work_dir / f"resp_stage_{stage}.json"
+    key = stable_digest({"version": 1, "stage": stage, **inputs})
+    resume = os.environ.get("NSAA_RESP_RESUME", "1").strip().lower() not in {"0", "false", "no"}
+
+    if resume and marker.exists():
+        try:
+            done = json.loads(marker.read_text(encoding="utf-8"))
+            valid = done["inputs"] == key and all(
+                (work_dir / name).exists() and _file_digest(work_dir / name) == digest
+                for name, digest in done["outputs"].items()
+            )
+        except (OSError, ValueError, KeyError, TypeError):
+            valid = False
+        if valid:
+            with _LOG_LOCK, log.open("a", encoding="utf-8") as fh:
+                fh.write(f"\n\n=== STAGE {stage} REUSED ===\nCWD: {work_dir}\n")
+            print(f"[RESP] {stage} stage unchanged, reusing {work_dir.name}/{marker.name}")
+            return done["result"]
+
+    marker.unlink(missing_ok=True)
+    result = run()
+    if result.get("fallback"):
+        return result
+    record = {
+        "stage": stage,
+        "inputs": key,
+        "input_fields": inputs,
+        "outputs": {name: _file_digest(work_dir / name) for name in outputs if (work_dir / name).exists()},
+        "result": result,
+    }
+    tmp = marker.with_name(marker.name + ".tmp")
+    tmp.write_text(json.dumps(record, indent=2), encoding="utf-8")
+    os.replace(tmp, marker)
+    return result
+
+
+# =========================
+# QM CHAINS
+# =========================
+_FINAL_ENERGY = re.compile(r"FINAL SINGLE POINT ENERGY\s+(-?\d+\.\d+)")
+_SCF_CONVERGED = re.compile(r"SCF CONVERGED AFTER\s+(\d+)\s+CYCLES")
+
+
+class _OrcaWatch:
+    """
+    Line callback collecting what the chain needs from ORCA's output while it
+    streams: the last final energy, the SCF iterations summed over every SCF
+    of the job (one per optimization step) and normal termination.
+    """
+
+    def __init__(self):
+        self.energy: Optional[float] = None
+        self.scf_cycles: Optional[int] = None
+        self.terminated = False
+
+    def __call__(self, stream: str, line: str) -> None:
+        if stream != "stdout":
+            return
+        m = _FINAL_ENERGY.search(line)
+        if m:
+            self.energy = float(m.group(1))
+        m = _SCF_CONVERGED.search(line)
+        if m:
+            self.scf_cycles = (self.scf_cycles or 0) + int(m.group(1))
+        if "ORCA TERMINATED NORMALLY" in line:
+            self.terminated = True
+
+
+def _write_orca_fallback_input(inp: Path, *, geometry_stalled: bool) -> None:
+    """
+    Rewrite an aborted ORCA input for its retry: damped SCF (SlowConv) and,
+    for a stalled optimization, LooseOpt from the last geometry it reached.
+    """
+    text = inp.read_text(encoding="utf-8")
+    keywords, rest = text.split("\n", 1)
+    if "SlowConv" not in keywords:
+        keywords += " SlowConv"
+    last_xyz = inp.with_suffix(".xyz")
+    if geometry_stalled and " Opt" in keywords and last_xyz.exists():
+        keywords = keywords.replace("TightOpt", "LooseOpt")
+        # ORCA rewrites <basename>.xyz every cycle; restart from a copy of it.
+        restart = inp.with_name(f"{inp.stem}_restart.xyz")
+        shutil.copyfile(last_xyz, restart)
+        rest = re.sub(r"^(\* xyzfile \S+ \S+) \S+$", rf"\1 {restart.name}", rest, flags=re.M)
+    inp.write_text(f"{keywords}\n{rest}", encoding="utf-8")
+
+
+def _orca_env(allocation: Allocation, *, ranks: int) -> dict:
+    # Threads per process so that ``ranks`` processes fill the allocation and
+    # no more: a %pal job starts one MPI rank per core, and OpenMP/BLAS would
+    # otherwise start a thread per machine core inside every one of them.
+    threads = str(max(1, allocation.nprocs // ranks))
+    env = os.environ.copy()
+    env["OMP_NUM_THREADS"] = threads
+    env["MKL_NUM_THREADS"] = threads
+    return env
+
+
+def _run_orca(orca: str, inp: Path, *, work_dir: Path, log: Path, env: dict) -> tuple[subprocess.CompletedProcess, _OrcaWatch, Optional[str]]:
+    """
+    Run one ORCA job under the convergence monitor (see modules.convergence).
+    A job the monitor aborts is retried once from a fallback input; the third
+    value is the reason of that abort, None when the first run went through.
+    """
+    settings = monitor_settings()
+    aborted: Optional[str] = None
+    while True:
+        watch = _OrcaWatch()
+        monitor = OrcaMonitor(settings) if settings is not None else None
+        try:
+            result = _run([orca, str(inp.resolve())], cwd=work_dir, log_path=log, env=env, on_line=fan_out(watch, monitor))
+            return result, watch, aborted
+        except RunAborted as exc:
+            if aborted is not None or not settings.fallback:
+                raise RuntimeError(
+                    f"ORCA job {inp.name} aborted: {exc.reason}\n"
+                    f"STDOUT:\n{exc.stdout}\n\n"
+                    f"STDERR:\n{exc.stderr}"
+                ) from exc
+            aborted = exc.reason
+            print(f"[RESP] {work_dir.name}/{inp.name} aborted ({exc.reason}); retrying with fallback settings")
+            _write_orca_fallback_input(inp, geometry_stalled=monitor.tripped == "geometry")
+
+
+def _run_qm_chain(
+    xyz: Path,
+    work_dir: Path,
+    *,
+    orca: str,
+    orca2mkl: Optional[str],
+    orca_vpot: Optional[str],
+    xtb: str,
+    geometry: str,
+    charge: int,
+    mult: int,
+    allocation: Allocation,
+    log: Path,
 ) -> dict:
-    residue_path = Path(residue_dir)
-    qm = residue_path / "resp_qm"
-    fit = residue_path / "resp_fit"
-    qm.mkdir(parents=True, exist_ok=True)
-    fit.mkdir(parents=True, exist_ok=True)
+    """
+    xtb pre-optimization, ORCA HF/6-31G* optimization and single point, then
+    either a molden export (``orca2mkl``) or the ESP on a fitting grid (``orca_vpot``).
+
+    The ORCA optimization follows the ``geometry`` policy. Before it runs, one
+    HF gradient at the xtb geometry decides whether it is needed at all: below
+    the policy's thresholds the xtb geometry is kept, otherwise that job's
+    orbitals start the optimization.
+
+    Every program of the chain runs on the cores and memory of ``allocation``;
+    ORCA gets one thread per %pal rank, the serial ORCA tools the whole share.
+    """
+    nprocs = allocation.nprocs
+    maxcore = allocation.maxcore_mb
+    orca_env = _orca_env(allocation, ranks=nprocs)
+    tool_env = _orca_env(allocation, ranks=1)
+
+    def run_xtb() -> dict:
+        _run_xtb(xyz=xyz, work_dir=work_dir, xtb_exe=xtb, charge=charge, log=log, nprocs=nprocs)
+        return {}
+
+    _checkpointed(
+        work_dir,
+        "xtb",
+        {"xyz": _file_digest(xyz), "charge": charge, "method": "xtb --opt", "program": xtb},
+        ["xtbopt.xyz"],
+        run_xtb,
+        log=log,
+    )
+    xtb_xyz = work_dir / "xtbopt.xyz"
+
+    moread = os.environ.get("NSAA_RESP_SP_MOREAD", "1").strip().lower() not in {"0", "false", "no"}
+    geometry_meta: dict = {"policy": geometry, "orca_opt": "skipped"}
+    scf_cycles: dict = {}
+    fallbacks: dict = {}
+    opt_inp: Optional[Path] = None
+    opt_xyz = xtb_xyz
+    guess: Optional[Path] = None
+    qm_inputs = {"charge": charge, "mult": mult, "program": orca}
+
+    level = _GEOMETRY_POLICIES[geometry]
+    check = os.environ.get("NSAA_RESP_GRADIENT_CHECK", "1").strip().lower() not in {"0", "false", "no"}
+    converged = False
+    if level is not None and check:
+        def run_grad() -> dict:
+            grad_inp = work_dir / "resp_grad.inp"
+            _write_orca_grad_input(xyz=xtb_xyz, out=grad_inp, charge=charge, mult=mult, nprocs=nprocs, maxcore=maxcore)
+            grad_result, watch, aborted = _run_orca(orca, grad_inp, work_dir=work_dir, log=log, env=orca_env)
+            engrad = work_dir / "resp_grad.engrad"
+            if grad_result.returncode != 0 or not engrad.exists():
+                raise RuntimeError("ORCA gradient at the xtb geometry failed")
+            gradient = _read_engrad(engrad)
+            return {
+                "max": float(np.abs(gradient).max()),
+                "rms": float(np.sqrt(np.mean(gradient ** 2))),
+                "scf_cycles": watch.scf_cycles,
+                "fallback": aborted,
+            }
+
+        grad = _checkpointed(
+            work_dir,
+            "grad",
+            {**qm_inputs, "xyz": _file_digest(xtb_xyz), "method": "HF 6-31G* TightSCF EnGrad"},
+            ["resp_grad.engrad", "resp_grad.gbw"],
+            run_grad,
+            log=log,
+        )
+        converged = grad["max"] < level[2] and grad["rms"] < level[3]
+        geometry_meta["gradient"] = {"max": grad["max"], "rms": grad["rms"]}
+        scf_cycles["grad"] = grad["scf_cycles"]
+        if grad.get("fallback"):
+            fallbacks["grad"] = grad["fallback"]
+        if (work_dir / "resp_grad.gbw").exists():
+            guess = work_dir / "resp_grad.gbw"
+
+    if level is not None and not converged:
+        opt_inp = work_dir / "resp_opt.inp"
+
+        def run_opt() -> dict:
+            _write_orca_opt_input(
+                xyz=xtb_xyz,
+                out=opt_inp,
+                charge=charge,
+                mult=mult,
+                nprocs=nprocs,
+                level=level[0],
+                max_iter=level[1],
+                guess_gbw=guess if moread else None,
+                maxcore=maxcore,
+            )
+
+            opt_result, watch, aborted = _run_orca(orca, opt_inp, work_dir=work_dir, log=log, env=orca_env)
+            if opt_result.returncode != 0:
+                raise RuntimeError("ORCA optimization crashed")
+            #if not watch.terminated:
+             #   raise RuntimeError("ORCA optimization did not terminate normally")
+            #if "OPTIMIZATION HAS CONVERGED" not in opt_result.stdout:
+             #   print("[WARNING] ORCA optimization did not fully converge")
+
+            if not (work_dir / "resp_opt.xyz").exists():
+                raise FileNotFoundError("Optimized XYZ not found (resp_opt.xyz)")
+            return {"scf_cycles": watch.scf_cycles, "fallback": aborted}
+
+        opt = _checkpointed(
+            work_dir,
+            "opt",
+            {
+                **qm_inputs,
+                "xyz": _file_digest(xtb_xyz),
+                "method": f"HF 6-31G* TightSCF Opt {level[0]}",
+                "max_iter": level[1],
+            },
+            ["resp_opt.xyz", "resp_opt.gbw"],
+            run_opt,
+            log=log,
+        )
+        opt_xyz = work_dir / "resp_opt.xyz"
+        geometry_meta["orca_opt"] = level[0]
+        scf_cycles["opt"] = opt["scf_cycles"]
+        if opt.get("fallback"):
+            fallbacks["opt"] = opt["fallback"]
+        opt_gbw = work_dir / "resp_opt.gbw"
+        guess = opt_gbw if opt_gbw.exists() else None
+
+    use_guess = moread and guess is not None
+    sp_inp = work_dir / "resp_sp.inp"
+
+    def run_sp() -> dict:
+        _write_orca_sp_input(
+            xyz=opt_xyz,
+            out=sp_inp,
+            charge=charge,
+            mult=mult,
+            nprocs=nprocs,
+            keep_density=orca_vpot is not None,
+            guess_gbw=guess if use_guess else None,
+            maxcore=maxcore,
+        )
+
+        sp_result, watch, aborted = _run_orca(orca, sp_inp, work_dir=work_dir, log=log, env=orca_env)
+        if sp_result.returncode != 0:
+            raise RuntimeError("ORCA SP crashed")
+        if not watch.terminated:
+            raise RuntimeError("ORCA SP did not terminate normally")
+        if not (work_dir / "resp_sp.gbw").exists():
+            raise FileNotFoundError("SP GBW not found (resp_sp.gbw)")
+        return {
+            "energy": watch.energy,
+            "scf_cycles": watch.scf_cycles,
+            "guess": guess.name if use_guess else "default",
+            "fallback": aborted,
+        }
+
+    sp = _checkpointed(
+        work_dir,
+        "sp",
+        {
+            **qm_inputs,
+            "xyz": _file_digest(opt_xyz),
+            "method": "HF 6-31G* TightSCF",
+            "keep_density": orca_vpot is not None,
+        },
+        ["resp_sp.gbw", "resp_sp.scfp", "resp_sp.densities"],
+        run_sp,
+        log=log,
+    )
+    gbw_path = work_dir / "resp_sp.gbw"
+
+    result = {
+        "input_xyz": xyz,
+        "xtb_xyz": xtb_xyz,
+        "opt_input": opt_inp,
+        "opt_xyz": opt_xyz,
+        "sp_input": sp_inp,
+        "sp_gbw": gbw_path,
+        "molden": None,
+        "esp": None,
+        "energy": sp["energy"],
+        "sp_guess": sp["guess"],
+        "scf_cycles": {**scf_cycles, "sp": sp["scf_cycles"]},
+        "fallbacks": {**fallbacks, **({"sp": sp["fallback"]} if sp.get("fallback") else {})},
+        "geometry": geometry_meta,
+        "resources": {"nprocs": nprocs, "maxcore_mb": maxcore},
+    }
+    if orca_vpot is not None:
+        def run_esp() -> dict:
+            _run_orca_vpot(work_dir, opt_xyz, orca_vpot=orca_vpot, log=log, env=tool_env)
+            return {}
+
+        _checkpointed(
+            work_dir,
+            "esp",
+            {
+                "gbw": _file_digest(gbw_path),
+                "grid_density": _env_float("NSAA_RESP_GRID_DENSITY", 6.0),
+                "program": orca_vpot,
+            },
+            ["resp_sp.vpot.out"],
+            run_esp,
+            log=log,
+        )
+        result["esp"] = work_dir / "resp_sp.vpot.out"
+        return result
+
+    def run_molden() -> dict:
+        mkl_result = _run([orca2mkl, "resp_sp", "-molden"], cwd=work_dir, log_path=log, env=tool_env)
+        if mkl_result.returncode != 0:
+            raise RuntimeError("orca_2mkl failed")
+
+        molden = work_dir / "resp_sp.molden.input"
+        if not molden.exists():
+            raise RuntimeError("Molden file not generated")
+        if molden.stat().st_size == 0:
+            raise RuntimeError("Molden file is empty")
+        return {}
+
+    _checkpointed(
+        work_dir,
+        "molden",
+        {"gbw": _file_digest(gbw_path), "program": orca2mkl},
+        ["resp_sp.molden.input"],
+        run_molden,
+        log=log,
+    )
+    result["molden"] = work_dir / "resp_sp.molden.input"
+    return result
 
-    log = residue_path / f"{resname}_resp.log"
-    log.write_text("", encoding="utf-8")
-    final_mol2 = Path(charged_file).resolve()
 
+def _run_conformer_chains(
+    mol2: Path,
+    atoms: list[AtomView],
+    qm: Path,
+    n_conformers: int,
+    nprocs: int,
+    *,
+    resname: str,
+    chain: dict,
+) -> list[dict]:
+    """
+    One QM chain per conformer, run side by side. ``nprocs`` is the core
+    budget of the whole residue: it is split evenly over the chains that run
+    at the same time, each of which reserves its share from the QM scheduler.
+    Failed conformers are dropped as long as one succeeds.
+    """
+    conformers = generate_conformers(mol2, n_conformers)
+    print(f"[RESP] {len(conformers)} conformer(s) for {resname} (requested {n_conformers})")
+
+    jobs = max(1, min(len(conformers), _env_int("NSAA_RESP_CONFORMER_JOBS", nprocs)))
+    per_chain = max(1, nprocs // jobs)
+
+    def run_one(i: int) -> dict:
+        work_dir = qm / f"conf_{i:02d}"
+        work_dir.mkdir(parents=True, exist_ok=True)
+        xyz = work_dir / "resp_input.xyz"
+        _write_xyz(atoms, conformers[i], xyz, f"Conformer {i} of {mol2.name}")
+        with default_scheduler().reserve(per_chain, label=f"{resname} conformer {i}") as allocation:
+            return _run_qm_chain(xyz, work_dir, allocation=allocation, **chain)
+
+    results: list[dict] = []
+    errors: list[str] = []
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(run_one, i) for i in range(len(conformers))]
+        for i, fut in enumerate(futures):
+            try:
+                results.append(fut.result())
+            except Exception as e:
+                errors.append(f"conformer {i}: {e}")
+                print(f"[RESP] warning: conformer {i} of {resname} failed and is left out: {e}")
+
+    if not results:
+        raise RuntimeError("All RESP conformer QM chains failed.\n" + "\n".join(errors))
+    return results
+
+
+def _conformer_weights(energies: list[Optional[float]]) -> list[float]:
+    """
+    Fitting weight per conformer. Equal by default; with
+    NSAA_RESP_CONFORMER_WEIGHTS=boltzmann, Boltzmann weights at 298.15 K
+    from the single-point energies.
+    """
+    n = len(energies)
+    mode = os.environ.get("NSAA_RESP_CONFORMER_WEIGHTS", "equal").strip().lower()
+    if mode not in {"equal", "boltzmann"}:
+        raise ValueError(f"Unsupported NSAA_RESP_CONFORMER_WEIGHTS: {mode}")
+    if mode == "equal" or n == 1 or any(e is None for e in energies):
+        return [1.0 / n] * n
+
+    rel = (np.array(energies, dtype=np.float64) - min(energies)) * HARTREE_TO_KCAL
+    w = np.exp(-rel / (BOLTZMANN_KCAL * 298.15))
+    return (w / w.sum()).tolist()
+
+
+# =========================
+# MAIN WORKFLOW
+# =========================
+def _qm_cache() -> Optional[ResultCache]:
+    root = os.environ.get("NSAA_QM_CACHE_DIR")
+    if not root:
+        return None
+    max_mb = _env_int("NSAA_QM_CACHE_MAX_MB", 2048)
+    return ResultCache(root, max_bytes=max_mb * 1024 * 1024)
+
+
+def _qm_cache_key(mol2: Path, atoms: list[AtomView], *, charge: int, mult: int, backend: str, geometry: str) -> str:
+    """
+    Everything the fitted charges depend on: elements and coordinates (A,
+    rounded to 1e-4) in atom order, bonds, charge, multiplicity, the ORCA
+    keyword lines and the fit settings. Atom and residue names do not enter.
+    """
+    row_of = {a.atom_id: i for i, a in enumerate(atoms)}
+    bonds = sorted(
+        sorted((row_of[b.a1], row_of[b.a2]))
+        for b in require_atoms(str(mol2)).bonds
+        if b.a1 in row_of and b.a2 in row_of
+    )
+    level = _GEOMETRY_POLICIES[geometry]
+    return stable_digest(
+        {
+            "version": 1,
+            "elements": [_guess_element(a.name, a.atom_type) for a in atoms],
+            "coords": [[round(v, 4) for v in (a.x, a.y, a.z)] for a in atoms],
+            "bonds": bonds,
+            "charge": int(charge),
+            "mult": int(mult),
+            "opt": f"HF 6-31G* TightSCF Opt {level[0]} MaxIter {level[1]}" if level else None,
+            "gradient_check": os.environ.get("NSAA_RESP_GRADIENT_CHECK", "1") if level else None,
+            "sp": "HF 6-31G* TightSCF",
+            "backend": backend,
+            "grid_density": _env_float("NSAA_RESP_GRID_DENSITY", 6.0) if backend == "native" else None,
+            "conformers": max(1, _env_int("NSAA_RESP_CONFORMERS", 1)),
+            "conformer_weights": os.environ.get("NSAA_RESP_CONFORMER_WEIGHTS", "equal").strip().lower(),
+        }
+    )
+
+
+def _store_qm_cache(
+    cache: ResultCache,
+    key: str,
+    *,
+    charges: list[float],
+    qm_meta: dict,
+    files: dict[str, Path],
+    staging: Path,
+) -> None:
+    """Store the optimized geometry, the gzipped fit inputs and the charges under ``key``."""
+    stored: dict[str, Path] = {}
+    for name, path in files.items():
+        if name.endswith(".gz"):
+            packed = staging / name
+            with path.open("rb") as src, gzip.open(packed, "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            stored[name] = packed
+        else:
+            stored[name] = path
+    try:
+        cache.put(key, stored, info={"charges": charges, "qm_meta": qm_meta})
+    except OSError as e:
+        print(f"[RESP] warning: could not store QM results in cache: {e}")
+    finally:
+        for name in files:
+            if name.endswith(".gz"):
+                (staging / name).unlink(missing_ok=True)
+
+
+def _restore_qm_cache(cache: ResultCache, key: str, *, qm: Path, fit: Path) -> Optional[tuple[list[float], dict, dict]]:
+    """(charges, QM meta, {stored name: restored path}) of entry ``key``, or None on a miss."""
+    entry = cache.get(key)
+    if entry is None:
+        return None
+    try:
+        info = json.loads((entry / "entry.json").read_text(encoding="utf-8"))
+        restored: dict[str, Path] = {}
+        for name in info.get("files", []):
+            if name.endswith(".gz"):
+                dst = fit / name[: -len(".gz")]
+                with gzip.open(entry / name, "rb") as src, dst.open("wb") as out:
+                    shutil.copyfileobj(src, out)
+            else:
+                dst = (qm if name.endswith(".xyz") else fit) / name
+                shutil.copyfile(entry / name, dst)
+            restored[name] = dst
+        return [float(q) for q in info["charges"]], dict(info["qm_meta"]), restored
+    except (OSError, ValueError, KeyError, EOFError):
+        # Entry evicted or half-written by another process; treat as a miss.
+        return None
+
+
+def _run_resp_qm(
+    *,
+    mol2: Path,
+    xyz: Path,
+    atoms: list[AtomView],
+    qm: Path,
+    fit: Path,
+    log: Path,
+    resname: str,
+    net_charge: int,
+    multiplicity: int,
+    backend: str,
+    geometry: str,
+    orca_path: Optional[str],
+    orca_2mkl_path: Optional[str],
+    multiwfn_path: Optional[str],
+    xtb_path: Optional[str],
+    orca_vpot_path: Optional[str],
+) -> tuple[list[float], dict, list[Path]]:
+    """QM chains and RESP fit: (charges, QM meta, fit input files)."""
     orca = _resolve_executable(
         cli_value=orca_path,
         env_var="NSAA_ORCA_EXE",
         program_name="orca",
     )
-    orca2mkl = _resolve_executable(
-        cli_value=orca_2mkl_path,
-        env_var="NSAA_ORCA_2MKL_EXE",
-        program_name="orca_2mkl",
-    )
-    multiwfn = _resolve_executable(
-        cli_value=multiwfn_path,
-        env_var="NSAA_MULTIWFN_EXE",
-        program_name="Multiwfn_noGUI",
-    )
+    orca2mkl = multiwfn = orca_vpot = None
+    if backend == "native":
+        orca_vpot = _resolve_executable(
+            cli_value=orca_vpot_path,
+            env_var="NSAA_ORCA_VPOT_EXE",
+            program_name="orca_vpot",
+        )
+    else:
+        orca2mkl = _resolve_executable(
+            cli_value=orca_2mkl_path,
+            env_var="NSAA_ORCA_2MKL_EXE",
+            program_name="orca_2mkl",
+        )
+        multiwfn = _resolve_executable(
+            cli_value=multiwfn_path,
+            env_var="NSAA_MULTIWFN_EXE",
+            program_name="Multiwfn_noGUI",
+        )
     xtb = _resolve_executable(
         cli_value=xtb_path,
         env_var="NSAA_XTB_EXE",
@@ -615,107 +1332,208 @@ def run_resp_charge_workflow(
     )
 
     print(f"[RESP] ORCA: {orca}")
-    print(f"[RESP] ORCA_2MKL: {orca2mkl}")
-    print(f"[RESP] Multiwfn: {multiwfn}")
+    if backend == "native":
+        print(f"[RESP] orca_vpot: {orca_vpot}")
+    else:
+        print(f"[RESP] ORCA_2MKL: {orca2mkl}")
+        print(f"[RESP] Multiwfn: {multiwfn}")
     print(f"[RESP] xTB: {xtb}")
 
-    mol2 = Path(capped_file)
-    xyz = qm / "resp_input.xyz"
-    atoms = _write_xyz_from_mol2(mol2, xyz)
+    # Cores the residue asks for; the QM scheduler may grant fewer on a busy machine.
+    nprocs = _env_int("NSAA_RESP_NPROCS", cores_for_atoms(len(atoms)))
+    n_conformers = max(1, _env_int("NSAA_RESP_CONFORMERS", 1))
 
-    multiplicity = _env_int(
-        "NSAA_RESP_MULTIPLICITY",
-        _guess_multiplicity(str(mol2), int(net_charge)),
-    )
-    nprocs = _env_int("NSAA_RESP_NPROCS", 4)
-
-    xtb_xyz = _run_xtb(
-        xyz=xyz,
-        work_dir=qm,
-        xtb_exe=xtb,
-        charge=int(net_charge),
-        log=log,
-    )
-
-    opt_inp = qm / "resp_opt.inp"
-    _write_orca_opt_input(
-        xyz=xtb_xyz,
-        out=opt_inp,
+    chain = dict(
+        orca=orca,
+        orca2mkl=orca2mkl,
+        orca_vpot=orca_vpot,
+        xtb=xtb,
+        geometry=geometry,
         charge=int(net_charge),
         mult=multiplicity,
-        nprocs=nprocs,
-    )
-
-    opt_result = _run([orca, str(opt_inp.resolve())], cwd=qm, log_path=log)
-    if opt_result.returncode != 0:
-        raise RuntimeError("ORCA optimization crashed")
-    #if "ORCA TERMINATED NORMALLY" not in opt_result.stdout:
-     #   raise RuntimeError("ORCA optimization did not terminate normally")
-    #if "OPTIMIZATION HAS CONVERGED" not in opt_result.stdout:
-     #   print("[WARNING] ORCA optimization did not fully converge")
-
-    opt_xyz = qm / "resp_opt.xyz"
-    if not opt_xyz.exists():
-        raise FileNotFoundError("Optimized XYZ not found (resp_opt.xyz)")
-
-    sp_inp = qm / "resp_sp.inp"
-    _write_orca_sp_input(
-        xyz=opt_xyz,
-        out=sp_inp,
-        charge=int(net_charge),
-        mult=multiplicity,
-        nprocs=nprocs,
-    )
-
-    sp_result = _run([orca, str(sp_inp.resolve())], cwd=qm, log_path=log)
-    if sp_result.returncode != 0:
-        raise RuntimeError("ORCA SP crashed")
-    if "ORCA TERMINATED NORMALLY" not in sp_result.stdout:
-        raise RuntimeError("ORCA SP did not terminate normally")
-
-    gbw_path = qm / "resp_sp.gbw"
-    if not gbw_path.exists():
-        raise FileNotFoundError("SP GBW not found (resp_sp.gbw)")
-
-    mkl_result = _run([orca2mkl, "resp_sp", "-molden"], cwd=qm, log_path=log)
-    if mkl_result.returncode != 0:
-        raise RuntimeError("orca_2mkl failed")
-
-    molden = qm / "resp_sp.molden.input"
-    if not molden.exists():
-        raise RuntimeError("Molden file not generated")
-    if molden.stat().st_size == 0:
-        raise RuntimeError("Molden file is empty")
-
-    copied_molden = fit / molden.name
-    copied_molden.write_text(
-        molden.read_text(encoding="utf-8", errors="replace"),
-        encoding="utf-8",
+        log=log,
     )
 
-    if not copied_molden.exists():
-        raise RuntimeError("Molden file missing before RESP")
-
-    resp_charges = _run_multiwfn_resp(
-        molden_path=copied_molden,
-        fitting_dir=fit,
-        log_path=log,
-        multiwfn_exe=multiwfn,
-    )
+    if n_conformers == 1:
+        with default_scheduler().reserve(nprocs, label=resname) as allocation:
+            print(f"[RESP] {resname}: {allocation.nprocs} core(s), maxcore {allocation.maxcore_mb} MB")
+            chains = [_run_qm_chain(xyz, qm, allocation=allocation, **chain)]
+    else:
+        chains = _run_conformer_chains(mol2, atoms, qm, n_conformers, nprocs, resname=resname, chain=chain)
+
+    # The files the fit reads: moldens for Multiwfn, ESP grids for the native fit.
+    fit_inputs = []
+    source = "esp" if backend == "native" else "molden"
+    suffix = "vpot.out" if backend == "native" else "molden.input"
+    for i, result in enumerate(chains):
+        # Conformer files share one name inside their own QM directories.
+        name = result[source].name if len(chains) == 1 else f"conf_{i:02d}.{suffix}"
+        copied = fit / name
+        copied.write_text(result[source].read_text(encoding="utf-8", errors="replace"), encoding="utf-8")
+        if not copied.exists():
+            raise RuntimeError(f"{source} file missing before RESP")
+        fit_inputs.append(copied)
+
+    weights = _conformer_weights([r["energy"] for r in chains])
+
+    if backend == "native":
+        resp_charges = _run_native_resp(
+            mol2=mol2,
+            atoms=atoms,
+            chains=chains,
+            weights=weights,
+            net_charge=int(net_charge),
+            fitting_dir=fit,
+        )
+    else:
+        resp_charges = _run_multiwfn_resp(
+            molden_paths=fit_inputs,
+            fitting_dir=fit,
+            log_path=log,
+            multiwfn_exe=multiwfn,
+            weights=weights,
+        )
 
     if len(resp_charges) != len(atoms):
         raise RuntimeError(
             f"RESP returned {len(resp_charges)} charges, but molecule has {len(atoms)} atoms."
         )
 
+    opt_xyz = chains[0]["opt_xyz"]
     opt_coords = _read_xyz_coordinates(opt_xyz)
     
     if len(opt_coords) != len(atoms):
         raise RuntimeError(
             f"Optimized XYZ has {len(opt_coords)} atoms, but capped MOL2 has {len(atoms)} atoms."
         )
-    
-    
+
+    first = chains[0]
+    # Charges from a fallback run are kept for this residue but never shared.
+    fallback = next((f"{stage}: {reason}" for r in chains for stage, reason in r["fallbacks"].items()), None)
+    qm_meta = {
+        "charge_backend": (
+            "xtb+orca+orca_vpot+native_resp+antechamber_rc"
+            if backend == "native"
+            else "xtb+orca+multiwfn+antechamber_rc"
+        ),
+        "sp_guess": first["sp_guess"],
+        "scf_cycles": first["scf_cycles"],
+        "fallbacks": first["fallbacks"],
+        "charge_fallback": fallback,
+        "geometry": first["geometry"],
+        "resources": first["resources"],
+        "files": {
+            "input_xyz": str(first["input_xyz"]),
+            "xtb_xyz": str(first["xtb_xyz"]),
+            "opt_input": str(first["opt_input"]) if first["opt_input"] else None,
+            "opt_xyz": str(first["opt_xyz"]),
+            "sp_input": str(first["sp_input"]),
+            "sp_gbw": str(first["sp_gbw"]),
+        },
+    }
+    if n_conformers > 1:
+        qm_meta["conformers"] = {
+            "requested": n_conformers,
+            "fitted": len(chains),
+            "weights": weights,
+            "sp_energies": [r["energy"] for r in chains],
+            "scf_cycles": [r["scf_cycles"] for r in chains],
+            "fallbacks": [r["fallbacks"] for r in chains],
+            "geometry": [r["geometry"] for r in chains],
+            "resources": [r["resources"] for r in chains],
+            ("esp_files" if backend == "native" else "moldens"): [str(p) for p in fit_inputs],
+        }
+    return resp_charges, qm_meta, fit_inputs
+
+
+def run_resp_charge_workflow(
+    *,
+    capped_file: str,
+    charged_file: str,
+    resname: str,
+    net_charge: int,
+    residue_dir: str,
+    orca_path: Optional[str] = None,
+    orca_2mkl_path: Optional[str] = None,
+    multiwfn_path: Optional[str] = None,
+    xtb_path: Optional[str] = None,
+    orca_vpot_path: Optional[str] = None,
+) -> dict:
+    """
+    RESP charges for one capped residue. NSAA_RESP_BACKEND selects the fit:
+    ``multiwfn`` (default) drives Multiwfn on a molden export of the single
+    point; ``native`` evaluates the ESP with orca_vpot and fits it in-process.
+
+    With NSAA_QM_CACHE_DIR set, the optimized geometry, fit inputs and
+    charges are shared between runs: a residue with the same geometry,
+    charge, multiplicity and QM settings skips every QM program.
+    """
+    residue_path = Path(residue_dir)
+    qm = residue_path / "resp_qm"
+    fit = residue_path / "resp_fit"
+    qm.mkdir(parents=True, exist_ok=True)
+    fit.mkdir(parents=True, exist_ok=True)
+
+    log = residue_path / f"{resname}_resp.log"
+    log.write_text("", encoding="utf-8")
+    final_mol2 = Path(charged_file).resolve()
+
+    mol2 = Path(capped_file)
+    xyz = qm / "resp_input.xyz"
+    atoms = _write_xyz_from_mol2(mol2, xyz)
+
+    multiplicity = _env_int(
+        "NSAA_RESP_MULTIPLICITY",
+        _guess_multiplicity(str(mol2), int(net_charge)),
+    )
+    backend = _resp_backend()
+    geometry = _geometry_policy()
+    fit_name = "resp_native.json" if backend == "native" else "MultiWfn_raw_outputs.txt"
+
+    cache = _qm_cache()
+    cache_key = None
+    cached = None
+    if cache is not None:
+        cache_key = _qm_cache_key(
+            mol2, atoms, charge=int(net_charge), mult=multiplicity, backend=backend, geometry=geometry
+        )
+        cached = _restore_qm_cache(cache, cache_key, qm=qm, fit=fit)
+
+    if cached is not None:
+        resp_charges, qm_meta, restored = cached
+        print(f"[RESP] QM cache hit for {resname} ({cache_key[:12]})")
+        qm_meta["files"] = {
+            "input_xyz": str(xyz),
+            "opt_xyz": str(restored.get("resp_opt.xyz", "")) or None,
+        }
+        fit_inputs = sorted(p for name, p in restored.items() if name.endswith(".gz"))
+    else:
+        resp_charges, qm_meta, fit_inputs = _run_resp_qm(
+            mol2=mol2,
+            xyz=xyz,
+            atoms=atoms,
+            qm=qm,
+            fit=fit,
+            log=log,
+            resname=resname,
+            net_charge=int(net_charge),
+            multiplicity=multiplicity,
+            backend=backend,
+            geometry=geometry,
+            orca_path=orca_path,
+            orca_2mkl_path=orca_2mkl_path,
+            multiwfn_path=multiwfn_path,
+            xtb_path=xtb_path,
+            orca_vpot_path=orca_vpot_path,
+        )
+        if cache is not None and not qm_meta["charge_fallback"]:
+            files = {"resp_opt.xyz": Path(qm_meta["files"]["opt_xyz"])}
+            files.update({p.name + ".gz": p for p in fit_inputs})
+            if (fit / fit_name).exists():
+                files[fit_name] = fit / fit_name
+            cached_meta = {k: v for k, v in qm_meta.items() if k != "files"}
+            _store_qm_cache(cache, cache_key, charges=resp_charges, qm_meta=cached_meta, files=files, staging=fit)
+
     resp_charge_file = residue_path / f"{resname}_resp.chg"
     _write_antechamber_charge_file(resp_charges, resp_charge_file)
 
@@ -732,22 +1550,25 @@ def run_resp_charge_workflow(
 
     print("RESP pipeline completed successfully")
 
-    return {
+    files = qm_meta.pop("files")
+    meta = {
         "charge_method": "resp",
-        "charge_backend": "xtb+orca+multiwfn+antechamber_rc",
+        "charge_backend": qm_meta.pop("charge_backend"),
         "net_charge": int(net_charge),
         "multiplicity": int(multiplicity),
+        **qm_meta,
         "files": {
             "capped_mol2": str(mol2),
-            "input_xyz": str(xyz),
-            "xtb_xyz": str(xtb_xyz),
-            "opt_input": str(opt_inp),
-            "opt_xyz": str(opt_xyz),
-            "sp_input": str(sp_inp),
-            "sp_gbw": str(gbw_path),
-            "sp_molden": str(copied_molden),
+            **files,
             "resp_charge_file": str(resp_charge_file),
             "final_mol2": str(final_mol2),
             "resp_log": str(log),
         },
     }
+    if fit_inputs:
+        meta["files"]["sp_esp" if backend == "native" else "sp_molden"] = str(fit_inputs[0])
+    if backend == "native":
+        meta["files"]["resp_fit"] = str(fit / fit_name)
+    if cache is not None:
+        meta["qm_cache"] = {"key": cache_key, "hit": cached is not None}
+    return meta
@@ -0,0 +1,259 @@
+from __future__ import annotations
+
+import os
+import shlex
+import signal
+import subprocess
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Callable, Optional
+
+
+# Lines of each stream kept in memory for error messages.
+TAIL_LINES = 200
+
+LineCallback = Callable[[str, str], None]
+
+_POLL_SECONDS = 0.2
+
+# Seconds an aborted tool gets to exit after SIGTERM before SIGKILL.
+_KILL_GRACE = 5.0
+
+
+class RunAborted(RuntimeError):
+    """
+    Raised by an ``on_line`` callback to stop the tool. ``run_streaming``
+    kills the tool's process group and re-raises it with the output tails
+    attached.
+    """
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+        self.stdout = ""
+        self.stderr = ""
+
+
+def fan_out(*callbacks: Optional[LineCallback]) -> LineCallback:
+    """One line callback that calls each of ``callbacks`` in turn."""
+    active = [cb for cb in callbacks if cb is not None]
+
+    def on_line(stream: str, line: str) -> None:
+        for cb in active:
+            cb(stream, line)
+
+    return on_line
+
+
+def _log_cap_bytes() -> int:
+    raw = os.environ.get("NSAA_LOG_MAX_MB", "64")
+    try:
+        return int(float(raw) * 1024 * 1024)
+    except ValueError as exc:
+        raise ValueError(f"Environment variable NSAA_LOG_MAX_MB must be a number, got: {raw}") from exc
+
+
+class _LogSink:
+    """Appends one command's output to a shared log, a line per write, up to a byte cap."""
+
+    def __init__(self, path: Optional[Path], lock: threading.Lock, tag: str, cap: int):
+        self.fh = path.open("a", encoding="utf-8") if path is not None else None
+        self.lock = lock
+        self.tag = f"[{tag}] " if tag else ""
+        self.cap = cap
+        self.written = 0
+        self.truncated = False
+
+    def write(self, text: str) -> None:
+        if self.fh is None:
+            return
+        # Flushed per write so the log can be tailed while the tool runs.
+        with self.lock:
+            self.fh.write(text)
+            self.fh.flush()
+
+    def close(self) -> None:
+        if self.fh is not None:
+            self.fh.close()
+
+    def line(self, prefix: str, line: str) -> None:
+        if self.fh is None or self.truncated:
+            return
+        text = f"{self.tag}{prefix}{line}\n"
+        if self.written + len(text) > self.cap:
+            self.truncated = True
+            text = f"{self.tag}... output truncated after {self.cap // (1024 * 1024)} MB ...\n"
+        self.written += len(text)
+        self.write(text)
+
+
+class _FileTail:
+    """New complete lines of a file another process is writing; restarts when the file is truncated."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.pos = 0
+        self.partial = ""
+
+    def read(self, final: bool = False) -> list[str]:
+        try:
+            size = self.path.stat().st_size
+            if size < self.pos:
+                self.pos, self.partial = 0, ""
+            if size == self.pos and not final:
+                return []
+            with self.path.open("r", encoding="utf-8", errors="replace") as fh:
+                fh.seek(self.pos)
+                chunk = fh.read()
+                self.pos = fh.tell()
+        except OSError:
+            return []
+        lines = (self.partial + chunk).split("\n")
+        self.partial = lines.pop()
+        if final and self.partial:
+            lines.append(self.partial)
+            self.partial = ""
+        return lines
+
+
+def _signal_group(proc: subprocess.Popen, sig: int) -> None:
+    try:
+        os.killpg(proc.pid, sig)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+# =========================
+# RUNNER
+# =========================
+def run_streaming(
+    cmd: list[str],
+    *,
+    cwd: Optional[Path] = None,
+    env: Optional[dict] = None,
+    log_path: Optional[Path] = None,
+    log_lock: Optional[threading.Lock] = None,
+    tag: str = "",
+    on_line: Optional[LineCallback] = None,
+    tail_lines: int = TAIL_LINES,
+    tail_files: Optional[list[Path]] = None,
+) -> subprocess.CompletedProcess:
+    """
+    Run ``cmd`` and stream its output as it is produced: every line goes to
+    ``log_path`` (stderr lines prefixed ``[stderr]``, all lines prefixed with
+    ``tag`` so that jobs sharing a log can be told apart) and to
+    ``on_line(stream, line)`` with stream "stdout" or "stderr". The log entry
+    of one command stops growing at NSAA_LOG_MAX_MB.
+
+    Only the last ``tail_lines`` lines of each stream are kept; they are the
+    ``stdout`` and ``stderr`` of the returned CompletedProcess. Callers that
+    need something from earlier in the output collect it in ``on_line``,
+    which runs on the reader threads.
+
+    Lines appended to ``tail_files`` while the tool runs (output files the
+    tool writes instead of stdout) are passed to ``on_line`` as well, with
+    the file name as stream; they are not copied to the log. An ``on_line``
+    that raises, typically ``RunAborted``, stops the tool and its children.
+    """
+    sink = _LogSink(log_path, log_lock or threading.Lock(), tag, _log_cap_bytes())
+    sink.write(
+        "\n\n=== CMD ===\n"
+        f"{sink.tag}CWD: {cwd}\n"
+        f"{sink.tag}CMD: " + " ".join(shlex.quote(str(x)) for x in cmd) + "\n"
+        "=== OUTPUT ===\n"
+    )
+
+    try:
+        proc = subprocess.Popen(
+            [str(x) for x in cmd],
+            cwd=str(cwd) if cwd else None,
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            errors="replace",
+            bufsize=1,
+            # Own process group, so that an abort also stops MPI workers and other children.
+            start_new_session=True,
+        )
+    except OSError:
+        sink.close()
+        raise
+
+    tails = {"stdout": deque(maxlen=tail_lines), "stderr": deque(maxlen=tail_lines)}
+    errors: list[BaseException] = []
+
+    def pump(stream_name: str, pipe) -> None:
+        prefix = "[stderr] " if stream_name == "stderr" else ""
+        try:
+            for raw in pipe:
+                line = raw.rstrip("\n")
+                tails[stream_name].append(line)
+                sink.line(prefix, line)
+                if on_line is not None:
+                    on_line(stream_name, line)
+        except BaseException as e:
+            errors.append(e)
+            # Keep draining so the child never blocks on a full pipe.
+            for _ in pipe:
+                pass
+        finally:
+            pipe.close()
+
+    readers = [
+        threading.Thread(target=pump, args=("stdout", proc.stdout), daemon=True),
+        threading.Thread(target=pump, args=("stderr", proc.stderr), daemon=True),
+    ]
+    for t in readers:
+        t.start()
+
+    files = [_FileTail(Path(p)) for p in tail_files or []]
+
+    def poll_files(final: bool = False) -> None:
+        for tail in files:
+            for line in tail.read(final):
+                if on_line is not None:
+                    on_line(tail.path.name, line)
+
+    stopped_at: Optional[float] = None
+    try:
+        while True:
+            try:
+                returncode = proc.wait(timeout=_POLL_SECONDS)
+            except subprocess.TimeoutExpired:
+                returncode = None
+            if not errors:
+                try:
+                    poll_files(final=returncode is not None)
+                except Exception as e:
+                    errors.append(e)
+            if returncode is not None:
+                break
+            if errors and stopped_at is None:
+                stopped_at = time.monotonic()
+                _signal_group(proc, signal.SIGTERM)
+            elif stopped_at is not None and time.monotonic() - stopped_at > _KILL_GRACE:
+                _signal_group(proc, signal.SIGKILL)
+    except BaseException:
+        # Interrupted (Ctrl-C, worker shutdown): do not leave the tool running.
+        _signal_group(proc, signal.SIGKILL)
+        raise
+    finally:
+        for t in readers:
+            t.join(timeout=_KILL_GRACE)
+
+    sink.write(f"=== RETURN CODE ===\n{sink.tag}{returncode}\n")
+    stdout = "\n".join(tails["stdout"]) + ("\n" if tails["stdout"] else "")
+    stderr = "\n".join(tails["stderr"]) + ("\n" if tails["stderr"] else "")
+    if errors:
+        error = errors[0]
+        if isinstance(error, RunAborted):
+            sink.write(f"=== ABORTED ===\n{sink.tag}{error.reason}\n")
+            error.stdout, error.stderr = stdout, stderr
+        sink.close()
+        raise error
+    sink.close()
+
+    return subprocess.CompletedProcess(args=cmd, returncode=returncode, stdout=stdout, stderr=stderr)
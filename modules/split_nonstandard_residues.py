@@ -2,12 +2,14 @@ from __future__ import annotations
 
 import json
 import sys
-from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict, Iterable, List, Optional, Set, Tuple
+from typing import Dict, Iterable, List, Optional, Set
 
+from .canonical import canonical_hashes
+from .graph import CSRGraph
+from .mol2 import AtomView, BondView, Mol2Molecule, parse_mol2
 from .utils import (
-    classify_residue_net_charge_from_full_mol2,
+    classify_all_residue_net_charges,
     normalize_resname,
 )
 
@@ -21,89 +23,6 @@ STANDARD_RESIDUES = {
 HIS_VARIANTS = {"HID", "HIE", "HIP"}
 
 
-@dataclass(frozen=True)
-class AtomRec:
-    atom_id: int
-    name: str
-    x: float
-    y: float
-    z: float
-    atom_type: str
-    subst_id: int
-    subst_name: str
-    charge: float
-
-
-@dataclass(frozen=True)
-class BondRec:
-    bond_id: int
-    a1: int
-    a2: int
-    bond_type: str
-
-
-def _parse_sections(mol2_path: str) -> Dict[str, List[str]]:
-    sections: Dict[str, List[str]] = {}
-    current: Optional[str] = None
-
-    with open(mol2_path, "r", encoding="utf-8", errors="replace") as f:
-        for line in f:
-            if line.startswith("@<TRIPOS>"):
-                current = line.strip()
-                sections[current] = []
-                continue
-            if current:
-                sections[current].append(line.rstrip("\n"))
-
-    return sections
-
-
-def _parse_atoms(lines: List[str]) -> List[AtomRec]:
-    atoms: List[AtomRec] = []
-    for line in lines:
-        if not line.strip():
-            continue
-        p = line.split()
-        if len(p) < 8:
-            continue
-
-        charge = float(p[8]) if len(p) > 8 else 0.0
-        atoms.append(
-            AtomRec(
-                atom_id=int(p[0]),
-                name=p[1],
-                x=float(p[2]),
-                y=float(p[3]),
-                z=float(p[4]),
-                atom_type=p[5],
-                subst_id=int(p[6]),
-                subst_name=p[7],
-                charge=charge,
-            )
-        )
-    return atoms
-
-
-def _parse_bonds(lines: List[str]) -> List[BondRec]:
-    bonds: List[BondRec] = []
-    for line in lines:
-        if not line.strip():
-            continue
-        p = line.split()
-        if len(p) < 4:
-            continue
-
-        bonds.append(
-            BondRec(
-                bond_id=int(p[0]),
-                a1=int(p[1]),
-                a2=int(p[2]),
-                bond_type=p[3],
-            )
-        )
-    return bonds
-
-
 def _guess_element(atom_name: str, atom_type: str) -> str:
     at = "".join(ch for ch in str(atom_type or "") if ch.isalpha()).upper()
     nm = "".join(ch for ch in str(atom_name or "") if ch.isalpha()).upper()
@@ -121,38 +40,50 @@ def _guess_element(atom_name: str, atom_type: str) -> str:
     return "C"
 
 
-def _build_graph(bonds: Iterable[BondRec]) -> Dict[int, Set[int]]:
-    g: Dict[int, Set[int]] = {}
-    for b in bonds:
-        g.setdefault(b.a1, set()).add(b.a2)
-        g.setdefault(b.a2, set()).add(b.a1)
-    return g
-
-
-def _shortest_path(graph: Dict[int, Set[int]], start: int, goal: int) -> Optional[List[int]]:
-    if start == goal:
-        return [start]
-
-    queue: List[int] = [start]
-    seen = {start}
-    prev: Dict[int, int] = {}
-    while queue:
-        cur = queue.pop(0)
-        for nxt in graph.get(cur, set()):
-            if nxt in seen:
-                continue
-            seen.add(nxt)
-            prev[nxt] = cur
-            if nxt == goal:
-                out = [goal]
-                walker = goal
-                while walker != start:
-                    walker = prev[walker]
-                    out.append(walker)
-                out.reverse()
-                return out
-            queue.append(nxt)
-    return None
+# =========================
+# WHOLE-STRUCTURE INDEX
+# =========================
+class _AtomsById:
+    """atom_id -> AtomView lookup without materializing a view per atom."""
+
+    __slots__ = ("_mol", "_index")
+
+    def __init__(self, mol: Mol2Molecule):
+        self._mol = mol
+        self._index = mol.index_of_id()
+
+    def __getitem__(self, atom_id: int) -> AtomView:
+        return AtomView(self._mol, self._index[atom_id])
+
+    def __contains__(self, atom_id: object) -> bool:
+        return atom_id in self._index
+
+
+class _StructureIndex:
+    """
+    Everything the splitter needs about the whole structure, built once:
+    atom rows grouped by subst id, bonds split into per-subst internal and
+    boundary lists (see Mol2Molecule.bonds_by_subst) and one global adjacency.
+    """
+
+    def __init__(self, mol: Mol2Molecule):
+        self.mol = mol
+        self.atoms_by_id = _AtomsById(mol)
+        self.subst_ids: List[int] = list(mol.subst_rows)
+
+        self.graph = CSRGraph.from_edges(mol.atom_id, mol.bond_a1, mol.bond_a2)
+
+    def subst_name(self, subst_id: int) -> str:
+        return AtomView(self.mol, int(self.mol.subst_rows[subst_id][0])).subst_name
+
+    def residue_atoms(self, subst_id: int) -> List[AtomView]:
+        return self.mol.residue_atoms(subst_id)
+
+    def internal_bonds(self, subst_id: int) -> List[BondView]:
+        return self.mol.residue_bonds(subst_id)
+
+    def external_bonds(self, subst_id: int) -> List[BondView]:
+        return self.mol.residue_bonds(subst_id, boundary=True)
 
 
 def _dedupe_keep_order(items: Iterable[str]) -> List[str]:
@@ -165,11 +96,11 @@ def _dedupe_keep_order(items: Iterable[str]) -> List[str]:
     return out
 
 
-def _is_carbonyl_like(atom: AtomRec, central_ids: Set[int], by_id: Dict[int, AtomRec], graph: Dict[int, Set[int]]) -> bool:
+def _is_carbonyl_like(atom: AtomView, central_ids: Set[int], by_id: Dict[int, AtomView], graph: CSRGraph) -> bool:
     if _guess_element(atom.name, atom.atom_type) != "C":
         return False
 
-    for nbr_id in graph.get(atom.atom_id, set()):
+    for nbr_id in graph.neighbors_of(atom.atom_id):
         if nbr_id not in central_ids:
             continue
         nbr = by_id[nbr_id]
@@ -179,14 +110,14 @@ def _is_carbonyl_like(atom: AtomRec, central_ids: Set[int], by_id: Dict[int, Ato
     return atom.name.upper() == "C"
 
 
-def _score_head_candidate(atom: AtomRec, central_ids: Set[int], by_id: Dict[int, AtomRec], graph: Dict[int, Set[int]]) -> int:
+def _score_head_candidate(atom: AtomView, central_ids: Set[int], by_id: Dict[int, AtomView], graph: CSRGraph) -> int:
     score = 0
     if atom.name.upper() == "N":
         score += 10
     if _guess_element(atom.name, atom.atom_type) == "N":
         score += 5
 
-    for nbr_id in graph.get(atom.atom_id, set()):
+    for nbr_id in graph.neighbors_of(atom.atom_id):
         if nbr_id not in central_ids:
             continue
         nbr = by_id[nbr_id]
@@ -198,7 +129,7 @@ def _score_head_candidate(atom: AtomRec, central_ids: Set[int], by_id: Dict[int,
     return score
 
 
-def _score_tail_candidate(atom: AtomRec, central_ids: Set[int], by_id: Dict[int, AtomRec], graph: Dict[int, Set[int]]) -> int:
+def _score_tail_candidate(atom: AtomView, central_ids: Set[int], by_id: Dict[int, AtomView], graph: CSRGraph) -> int:
     score = 0
     if atom.name.upper() == "C":
         score += 10
@@ -210,24 +141,21 @@ def _score_tail_candidate(atom: AtomRec, central_ids: Set[int], by_id: Dict[int,
 
 
 def _infer_polymer_connection_atoms(
-    residue_atoms: List[AtomRec],
-    all_atoms_by_id: Dict[int, AtomRec],
-    all_bonds: List[BondRec],
+    residue_atoms: List[AtomView],
+    all_atoms_by_id: _AtomsById,
+    boundary_bonds: List[BondView],
+    all_graph: CSRGraph,
 ) -> tuple[Optional[str], Optional[str], List[dict]]:
+    """``boundary_bonds`` are the bonds with exactly one end in the residue."""
     central_ids = {a.atom_id for a in residue_atoms}
-    all_graph = _build_graph(all_bonds)
     by_id = all_atoms_by_id
 
     external_bonds: List[dict] = []
     head_candidates: List[tuple[int, str]] = []
     tail_candidates: List[tuple[int, str]] = []
 
-    for bond in all_bonds:
+    for bond in boundary_bonds:
         in_a1 = bond.a1 in central_ids
-        in_a2 = bond.a2 in central_ids
-        if in_a1 == in_a2:
-            continue
-
         central_id = bond.a1 if in_a1 else bond.a2
         external_id = bond.a2 if in_a1 else bond.a1
 
@@ -261,19 +189,17 @@ def _infer_polymer_connection_atoms(
 
 
 def _infer_main_chain(
-    residue_atoms: List[AtomRec],
-    all_bonds: List[BondRec],
+    residue_atoms: List[AtomView],
+    residue_bonds: List[BondView],
     head_name: Optional[str],
     tail_name: Optional[str],
 ) -> Optional[List[str]]:
     if not head_name or not tail_name:
         return None
 
-    central_ids = {a.atom_id for a in residue_atoms}
-    central_bonds = [b for b in all_bonds if b.a1 in central_ids and b.a2 in central_ids]
-    graph = _build_graph(central_bonds)
+    graph = CSRGraph.from_bonds((a.atom_id for a in residue_atoms), residue_bonds)
     by_name: Dict[str, List[int]] = {}
-    by_id: Dict[int, AtomRec] = {a.atom_id: a for a in residue_atoms}
+    by_id: Dict[int, AtomView] = {a.atom_id: a for a in residue_atoms}
 
     for atom in residue_atoms:
         by_name.setdefault(atom.name, []).append(atom.atom_id)
@@ -281,7 +207,7 @@ def _infer_main_chain(
     if head_name not in by_name or tail_name not in by_name:
         return None
 
-    path = _shortest_path(graph, by_name[head_name][0], by_name[tail_name][0])
+    path = graph.shortest_path(by_name[head_name][0], by_name[tail_name][0])
     if not path or len(path) < 3:
         return None
 
@@ -294,8 +220,8 @@ def _infer_main_chain(
 def _write_residue_mol2(
     output_file: Path,
     resname: str,
-    residue_atoms: List[AtomRec],
-    residue_bonds: List[BondRec],
+    residue_atoms: List[AtomView],
+    residue_bonds: List[BondView],
 ) -> None:
     atom_ids = {a.atom_id for a in residue_atoms}
     id_map = {old: new for new, old in enumerate(sorted(atom_ids), start=1)}
@@ -323,7 +249,7 @@ def _write_residue_mol2(
         f.write(f"1 {resname} 1\n")
 
 
-def _candidate_rank(meta: dict, residue_atoms: List[AtomRec], residue_bonds: List[BondRec]) -> tuple[int, int, int, int]:
+def _candidate_rank(meta: dict, residue_atoms: List[AtomView], residue_bonds: List[BondView]) -> tuple[int, int, int, int]:
     has_head = 1 if meta.get("head_name") else 0
     has_tail = 1 if meta.get("tail_name") else 0
     has_both = 1 if has_head and has_tail else 0
@@ -331,42 +257,37 @@ def _candidate_rank(meta: dict, residue_atoms: List[AtomRec], residue_bonds: Lis
 
 
 def extract_nonstandard_residues_from_mol2(input_mol2: str, output_dir: str) -> List[str]:
-    sections = _parse_sections(input_mol2)
-    atoms = _parse_atoms(sections.get("@<TRIPOS>ATOM", []))
-    bonds = _parse_bonds(sections.get("@<TRIPOS>BOND", []))
+    mol = parse_mol2(input_mol2, keep_text=False)
 
-    if not atoms:
+    if not len(mol.atom_id):
         raise ValueError(f"No atoms parsed from MOL2 file: {input_mol2}")
 
     out = Path(output_dir)
     out.mkdir(parents=True, exist_ok=True)
 
     std = STANDARD_RESIDUES | HIS_VARIANTS
-    residues: Dict[int, List[AtomRec]] = {}
-    atoms_by_id: Dict[int, AtomRec] = {a.atom_id: a for a in atoms}
+    index = _StructureIndex(mol)
 
-    for atom in atoms:
-        residues.setdefault(atom.subst_id, []).append(atom)
+    candidates = [(subst_id, normalize_resname(index.subst_name(subst_id))) for subst_id in index.subst_ids]
+    candidates = [(subst_id, resname) for subst_id, resname in candidates if resname not in std]
+    full_charges = classify_all_residue_net_charges(mol, [subst_id for subst_id, _ in candidates])
 
     selected_by_resname: Dict[str, dict] = {}
+    # graph hash -> subst ids, per resname; and resnames per graph hash.
+    graphs_by_resname: Dict[str, Dict[str, List[int]]] = {}
+    resnames_by_graph: Dict[str, Set[str]] = {}
 
-    for subst_id in sorted(residues):
-        residue_atoms = residues[subst_id]
-        raw_name = residue_atoms[0].subst_name
-        resname = normalize_resname(raw_name)
-
-        if resname in std:
-            continue
-
-        central_ids = {a.atom_id for a in residue_atoms}
-        residue_bonds = [b for b in bonds if b.a1 in central_ids and b.a2 in central_ids]
+    for subst_id, resname in candidates:
+        residue_atoms = index.residue_atoms(subst_id)
+        residue_bonds = index.internal_bonds(subst_id)
 
         head_name, tail_name, external_bonds = _infer_polymer_connection_atoms(
             residue_atoms,
-            atoms_by_id,
-            bonds,
+            index.atoms_by_id,
+            index.external_bonds(subst_id),
+            index.graph,
         )
-        main_chain = _infer_main_chain(residue_atoms, bonds, head_name, tail_name)
+        main_chain = _infer_main_chain(residue_atoms, residue_bonds, head_name, tail_name)
 
         is_polymer_internal = bool(head_name and tail_name)
         is_n_terminal_like = bool(tail_name and not head_name)
@@ -383,11 +304,10 @@ def extract_nonstandard_residues_from_mol2(input_mol2: str, output_dir: str) ->
         elif is_c_terminal_like:
             topology = "c_term_like"
 
-        full_charge, full_charge_source = classify_residue_net_charge_from_full_mol2(
-            input_mol2,
-            target_subst_id=subst_id,
-            target_resname=resname,
-        )
+        full_charge, full_charge_source = full_charges[subst_id]
+        graph_hash, graph_hash_stereo = canonical_hashes(residue_atoms, residue_bonds)
+        graphs_by_resname.setdefault(resname, {}).setdefault(graph_hash, []).append(int(subst_id))
+        resnames_by_graph.setdefault(graph_hash, set()).add(resname)
 
         meta = {
             "resname": resname,
@@ -407,6 +327,8 @@ def extract_nonstandard_residues_from_mol2(input_mol2: str, output_dir: str) ->
             "topology": topology,
             "full_context_net_charge": int(full_charge) if full_charge is not None else None,
             "full_context_charge_source": full_charge_source,
+            "graph_hash": graph_hash,
+            "graph_hash_stereo": graph_hash_stereo,
         }
 
         rank = _candidate_rank(meta, residue_atoms, residue_bonds)
@@ -442,6 +364,26 @@ def extract_nonstandard_residues_from_mol2(input_mol2: str, output_dir: str) ->
         residue_bonds = selected["residue_bonds"]
         meta = selected["meta"]
 
+        other_graphs = {
+            h: ids for h, ids in graphs_by_resname[resname].items() if h != meta["graph_hash"]
+        }
+        if other_graphs:
+            # Copies that are not the same molecule (terminal variants, differently
+            # protonated or simply unrelated residues) cannot share one template.
+            meta["graph_hash_conflicts"] = [
+                {"graph_hash": h, "subst_ids": ids} for h, ids in sorted(other_graphs.items())
+            ]
+            print(
+                f"[{resname}] warning: {len(other_graphs) + 1} different residue graphs share this name; "
+                f"kept subst_id {selected['subst_id']}, skipped subst_ids "
+                f"{sorted(i for ids in other_graphs.values() for i in ids)}"
+            )
+
+        same_graph = sorted(resnames_by_graph[meta["graph_hash"]] - {resname})
+        if same_graph:
+            meta["same_graph_as"] = same_graph
+            print(f"[{resname}] note: same residue graph as {', '.join(same_graph)}")
+
         output_file = out / f"{resname}.mol2"
         meta_file = out / f"{resname}.split.json"
 
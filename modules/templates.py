@@ -0,0 +1,297 @@
+from __future__ import annotations
+
+import json
+import re
+import shutil
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from modules.canonical import canonical_form
+from modules.mol2 import parse_mol2
+from modules.result_cache import ResultCache
+from modules.utils import normalize_resname
+
+
+# Name of each stored file inside a template entry.
+CHARGED_MOL2 = "charged.mol2"
+CAPPED_MOL2 = "residue_capped.mol2"
+PREPIN = "residue.prepin"
+BACKBONE_FRCMOD = "backbone.frcmod"
+SIDECHAIN_FRCMOD = "sidechain.frcmod"
+LIB = "residue.lib"
+RESIDUE_META = "residue_meta.json"
+CAPPING_META = "residue_capping_meta.json"
+
+
+def _renamed_resname(name: str, old_resname: str, new_resname: str) -> str:
+    # Keeps numeric suffixes such as the "1" of a MOL2 substructure "AIB1".
+    if normalize_resname(name) != old_resname:
+        return name
+    return new_resname + name[len(old_resname):] if name.upper().startswith(old_resname) else new_resname
+
+
+def _retoken(line: str, rename, fields: Optional[set] = None) -> str:
+    """
+    Rename whitespace-separated tokens of a fixed-column line, keeping the
+    columns after each renamed token where the new name fits.
+    """
+    out = []
+    pos = 0
+    carry = 0
+    for i, m in enumerate(re.finditer(r"\S+", line)):
+        gap = line[pos : m.start()]
+        if carry:
+            gap = gap[min(carry, len(gap) - 1) :] if gap else gap
+            carry = 0
+        token = m.group(0)
+        new = rename(token) if fields is None or i in fields else token
+        if len(new) > len(token):
+            carry = len(new) - len(token)
+        elif len(new) < len(token):
+            new = new.ljust(len(token))
+        out.append(gap + new)
+        pos = m.end()
+    out.append(line[pos:])
+    return "".join(out)
+
+
+# =========================
+# RENAMING
+# =========================
+def capped_name_mapping(
+    stored: Path,
+    new: Path,
+    old_resname: str,
+    new_resname: str,
+) -> Optional[Dict[str, Dict[str, str]]]:
+    """
+    Atom renaming {stored residue: {stored name: new name}} that carries a
+    stored capped residue onto a new capping of the same molecule. Capping
+    renames re-added hydrogens and cap atoms after the input's names, so the
+    mapping pairs atoms of the two whole capped molecules by canonical order.
+
+    None when the two are not the same stereo graph, are too symmetric to
+    order, pair central atoms with cap atoms, or would give a residue
+    duplicate atom names.
+    """
+    old_mol, new_mol = parse_mol2(stored), parse_mol2(new)
+    old_form = canonical_form(list(old_mol.atoms), old_mol.bonds)
+    new_form = canonical_form(list(new_mol.atoms), new_mol.bonds)
+    if (
+        old_form.atom_order is None
+        or new_form.atom_order is None
+        or old_form.stereo_hash != new_form.stereo_hash
+        or len(old_form.atom_order) != len(new_form.atom_order)
+    ):
+        return None
+
+    old_atoms = {a.atom_id: a for a in old_mol.atoms}
+    new_atoms = {a.atom_id: a for a in new_mol.atoms}
+    mapping: Dict[str, Dict[str, str]] = {}
+    for i, j in zip(old_form.atom_order, new_form.atom_order):
+        a, b = old_atoms[i], new_atoms[j]
+        old_res, new_res = normalize_resname(a.subst_name), normalize_resname(b.subst_name)
+        if (old_res == old_resname) != (new_res == new_resname) or (old_res != old_resname and old_res != new_res):
+            return None
+        names = mapping.setdefault(old_res, {})
+        if a.name in names:
+            return None
+        names[a.name] = b.name
+
+    if any(len(set(names.values())) != len(names) for names in mapping.values()):
+        return None
+    return mapping
+
+
+def rename_mol2(src: Path, dst: Path, mapping: Dict[str, Dict[str, str]], old_resname: str, new_resname: str) -> None:
+    """
+    Copy a charged MOL2, renaming atoms per residue ({residue: {old: new}})
+    and the substructure of the central residue.
+    """
+    mol = parse_mol2(src)
+    for i, (name, subst) in enumerate(zip(mol.name.tolist(), mol.subst_name.tolist())):
+        residue = normalize_resname(subst)
+        names = mapping.get(residue, {})
+        if residue != old_resname:
+            if name in names:
+                mol.set_atom(i, name=names[name])
+            continue
+        mol.set_atom(
+            i,
+            name=names.get(name, name),
+            subst_name=_renamed_resname(subst, old_resname, new_resname),
+        )
+
+    lines = mol.to_text().split("\n")
+    section = None
+    for k, line in enumerate(lines):
+        if line.startswith("@<TRIPOS>"):
+            section = line.strip()
+            continue
+        if section == "@<TRIPOS>MOLECULE" and k > 0 and lines[k - 1].startswith("@<TRIPOS>MOLECULE"):
+            lines[k] = _renamed_resname(line.strip(), old_resname, new_resname)
+        elif section == "@<TRIPOS>SUBSTRUCTURE" and line.strip():
+            lines[k] = _retoken(line, lambda t: _renamed_resname(t, old_resname, new_resname), {1})
+    dst.write_text("\n".join(lines), encoding="utf-8")
+
+
+def rename_prepin(text: str, mapping: Dict[str, str], old_resname: str, new_resname: str) -> str:
+    """Rename atoms and the residue of a prepgen PREPIN (atom table, LOOP and IMPROPER blocks)."""
+    atom_line = re.compile(r"^\s*\d+\s+\S+\s+\S+\s+[A-Z0-9]\s+-?\d+\s+-?\d+\s+-?\d+\s")
+    lines = text.split("\n")
+    block = None
+    for k, line in enumerate(lines):
+        stripped = line.strip()
+        if re.match(r"^\S+\s+INT\s+\d+", stripped) and stripped.split()[0].upper() == old_resname:
+            lines[k] = _retoken(line, lambda t: new_resname, {0})
+        elif stripped in {"LOOP", "IMPROPER"}:
+            block = stripped
+        elif not stripped or stripped in {"DONE", "STOP", "CHARGE"}:
+            block = None
+        elif block is not None:
+            lines[k] = _retoken(line, lambda t: mapping.get(t, t))
+        elif atom_line.match(line):
+            lines[k] = _retoken(line, lambda t: mapping.get(t, t), {1})
+    return "\n".join(lines)
+
+
+def rename_off(text: str, mapping: Dict[str, Dict[str, str]], old_resname: str, new_resname: str) -> str:
+    """
+    Rename a tleap OFF library: the unit, the central residue, and the atoms
+    (and per-atom info) of every residue, per residue ({residue: {old: new}}).
+    """
+    lines = text.split("\n")
+
+    # Residue table first: the atom table refers to residues by position.
+    residue_at: Dict[int, str] = {}
+    table = None
+    seq = 0
+    for line in lines:
+        if line.startswith("!"):
+            table = line.split()[0]
+            seq = 0
+            continue
+        if table is not None and table.endswith(".unit.residues"):
+            seq += 1
+            m = re.match(r'\s*"([^"]*)"', line)
+            if m:
+                residue_at[seq] = normalize_resname(m.group(1))
+
+    def quoted(line: str, rename) -> str:
+        return re.sub(r'^(\s*)"([^"]*)"', lambda m: f'{m.group(1)}"{rename(m.group(2))}"', line, count=1)
+
+    renamed_rows: Dict[int, Dict[str, str]] = {}
+    table = None
+    row = 0
+    for k, line in enumerate(lines):
+        if line.startswith("!"):
+            head = line.split()[0]
+            table = head
+            row = 0
+            if head.startswith(f"!entry.{old_resname}."):
+                lines[k] = line.replace(f"!entry.{old_resname}.", f"!entry.{new_resname}.", 1)
+            continue
+        if table is None:
+            continue
+        row += 1
+        if table == "!!index" or table.endswith(".unit.name"):
+            lines[k] = quoted(line, lambda s: new_resname if s == old_resname else s)
+        elif table.endswith(".unit.residues"):
+            lines[k] = quoted(line, lambda s: _renamed_resname(s, old_resname, new_resname))
+        elif table.endswith(".unit.atoms"):
+            fields = re.findall(r'"[^"]*"|\S+', line)
+            if len(fields) >= 4 and fields[3].lstrip("-").isdigit():
+                names = mapping.get(residue_at.get(int(fields[3]), ""), {})
+                renamed_rows[row] = names
+                lines[k] = quoted(line, lambda s: names.get(s, s))
+        elif table.endswith(".unit.atomspertinfo") and row in renamed_rows:
+            names = renamed_rows[row]
+            lines[k] = quoted(line, lambda s: names.get(s, s))
+    return "\n".join(lines)
+
+
+# =========================
+# LIBRARY
+# =========================
+class TemplateLibrary:
+    """
+    Finished residues (charged MOL2, PREPIN, frcmods, OFF library) keyed by
+    canonical graph and run settings, on top of ``ResultCache``.
+
+    Each entry keeps the capped residue its files were made from; a new
+    residue with the same key gets the files renamed atom for atom onto its
+    own capping (see ``capped_name_mapping``).
+    """
+
+    def __init__(self, root: str | Path, max_bytes: Optional[int] = None):
+        self.cache = ResultCache(root, max_bytes=max_bytes)
+
+    def store(
+        self,
+        key: str,
+        *,
+        resname: str,
+        atom_names: List[str],
+        files: Dict[str, Path],
+    ) -> Optional[Path]:
+        present = {name: path for name, path in files.items() if path.exists()}
+        try:
+            return self.cache.put(key, present, info={"resname": resname, "atom_names": list(atom_names)})
+        except OSError as e:
+            print(f"[{resname}] warning: could not store residue template: {e}")
+            return None
+
+    def restore(
+        self,
+        key: str,
+        *,
+        residue_dir: Path,
+        resname: str,
+        capped_file: Path,
+        outputs: Dict[str, Path],
+    ) -> Optional[dict]:
+        """
+        Write the files of entry ``key``, renamed onto ``capped_file`` (the
+        new residue's capping), to ``outputs`` ({stored name: destination}).
+        Returns the entry info plus its stored residue meta, or None on a
+        miss or when the atoms cannot be matched.
+        """
+        entry = self.cache.get(key)
+        if entry is None:
+            return None
+
+        try:
+            info = json.loads((entry / "entry.json").read_text(encoding="utf-8"))
+            old_resname = normalize_resname(info.get("resname"))
+            if not (entry / CAPPED_MOL2).exists():
+                return None
+            mapping = capped_name_mapping(entry / CAPPED_MOL2, capped_file, old_resname, resname)
+            if mapping is None:
+                return None
+
+            for name, dst in outputs.items():
+                src = entry / name
+                if not src.exists():
+                    continue
+                if name == CHARGED_MOL2:
+                    rename_mol2(src, dst, mapping, old_resname, resname)
+                elif name == PREPIN:
+                    text = src.read_text(encoding="utf-8", errors="replace")
+                    dst.write_text(
+                        rename_prepin(text, mapping.get(old_resname, {}), old_resname, resname), encoding="utf-8"
+                    )
+                elif name == LIB:
+                    text = src.read_text(encoding="utf-8", errors="replace")
+                    dst.write_text(rename_off(text, mapping, old_resname, resname), encoding="utf-8")
+                else:
+                    shutil.copyfile(src, dst)
+
+            stored_meta = {}
+            if (entry / RESIDUE_META).exists():
+                stored_meta = json.loads((entry / RESIDUE_META).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            # Entry evicted or half-written by another process; treat as a miss.
+            return None
+
+        info["residue_meta"] = stored_meta
+        return info
@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+
+import numpy as np
+
+from .graph import CSRGraph
+from .mol2 import Mol2Source, require_atoms
+
+
+# sp2 centres that get an improper dihedral: Sybyl, Amber and GAFF spellings.
+_SP2_SYBYL_TYPES = {"C.2", "C.AR", "C.CAT", "N.AR", "N.AM", "N.PL3", "N.2"}
+_SP2_AMBER_TYPES = {"C", "CA", "CB", "CC", "CD", "CK", "CM", "CN", "CQ", "CR", "CV", "CW", "C*", "N", "NA", "N*", "N2"}
+_SP2_GAFF_TYPES = {"c", "c2", "ca", "cc", "cd", "ce", "cf", "cp", "cq", "n", "na", "nh", "ne", "nf"}
+
+
+def _is_sp2_type(atom_type: str) -> bool:
+    t = str(atom_type or "").strip()
+    if "." in t:
+        return t.upper() in _SP2_SYBYL_TYPES
+    return t in _SP2_AMBER_TYPES or t in _SP2_GAFF_TYPES
+
+
+# =========================
+# TOPOLOGY
+# =========================
+@dataclass(frozen=True)
+class Topology:
+    """
+    Bonded terms of one molecule as int64 arrays of 1-based atom serials
+    (MOL2 atoms ordered by atom id), each sorted row-wise:
+
+    - bonds (n, 2), i < j
+    - angles (n, 3) i-j-k with centre j, i < k
+    - dihedrals (n, 4) proper i-j-k-l, oriented so that i < l
+    - pairs (n, 2) 1-4 pairs that are not also 1-2 or 1-3
+    - impropers (n, 4) n1-n2-centre-n3 for three-connected sp2 centres
+    """
+
+    bonds: np.ndarray
+    angles: np.ndarray
+    dihedrals: np.ndarray
+    pairs: np.ndarray
+    impropers: np.ndarray
+
+
+def _neighbor_rows(graph: CSRGraph, rows: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """(owner position in ``rows``, neighbor row) for every neighbor of every row."""
+    start = graph.offsets[rows]
+    count = graph.offsets[rows + 1] - start
+    owner = np.repeat(np.arange(len(rows)), count)
+    within = np.arange(int(count.sum())) - np.repeat(np.cumsum(count) - count, count)
+    return owner, graph.neighbors[np.repeat(start, count) + within].astype(np.int64)
+
+
+def _unique_rows(arr: np.ndarray) -> np.ndarray:
+    if not len(arr):
+        return arr
+    arr = arr[np.lexsort(arr.T[::-1])]
+    keep = np.concatenate([[True], np.any(arr[1:] != arr[:-1], axis=1)])
+    return arr[keep]
+
+
+def _angles(graph: CSRGraph) -> np.ndarray:
+    deg = graph.degrees()
+    out = [np.zeros((0, 3), dtype=np.int64)]
+    for d in np.flatnonzero(np.bincount(deg)).tolist():
+        if d < 2:
+            continue
+        centers = np.flatnonzero(deg == d)
+        nbr = graph.neighbors[graph.offsets[centers][:, None] + np.arange(d)].astype(np.int64)
+        a, b = np.triu_indices(d, 1)
+        out.append(
+            np.stack(
+                [nbr[:, a].ravel(), np.repeat(centers, len(a)), nbr[:, b].ravel()],
+                axis=1,
+            )
+        )
+    return _unique_rows(np.concatenate(out))
+
+
+def _dihedrals(graph: CSRGraph, bonds: np.ndarray) -> np.ndarray:
+    if not len(bonds):
+        return np.zeros((0, 4), dtype=np.int64)
+    j, k = bonds[:, 0], bonds[:, 1]
+
+    left_b, left_i = _neighbor_rows(graph, j)
+    keep = left_i != k[left_b]
+    left_b, left_i = left_b[keep], left_i[keep]
+
+    right_b, right_l = _neighbor_rows(graph, k)
+    keep = right_l != j[right_b]
+    right_b, right_l = right_b[keep], right_l[keep]
+
+    # Every left neighbor of a bond against every right neighbor of the same bond.
+    right_count = np.bincount(right_b, minlength=len(bonds))
+    right_start = np.cumsum(right_count) - right_count
+    reps = right_count[left_b]
+    left_idx = np.repeat(np.arange(len(left_b)), reps)
+    within = np.arange(int(reps.sum())) - np.repeat(np.cumsum(reps) - reps, reps)
+    bond_of = left_b[left_idx]
+    quad = np.stack(
+        [left_i[left_idx], j[bond_of], k[bond_of], right_l[right_start[bond_of] + within]],
+        axis=1,
+    )
+    quad = quad[quad[:, 0] != quad[:, 3]]
+
+    flip = quad[:, 0] > quad[:, 3]
+    quad[flip] = quad[flip, ::-1]
+    return _unique_rows(quad)
+
+
+def _pair_keys(pairs: np.ndarray, n: int) -> np.ndarray:
+    return np.minimum(pairs[:, 0], pairs[:, 1]) * n + np.maximum(pairs[:, 0], pairs[:, 1])
+
+
+def build_topology(mol2_path: Mol2Source) -> Topology:
+    mol = require_atoms(mol2_path)
+    order = np.argsort(mol.atom_id, kind="stable")
+    graph = CSRGraph.from_edges(mol.atom_id[order], mol.bond_a1, mol.bond_a2)
+    n = len(order)
+
+    deg = graph.degrees()
+    src = np.repeat(np.arange(n), deg)
+    dst = graph.neighbors.astype(np.int64)
+    bonds = np.stack([src, dst], axis=1)[src < dst]
+    angles = _angles(graph)
+    dihedrals = _dihedrals(graph, bonds)
+
+    pairs = _unique_rows(np.sort(dihedrals[:, [0, 3]], axis=1))
+    if len(pairs):
+        excluded = np.sort(np.concatenate([_pair_keys(bonds, n), _pair_keys(angles[:, [0, 2]], n)]))
+        keys = _pair_keys(pairs, n)
+        if len(excluded):
+            hit = excluded[np.minimum(np.searchsorted(excluded, keys), len(excluded) - 1)] == keys
+            pairs = pairs[~hit]
+
+    types = mol.atom_type[order].tolist()
+    sp2_of = {t: _is_sp2_type(t) for t in set(types)}
+    sp2 = np.array([sp2_of[t] for t in types], dtype=bool)
+    centers = np.flatnonzero((deg == 3) & sp2)
+    nbr = graph.neighbors[graph.offsets[centers][:, None] + np.arange(3)].astype(np.int64)
+    impropers = np.stack([nbr[:, 0], nbr[:, 1], centers, nbr[:, 2]], axis=1).reshape(-1, 4)
+
+    return Topology(
+        bonds=bonds + 1,
+        angles=angles + 1,
+        dihedrals=dihedrals + 1,
+        pairs=pairs.reshape(-1, 2) + 1,
+        impropers=impropers + 1,
+    )
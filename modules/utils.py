@@ -1,25 +1,14 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
+import hashlib
 from pathlib import Path
 import re
 from typing import Dict, Iterable, List, Optional, Set, Tuple
 
+import numpy as np
 
-@dataclass(frozen=True)
-class AtomRec:
-    atom_id: int
-    name: str
-    atype: str
-    charge: float
-    subst_name: str = ""
-
-
-@dataclass(frozen=True)
-class BondRec:
-    a1: int
-    a2: int
-    btype: str
+from modules.graph import CSRGraph
+from modules.mol2 import AtomRec, BondRec, Mol2Molecule, Mol2Source, as_molecule, require_atoms
 
 
 def normalize_resname(raw: str) -> str:
@@ -172,60 +161,51 @@ def get_mass(atom_type: str) -> float:
     return masses.get(str(atom_type).upper(), 12.011)
 
 
-def _parse_mol2_atoms(mol2_path: str) -> List[AtomRec]:
-    atoms: List[AtomRec] = []
-    in_atoms = False
-    with open(mol2_path, "r", encoding="utf-8", errors="replace") as f:
-        for line in f:
-            s = line.strip()
-            if s.startswith("@<TRIPOS>ATOM"):
-                in_atoms = True
-                continue
-            if s.startswith("@<TRIPOS>") and in_atoms:
-                break
-            if not in_atoms or not s:
-                continue
-            parts = line.split()
-            if len(parts) < 8:
-                continue
-            charge = float(parts[8]) if len(parts) >= 9 else 0.0
-            subst_name = parts[7] if len(parts) >= 8 else ""
-            atoms.append(AtomRec(int(parts[0]), parts[1], parts[5], charge, subst_name))
-    if not atoms:
-        raise ValueError(f"No atoms parsed from MOL2: {mol2_path}")
-    return atoms
-
-
-def _parse_mol2_bonds_with_types(mol2_path: str) -> List[BondRec]:
-    bonds: List[BondRec] = []
-    in_bonds = False
-    with open(mol2_path, "r", encoding="utf-8", errors="replace") as f:
-        for line in f:
-            s = line.strip()
-            if s.startswith("@<TRIPOS>BOND"):
-                in_bonds = True
-                continue
-            if s.startswith("@<TRIPOS>") and in_bonds:
-                break
-            if not in_bonds or not s:
-                continue
-            parts = line.split()
-            if len(parts) < 4:
-                continue
-            bonds.append(BondRec(int(parts[1]), int(parts[2]), parts[3]))
-    return bonds
+def _parse_mol2_atoms(mol2: Mol2Source) -> List[AtomRec]:
+    return list(require_atoms(mol2).atoms)
 
 
-def _parse_mol2_bonds(mol2_path: str) -> List[Tuple[int, int]]:
-    return [(b.a1, b.a2) for b in _parse_mol2_bonds_with_types(mol2_path)]
+def _parse_mol2_bonds_with_types(mol2: Mol2Source) -> List[BondRec]:
+    return list(as_molecule(mol2).bonds)
 
 
-def extract_charges(mol2_path: str) -> List[float]:
+def mol2_residue_digest(mol2_path: Mol2Source, include_coordinates: bool = True) -> str:
+    """
+    Order-independent sha256 of a MOL2 residue: atom names, types and elements,
+    bonds (by atom name, with bond type) and optionally coordinates rounded to
+    1e-3 A. Two exports of the same residue with shuffled atom order hash equal.
+    """
+    mol = as_molecule(mol2_path)
+    atoms = _parse_mol2_atoms(mol)
+    bonds = _parse_mol2_bonds_with_types(mol)
+    by_id = {a.atom_id: a for a in atoms}
+
+    atom_rows = []
+    for a in atoms:
+        row = [a.name.strip(), a.atype, _guess_element(a.name, a.atype)]
+        if include_coordinates:
+            row.extend(f"{v:.3f}" for v in (a.x, a.y, a.z))
+        atom_rows.append("|".join(row))
+
+    bond_rows = []
+    for b in bonds:
+        a1 = by_id.get(b.a1)
+        a2 = by_id.get(b.a2)
+        if a1 is None or a2 is None:
+            continue
+        n1, n2 = sorted((a1.name.strip(), a2.name.strip()))
+        bond_rows.append(f"{n1}-{n2}|{str(b.btype).strip().lower()}")
+
+    blob = "\n".join(sorted(atom_rows)) + "\n#\n" + "\n".join(sorted(bond_rows))
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def extract_charges(mol2_path: Mol2Source) -> List[float]:
     atoms = sorted(_parse_mol2_atoms(mol2_path), key=lambda a: a.atom_id)
     return [a.charge for a in atoms]
 
 
-def get_atomtypes(mol2_path: str):
+def get_atomtypes(mol2_path: Mol2Source):
     atoms = sorted(_parse_mol2_atoms(mol2_path), key=lambda a: a.atom_id)
     atom_dicts = [{"id": a.atom_id, "name": a.name, "type": a.atype} for a in atoms]
     unique_types = sorted({a.atype for a in atoms})
@@ -233,13 +213,8 @@ def get_atomtypes(mol2_path: str):
     return atom_dicts, atomtypes_block
 
 
-def _build_graph(num_atoms: int, bonds: List[Tuple[int, int]]) -> Dict[int, Set[int]]:
-    g: Dict[int, Set[int]] = {i: set() for i in range(1, num_atoms + 1)}
-    for a, b in bonds:
-        if a in g and b in g:
-            g[a].add(b)
-            g[b].add(a)
-    return g
+def _build_graph(atoms: List[AtomRec], bonds: List[Tuple[int, int]]) -> CSRGraph:
+    return CSRGraph.from_pairs((a.atom_id for a in atoms), bonds)
 
 
 def _build_neighbor_bonds(bonds: Iterable[BondRec]) -> Dict[int, List[Tuple[int, BondRec]]]:
@@ -250,32 +225,6 @@ def _build_neighbor_bonds(bonds: Iterable[BondRec]) -> Dict[int, List[Tuple[int,
     return out
 
 
-def _shortest_path_ids(graph: Dict[int, Set[int]], start: int, goal: int) -> Optional[List[int]]:
-    if start == goal:
-        return [start]
-
-    queue: List[int] = [start]
-    seen = {start}
-    prev: Dict[int, int] = {}
-    while queue:
-        cur = queue.pop(0)
-        for nxt in graph.get(cur, set()):
-            if nxt in seen:
-                continue
-            seen.add(nxt)
-            prev[nxt] = cur
-            if nxt == goal:
-                out = [goal]
-                walker = goal
-                while walker != start:
-                    walker = prev[walker]
-                    out.append(walker)
-                out.reverse()
-                return out
-            queue.append(nxt)
-    return None
-
-
 def _atomic_number(element: str) -> int:
     return _ATOMIC_NUMBERS.get(element.upper(), 0)
 
@@ -414,7 +363,7 @@ def _infer_backbone_atom_ids(
     bonds: List[BondRec],
     central_resname: str,
 ) -> Set[int]:
-    graph = _build_graph(len(atoms), [(b.a1, b.a2) for b in bonds])
+    graph = _build_graph(atoms, [(b.a1, b.a2) for b in bonds])
     by_id = {a.atom_id: a for a in atoms}
     central_atoms = [a for a in atoms if normalize_resname(a.subst_name) == central_resname]
     central_ids = {a.atom_id for a in central_atoms}
@@ -450,7 +399,7 @@ def _infer_backbone_atom_ids(
 
     backbone_ids: Set[int] = set()
     if head_ids and tail_ids:
-        path = _shortest_path_ids(graph, head_ids[0], tail_ids[0])
+        path = graph.shortest_path(head_ids[0], tail_ids[0])
         if path:
             backbone_ids.update(i for i in path if i in central_ids)
 
@@ -464,7 +413,7 @@ def _infer_backbone_atom_ids(
         atom = by_id[atom_id]
         if atom.name.upper() != "C" and _element_upper(atom) != "C":
             continue
-        for nbr_id in graph.get(atom_id, set()):
+        for nbr_id in graph.neighbors_of(atom_id):
             if nbr_id not in central_ids:
                 continue
             nbr = by_id[nbr_id]
@@ -478,9 +427,11 @@ def _sidechain_charge_for_amino_acid_like(
     atoms: List[AtomRec],
     bonds: List[BondRec],
     central_resname: str,
+    nbrs: Optional[Dict[int, List[Tuple[int, BondRec]]]] = None,
 ) -> tuple[int, List[str]]:
     by_id = {a.atom_id: a for a in atoms}
-    nbrs = _build_neighbor_bonds(bonds)
+    if nbrs is None:
+        nbrs = _build_neighbor_bonds(bonds)
     central_atoms = [a for a in atoms if normalize_resname(a.subst_name) == central_resname]
     central_ids = {a.atom_id for a in central_atoms}
     backbone_ids = _infer_backbone_atom_ids(atoms, bonds, central_resname)
@@ -522,9 +473,10 @@ def _sidechain_charge_for_amino_acid_like(
     return charge, reasons
 
 
-def estimate_net_charge(mol2_path: str) -> tuple[Optional[int], str]:
-    atoms = _parse_mol2_atoms(mol2_path)
-    bonds = _parse_mol2_bonds_with_types(mol2_path)
+def estimate_net_charge(mol2_path: Mol2Source) -> tuple[Optional[int], str]:
+    mol = as_molecule(mol2_path)
+    atoms = _parse_mol2_atoms(mol)
+    bonds = _parse_mol2_bonds_with_types(mol)
     by_id = {a.atom_id: a for a in atoms}
     nbrs = _build_neighbor_bonds(bonds)
 
@@ -566,18 +518,19 @@ def estimate_net_charge(mol2_path: str) -> tuple[Optional[int], str]:
     return charge, f"heuristic({';'.join(reasons)})"
 
 
-def detect_formal_charge_from_mol2(mol2_path: str) -> Optional[int]:
+def detect_formal_charge_from_mol2(mol2_path: Mol2Source) -> Optional[int]:
     charge, _ = estimate_net_charge(mol2_path)
     return charge
 
 
-def classify_residue_net_charge(mol2_path: str, resname: Optional[str] = None) -> tuple[Optional[int], str]:
+def classify_residue_net_charge(mol2_path: Mol2Source, resname: Optional[str] = None) -> tuple[Optional[int], str]:
     norm_resname = normalize_resname(resname or "")
     if norm_resname in STANDARD_RESIDUE_CHARGES:
         return STANDARD_RESIDUE_CHARGES[norm_resname], "known_residue_table"
 
-    atoms = _parse_mol2_atoms(mol2_path)
-    bonds = _parse_mol2_bonds_with_types(mol2_path)
+    mol = as_molecule(mol2_path)
+    atoms = _parse_mol2_atoms(mol)
+    bonds = _parse_mol2_bonds_with_types(mol)
     central_resname = _infer_central_residue_name(atoms)
 
     if central_resname in STANDARD_RESIDUE_CHARGES:
@@ -593,41 +546,30 @@ def classify_residue_net_charge(mol2_path: str, resname: Optional[str] = None) -
             return charge, f"amino_acid_sidechain({';'.join(reasons)})"
         return 0, "amino_acid_like_neutral_backbone"
 
-    charge, reason = estimate_net_charge(mol2_path)
+    charge, reason = estimate_net_charge(mol)
     return charge, reason
 
 
 def classify_residue_net_charge_from_full_mol2(
-    mol2_path: str,
+    mol2_path: Mol2Source,
     *,
     target_subst_id: Optional[int] = None,
     target_resname: Optional[str] = None,
 ) -> tuple[Optional[int], str]:
-    atoms = _parse_mol2_atoms(mol2_path)
-    bonds = _parse_mol2_bonds_with_types(mol2_path)
+    mol = as_molecule(mol2_path)
+    atoms = _parse_mol2_atoms(mol)
+    bonds = _parse_mol2_bonds_with_types(mol)
 
     if target_subst_id is not None:
-        selected_atoms = [a for a in atoms if str(a.subst_name).strip() and normalize_resname(a.subst_name) == normalize_resname(target_resname or a.subst_name)]
-        selected_atoms = [a for a in selected_atoms if True]
-        # Prefer exact subst id when available from the original file.
-        exact = []
-        with open(mol2_path, "r", encoding="utf-8", errors="replace") as f:
-            in_atoms = False
-            for line in f:
-                s = line.strip()
-                if s.startswith("@<TRIPOS>ATOM"):
-                    in_atoms = True
-                    continue
-                if s.startswith("@<TRIPOS>") and in_atoms:
-                    break
-                if not in_atoms or not s:
-                    continue
-                parts = line.split()
-                if len(parts) < 8:
-                    continue
-                if int(parts[6]) == int(target_subst_id):
-                    exact.append(AtomRec(int(parts[0]), parts[1], parts[5], float(parts[8]) if len(parts) >= 9 else 0.0, parts[7]))
-        selected_atoms = exact if exact else selected_atoms
+        # Prefer the exact subst id; fall back to matching the residue name.
+        exact = np.flatnonzero(mol.subst_id == int(target_subst_id))
+        if exact.size:
+            selected_atoms = [atoms[i] for i in exact.tolist()]
+        else:
+            selected_atoms = [
+                a for a in atoms
+                if str(a.subst_name).strip() and normalize_resname(a.subst_name) == normalize_resname(target_resname or a.subst_name)
+            ]
     else:
         selected_atoms = [a for a in atoms if normalize_resname(a.subst_name) == normalize_resname(target_resname or "")]
 
@@ -638,23 +580,69 @@ def classify_residue_net_charge_from_full_mol2(
     central_ids = {a.atom_id for a in selected_atoms}
     relevant_atoms = [a for a in atoms if a.atom_id in central_ids]
     relevant_bonds = [b for b in bonds if b.a1 in central_ids and b.a2 in central_ids]
+    return _classify_full_context_residue(relevant_atoms, relevant_bonds, central_resname)
 
-    backbone_ids = _infer_backbone_atom_ids(relevant_atoms, relevant_bonds, central_resname)
-    amino_acid_like = bool(backbone_ids) or bool({a.name.upper() for a in selected_atoms} & {"N", "CA", "C"})
+
+def classify_all_residue_net_charges(
+    mol2_path: Mol2Source,
+    subst_ids: Optional[Iterable[int]] = None,
+) -> Dict[int, tuple[Optional[int], str]]:
+    """
+    Full-context net charge of every residue (or only ``subst_ids``) of a
+    structure in one pass: ``{subst_id: (charge, source)}``, with the same
+    answers as classify_residue_net_charge_from_full_mol2 per exact subst id.
+
+    Atoms and bonds are grouped by subst id once and all residues share one
+    neighbor index built from their internal bonds.
+    """
+    mol = as_molecule(mol2_path)
+    wanted = list(mol.subst_rows) if subst_ids is None else [int(s) for s in subst_ids]
+
+    residues: Dict[int, tuple[List[AtomRec], List[BondRec]]] = {}
+    for sid in wanted:
+        atoms = mol.residue_atoms(sid)
+        if atoms:
+            residues[sid] = (atoms, mol.residue_bonds(sid))
+    nbrs = _build_neighbor_bonds(b for _, bonds in residues.values() for b in bonds)
+
+    out: Dict[int, tuple[Optional[int], str]] = {}
+    for sid in wanted:
+        if sid not in residues:
+            out[sid] = (None, "target_residue_not_found")
+            continue
+        atoms, bonds = residues[sid]
+        out[sid] = _classify_full_context_residue(atoms, bonds, normalize_resname(atoms[0].subst_name), nbrs)
+    return out
+
+
+def _classify_full_context_residue(
+    atoms: List[AtomRec],
+    bonds: List[BondRec],
+    central_resname: str,
+    nbrs: Optional[Dict[int, List[Tuple[int, BondRec]]]] = None,
+) -> tuple[Optional[int], str]:
+    """``bonds`` (and ``nbrs``, if shared) must only hold bonds internal to residues."""
+    backbone_ids = _infer_backbone_atom_ids(atoms, bonds, central_resname)
+    amino_acid_like = bool(backbone_ids) or bool({a.name.upper() for a in atoms} & {"N", "CA", "C"})
 
     if amino_acid_like:
-        charge, reasons = _sidechain_charge_for_amino_acid_like(relevant_atoms, relevant_bonds, central_resname)
+        charge, reasons = _sidechain_charge_for_amino_acid_like(atoms, bonds, central_resname, nbrs)
         if reasons:
             return charge, f"full_context_amino_acid_sidechain({';'.join(reasons)})"
         return 0, "full_context_amino_acid_neutral_backbone"
 
-    charge, reason = estimate_net_charge_for_subgraph(relevant_atoms, relevant_bonds)
+    charge, reason = estimate_net_charge_for_subgraph(atoms, bonds, nbrs)
     return charge, f"full_context_{reason}"
 
 
-def estimate_net_charge_for_subgraph(atoms: List[AtomRec], bonds: List[BondRec]) -> tuple[int, str]:
+def estimate_net_charge_for_subgraph(
+    atoms: List[AtomRec],
+    bonds: List[BondRec],
+    nbrs: Optional[Dict[int, List[Tuple[int, BondRec]]]] = None,
+) -> tuple[int, str]:
     by_id = {a.atom_id: a for a in atoms}
-    nbrs = _build_neighbor_bonds(bonds)
+    if nbrs is None:
+        nbrs = _build_neighbor_bonds(bonds)
     charge = 0
     reasons: List[str] = []
 
@@ -690,25 +678,26 @@ def estimate_net_charge_for_subgraph(atoms: List[AtomRec], bonds: List[BondRec])
     return charge, f"heuristic({';'.join(reasons)})"
 
 
-def electron_count_for_charge(mol2_path: str, charge: int) -> int:
+def electron_count_for_charge(mol2_path: Mol2Source, charge: int) -> int:
     atoms = _parse_mol2_atoms(mol2_path)
     total_atomic_number = sum(_atomic_number(_guess_element(a.name, a.atype)) for a in atoms)
     return total_atomic_number - int(charge)
 
 
-def adjust_charge_for_even_electrons(mol2_path: str, proposed_charge: int) -> tuple[int, bool]:
+def adjust_charge_for_even_electrons(mol2_path: Mol2Source, proposed_charge: int) -> tuple[int, bool]:
     electrons = electron_count_for_charge(mol2_path, int(proposed_charge))
     if electrons % 2 == 0:
         return int(proposed_charge), False
     return int(proposed_charge), False
 
 
-def validate_molecule(mol2_path: str, expected_charge: Optional[int] = None) -> List[str]:
+def validate_molecule(mol2_path: Mol2Source, expected_charge: Optional[int] = None) -> List[str]:
     warnings: List[str] = []
-    atoms = _parse_mol2_atoms(mol2_path)
-    bonds = _parse_mol2_bonds_with_types(mol2_path)
+    mol = as_molecule(mol2_path)
+    atoms = _parse_mol2_atoms(mol)
+    bonds = _parse_mol2_bonds_with_types(mol)
     if not atoms:
-        raise ValueError(f"No atoms found in {mol2_path}")
+        raise ValueError(f"No atoms found in {mol.label}")
 
     atom_names = [a.name.strip() for a in atoms]
     if len(atom_names) != len(set(atom_names)):
@@ -718,16 +707,7 @@ def validate_molecule(mol2_path: str, expected_charge: Optional[int] = None) ->
     if long_names:
         warnings.append(f"Amber atom-name limit exceeded for: {', '.join(sorted(set(long_names)))}")
 
-    graph = _build_graph(len(atoms), [(b.a1, b.a2) for b in bonds])
-    seen: Set[int] = set()
-    stack = [atoms[0].atom_id]
-    while stack:
-        cur = stack.pop()
-        if cur in seen:
-            continue
-        seen.add(cur)
-        stack.extend(n for n in graph.get(cur, set()) if n not in seen)
-    if len(seen) != len(atoms):
+    if not _build_graph(atoms, [(b.a1, b.a2) for b in bonds]).is_connected():
         warnings.append("Molecule graph is disconnected.")
 
     if expected_charge is not None:
@@ -741,8 +721,13 @@ def validate_molecule(mol2_path: str, expected_charge: Optional[int] = None) ->
     return warnings
 
 
-def renormalize_mol2_partial_charges_to_integer(mol2_path: str, target_integer_charge: int) -> bool:
-    charges = extract_charges(mol2_path)
+def renormalize_mol2_partial_charges_to_integer(mol2_path: Mol2Source, target_integer_charge: int) -> bool:
+    """
+    Spread the difference to ``target_integer_charge`` evenly over all atoms.
+    A path is rewritten in place; a parsed molecule is only edited in memory.
+    """
+    mol = as_molecule(mol2_path)
+    charges = [a.charge for a in _parse_mol2_atoms(mol)]
     current_sum = float(sum(charges))
     diff = float(target_integer_charge) - current_sum
 
@@ -750,138 +735,37 @@ def renormalize_mol2_partial_charges_to_integer(mol2_path: str, target_integer_c
         return False
 
     per_atom = diff / float(len(charges))
-    lines = Path(mol2_path).read_text(encoding="utf-8", errors="replace").splitlines()
-    new_lines: List[str] = []
-
-    in_atoms = False
-    atom_seen = 0
-    for line in lines:
-        s = line.strip()
-        if s.startswith("@<TRIPOS>ATOM"):
-            in_atoms = True
-            new_lines.append(line)
-            continue
-        if s.startswith("@<TRIPOS>") and in_atoms and not s.startswith("@<TRIPOS>ATOM"):
-            in_atoms = False
-            new_lines.append(line)
-            continue
-
-        if in_atoms and s:
-            parts = line.split()
-            if len(parts) >= 9:
-                atom_seen += 1
-                q = float(parts[-1]) + per_atom
-                parts[-1] = f"{q:.6f}"
-                new_lines.append(" ".join(parts))
-                continue
-
-        new_lines.append(line)
-
-    if atom_seen != len(charges):
-        raise RuntimeError(
-            f"Charge renorm mismatch: saw {atom_seen} atom lines but parsed {len(charges)} charges."
-        )
+    for idx, atom in enumerate(mol.atoms):
+        if len(mol.atom_parts(idx)) < 9:
+            raise RuntimeError(
+                f"Charge renorm mismatch: atom {atom.atom_id} in {mol.label} has no charge column."
+            )
+        mol.set_atom(idx, charge=atom.charge + per_atom)
 
-    Path(mol2_path).write_text("\n".join(new_lines) + "\n", encoding="utf-8")
+    if not isinstance(mol2_path, Mol2Molecule):
+        mol.write()
     return True
 
 
-def get_bonds_angles_dihedrals(mol2_path: str):
-    atoms = sorted(_parse_mol2_atoms(mol2_path), key=lambda a: a.atom_id)
-    bonds = _parse_mol2_bonds(mol2_path)
-    g = _build_graph(len(atoms), bonds)
-
-    bond_lines = [f"{a:>5} {b:>5} 1" for a, b in sorted({tuple(sorted(x)) for x in bonds})]
-
-    angles_set: Set[Tuple[int, int, int]] = set()
-    for j in range(1, len(atoms) + 1):
-        neigh = sorted(g[j])
-        for idx_i in range(len(neigh)):
-            for idx_k in range(idx_i + 1, len(neigh)):
-                i = neigh[idx_i]
-                k = neigh[idx_k]
-                angles_set.add((i, j, k) if i < k else (k, j, i))
-    angle_lines = [f"{i:>5} {j:>5} {k:>5} 1" for (i, j, k) in sorted(angles_set)]
-
-    dihed_set: Set[Tuple[int, int, int, int]] = set()
-    for j, k in sorted({tuple(sorted(b)) for b in bonds}):
-        for i in g[j]:
-            if i == k:
-                continue
-            for l in g[k]:
-                if l == j or l == i:
-                    continue
-                tup = (i, j, k, l)
-                rev = (l, k, j, i)
-                dihed_set.add(tup if tup < rev else rev)
-
-    dihed_lines = [f"{i:>5} {j:>5} {k:>5} {l:>5} 1" for (i, j, k, l) in sorted(dihed_set)]
-    return bond_lines, angle_lines, dihed_lines
-
-
-def get_impropers(mol2_path: str):
-    return []
+_BACKBONE_ATOM_TYPES = {"CA": "CX", "N": "N", "C": "C", "O": "O"}
 
 
-def get_pairs(dihedrals: List[str]) -> List[str]:
-    pairs: Set[Tuple[int, int]] = set()
-    for d in dihedrals:
-        parts = d.split()
-        if len(parts) < 4:
-            continue
-        i = int(parts[0])
-        l = int(parts[3])
-        a, b = (i, l) if i < l else (l, i)
-        pairs.add((a, b))
-    return [f"{a:>5} {b:>5} 1" for (a, b) in sorted(pairs)]
-
-
-def fix_backbone_atom_types(mol2_path: str) -> bool:
-    lines = Path(mol2_path).read_text(encoding="utf-8", errors="replace").splitlines()
-    new_lines: List[str] = []
-    in_atoms = False
+def fix_backbone_atom_types(mol2_path: Mol2Source) -> bool:
+    """
+    Force Amber backbone types on N/CA/C/O. A path is rewritten in place when
+    something changed; a parsed molecule is only edited in memory.
+    """
+    mol = as_molecule(mol2_path)
     changed = False
 
-    for line in lines:
-        s = line.strip()
-
-        if s.startswith("@<TRIPOS>ATOM"):
-            in_atoms = True
-            new_lines.append(line)
-            continue
-
-        if s.startswith("@<TRIPOS>") and in_atoms:
-            in_atoms = False
-            new_lines.append(line)
-            continue
-
-        if in_atoms and s:
-            parts = line.split()
-            if len(parts) >= 6:
-                atom_name = parts[1].strip().upper()
-                atom_type = parts[5]
-                new_type = atom_type
-
-                if atom_name == "CA":
-                    new_type = "CX"
-                elif atom_name == "N":
-                    new_type = "N"
-                elif atom_name == "C":
-                    new_type = "C"
-                elif atom_name == "O":
-                    new_type = "O"
-
-                if new_type != atom_type:
-                    parts[5] = new_type
-                    changed = True
-
-                new_lines.append(" ".join(parts))
-                continue
-
-        new_lines.append(line)
+    for idx, atom in enumerate(mol.atoms):
+        new_type = _BACKBONE_ATOM_TYPES.get(atom.name.strip().upper())
+        if new_type is not None and new_type != atom.atype:
+            mol.set_atom(idx, atype=new_type)
+            changed = True
 
-    if changed:
-        Path(mol2_path).write_text("\n".join(new_lines) + "\n", encoding="utf-8")
+    if changed and not isinstance(mol2_path, Mol2Molecule):
+        mol.write()
     return changed
 
 